@@ -203,3 +203,71 @@ AUTHENTICATION_BACKENDS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Shared cache for the entitlement, manual TOC and home catalog caches
+# below. Use one (REDIS_URL) whenever more than one worker process serves
+# requests: their invalidations only reach other workers through it, and
+# with the process-local default they are cached briefly or not at all.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
+# Rendered markdown cache (books.utils.markdown_processor). Set CACHE_ALIAS to
+# a shared cache (e.g. 'default' backed by Redis) to reuse renders across workers.
+MARKDOWN_RENDER_CACHE = {
+    'MAX_BYTES': int(os.getenv('MARKDOWN_RENDER_CACHE_BYTES', 64 * 1024 * 1024)),
+    'CACHE_ALIAS': os.getenv('MARKDOWN_RENDER_CACHE_ALIAS') or None,
+    'TIMEOUT': 60 * 60 * 24,
+}
+
+# Highlighted code fragments (books.utils.highlighting), keyed by code,
+# language and style.
+MARKDOWN_HIGHLIGHT_CACHE = {
+    'MAX_BYTES': int(os.getenv('MARKDOWN_HIGHLIGHT_CACHE_BYTES', 16 * 1024 * 1024)),
+    'CACHE_ALIAS': os.getenv('MARKDOWN_RENDER_CACHE_ALIAS') or None,
+    'TIMEOUT': 60 * 60 * 24 * 7,
+}
+
+# Pygments options for code blocks. Keep NOCLASSES off so code is emitted
+# with CSS classes styled by /books/highlight.css; changing any of these
+# changes the content hash, so run rerender_content afterwards.
+MARKDOWN_CODEHILITE = {
+    'STYLE': os.getenv('MARKDOWN_CODEHILITE_STYLE', 'default'),
+    'NOCLASSES': False,
+    'CSS_CLASS': 'codehilite',
+    'GUESS_LANG': True,
+}
+
+# PostgreSQL text search configuration for /books/search/ (books.search).
+# 'simple' doesn't stem, so it works for any language.
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'simple')
+
+# Cached per-user unlocked book ids (books.entitlements). Never cached in a
+# process-local cache: a revoked access would stay readable on other workers.
+ENTITLEMENT_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60 * 60 * 24,
+    'LOCAL_TIMEOUT': None,
+}
+
+# Cached manual TOC trees per book (books.utils.toc). Not cached in a
+# process-local cache: other workers would keep serving an edited TOC.
+MANUAL_TOC_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60 * 60 * 24,
+    'LOCAL_TIMEOUT': None,
+}
+
+# Public home catalog snapshot (books.utils.catalog). MAX_AGE is how long
+# clients and proxies may reuse it before revalidating with its ETag. In a
+# process-local cache it is kept for MAX_AGE only, since other workers
+# don't see its invalidation when a book is published, hidden or deleted.
+HOME_CATALOG_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60 * 60 * 24,
+    'LOCAL_TIMEOUT': 60,
+    'MAX_AGE': 60,
+}
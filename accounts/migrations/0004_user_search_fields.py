@@ -0,0 +1,75 @@
+# Generated by Django 4.2.2 on 2026-10-17 01:06
+
+import re
+import unicodedata
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+# Frozen copies of accounts.models.normalize_search_text / phone_digits as
+# of this migration, so later changes to them don't change what it does
+def normalize_search_text(value, max_length):
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())[:max_length]
+
+
+def phone_digits(value):
+    return re.sub(r'\D', '', value or '')[:15]
+
+
+def fill_search_fields(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    users = list(User.objects.only('pk', 'name', 'email', 'phone'))
+    for user in users:
+        user.search_name = normalize_search_text(user.name, 150)
+        user.search_email = normalize_search_text(user.email, 254)
+        user.search_phone = phone_digits(user.phone)
+    User.objects.bulk_update(users, ['search_name', 'search_email', 'search_phone'], batch_size=1000)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Trigram indexes make name substring/similarity search indexed on
+    # PostgreSQL; other databases scan the normalized column
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS accounts_user_search_name_trgm '
+        'ON accounts_user USING GIN (search_name gin_trgm_ops)'
+    )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS accounts_user_search_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_remove_user_is_paid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='search_email',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='search_name',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='search_phone',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=15),
+        ),
+        migrations.RunPython(fill_search_fields, migrations.RunPython.noop),
+        # No-op on databases other than PostgreSQL
+        TrigramExtension(),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
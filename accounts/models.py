@@ -1,6 +1,21 @@
+import re
+import unicodedata
+
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
 
+
+def normalize_search_text(value):
+    """Case-folded, accent-stripped text with whitespace collapsed."""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def phone_digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
         if not email:
@@ -26,11 +41,34 @@ class User(AbstractUser):
     name = models.CharField(max_length=150)
     phone = models.CharField(max_length=15, blank=True, null=True)
     is_blocked = models.BooleanField(default=False)
+    # Normalized copies of name/email/phone for the admin user search
+    # (accounts.search), maintained on save
+    search_name = models.CharField(max_length=150, blank=True, default='', editable=False, db_index=True)
+    search_email = models.CharField(max_length=254, blank=True, default='', editable=False, db_index=True)
+    search_phone = models.CharField(max_length=15, blank=True, default='', editable=False, db_index=True)
+
+    SEARCH_SOURCES = {'name': 'search_name', 'email': 'search_email', 'phone': 'search_phone'}
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []  
 
     objects = UserManager()
 
+    def save(self, *args, **kwargs):
+        search_values = {
+            'search_name': normalize_search_text(self.name),
+            'search_email': normalize_search_text(self.email),
+            'search_phone': phone_digits(self.phone),
+        }
+        for column, value in search_values.items():
+            # Normalizing can lengthen text ('ß' -> 'ss', decomposed accents)
+            setattr(self, column, value[:self._meta.get_field(column).max_length])
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            touched = [self.SEARCH_SOURCES[field] for field in update_fields if field in self.SEARCH_SOURCES]
+            if touched:
+                kwargs['update_fields'] = set(update_fields) | set(touched)
+        super().save(*args, **kwargs)
+
     def __str__(self):
-        return self.email
\ No newline at end of file
+        return self.email
@@ -0,0 +1,63 @@
+"""
+Admin user search over the normalized search_* columns of User.
+
+Email and phone digits match by prefix (B-tree indexes), names by substring
+and, on PostgreSQL, by trigram word similarity (GIN pg_trgm index, see
+migration 0004), so typos still find the user. Results are ranked: exact
+email, email prefix, phone prefix, name prefix, then the other matches.
+"""
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import User, normalize_search_text, phone_digits
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Shorter digit runs would match most phone numbers
+MIN_PHONE_DIGITS = 3
+
+# Without registering django.contrib.postgres as an app
+User._meta.get_field('search_name').register_lookup(TrigramWordSimilar)
+
+
+def uses_trigram_search() -> bool:
+    return connections[User.objects.db].vendor == 'postgresql'
+
+
+def _match_condition(text: str, digits: str) -> Q:
+    condition = Q(search_email__startswith=text) | Q(search_name__contains=text)
+    if len(digits) >= MIN_PHONE_DIGITS:
+        condition |= Q(search_phone__startswith=digits)
+    if uses_trigram_search():
+        condition |= Q(search_name__trigram_word_similar=text)
+    return condition
+
+
+def search_users(query: str, limit: int = DEFAULT_LIMIT, queryset=None):
+    """The best limit matches of query among queryset (all users by default)."""
+    if queryset is None:
+        queryset = User.objects.all()
+    text = normalize_search_text(query)
+    if not text:
+        return queryset.none()
+    digits = phone_digits(query)
+
+    ranks = [
+        When(search_email=text, then=Value(0)),
+        When(search_email__startswith=text, then=Value(1)),
+    ]
+    if len(digits) >= MIN_PHONE_DIGITS:
+        ranks.append(When(search_phone__startswith=digits, then=Value(2)))
+    ranks.append(When(search_name__startswith=text, then=Value(3)))
+    ordering = ['search_rank']
+    if uses_trigram_search():
+        queryset = queryset.annotate(name_similarity=TrigramWordSimilarity(text, 'search_name'))
+        ordering.append('-name_similarity')
+    ordering += ['search_name', 'id']
+
+    results = queryset.filter(_match_condition(text, digits)).annotate(
+        search_rank=Case(*ranks, default=Value(4), output_field=IntegerField()),
+    ).order_by(*ordering)
+    return results[:max(1, min(limit, MAX_LIMIT))]
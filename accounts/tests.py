@@ -1,3 +1,95 @@
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from books.models import Book
+from .models import User
+from .search import search_users
 
-# Create your tests here.
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(email='root@example.com', password='pass', name='Admin',
+                                              is_staff=True, is_superuser=True)
+        self.jose = User.objects.create_user(email='jose@example.com', password='pass', name='José  Álvarez',
+                                             phone='+1 (555) 010-2030')
+        self.joseph = User.objects.create_user(email='joseph@example.com', password='pass', name='Joseph Smith')
+        self.ana = User.objects.create_user(email='ana@example.org', password='pass', name='Ana Joseline',
+                                            phone='555-777')
+
+    def emails(self, query, **kwargs):
+        return [user.email for user in search_users(query, **kwargs)]
+
+    def test_normalized_columns_follow_saves(self):
+        self.assertEqual((self.jose.search_name, self.jose.search_phone), ('jose alvarez', '15550102030'))
+        self.jose.name = 'Pepe'
+        self.jose.save(update_fields=['name'])
+        self.jose.refresh_from_db()
+        self.assertEqual(self.jose.search_name, 'pepe')
+
+    def test_normalized_columns_fit_their_length(self):
+        # Case folding 'ß' and decomposing ligatures like 'ﬁ' lengthen the text
+        user = User.objects.create_user(email='long@example.com', password='pass', name='ß' * 150)
+        self.assertEqual(user.search_name, 's' * 150)
+        user.name = 'ﬁ' * 150
+        user.save(update_fields=['name'])
+        user.refresh_from_db()
+        self.assertEqual(user.search_name, 'fi' * 75)
+
+    def test_ranked_prefix_and_substring_matches(self):
+        self.assertEqual(self.emails('JOSE'), ['jose@example.com', 'joseph@example.com', 'ana@example.org'])
+        self.assertEqual(self.emails('jose@example.com'), ['jose@example.com'])
+        self.assertEqual(self.emails('alvarez'), ['jose@example.com'])
+        self.assertEqual(self.emails('1 555 01'), ['jose@example.com'])
+        self.assertEqual(self.emails('jose', limit=1), ['jose@example.com'])
+        self.assertEqual(self.emails('   '), [])
+
+    def test_admin_search_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        res = client.get(reverse('admin-user-search'), {'q': 'jose', 'limit': 2})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([user['email'] for user in res.data], ['jose@example.com', 'joseph@example.com'])
+        self.assertIn('book_access_count', res.data[0])
+        self.assertEqual(client.get(reverse('admin-user-search')).status_code, 400)
+
+    def test_user_list_search_matches_substrings(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        for search, email in (('smith', 'joseph@example.com'), ('example.org', 'ana@example.org'),
+                              ('010-2030', 'jose@example.com')):
+            res = client.get(reverse('admin-user-list'), {'search': search})
+            self.assertEqual([user['email'] for user in res.data['results']], [email])
+
+
+class HomeCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title='Published', author='A', description='D', is_published=True)
+        Book.objects.create(title='Draft', author='A', description='D', is_published=False)
+
+    def test_snapshot_served_with_etag_and_revalidated(self):
+        url = reverse('home')
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['total_books'], 1)
+        self.assertEqual(res.json()['books'][0]['title'], 'Published')
+        self.assertIn('public', res['Cache-Control'])
+        etag = res['ETag']
+
+        with self.assertNumQueries(0):
+            res = self.client.get(url)
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+
+        self.book.title = 'Renamed'
+        self.book.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(res.json()['books'][0]['title'], 'Renamed')
+
+        self.book.delete()
+        self.assertEqual(self.client.get(url).json()['total_books'], 0)
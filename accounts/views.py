@@ -3,9 +3,10 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from .serializers import RegisterSerializer, LoginSerializer, get_tokens_for_user, UserProfileSerializer
-from books.models import Book
-from books.serializers import BookListSerializer
+from books.utils.catalog import get_home_snapshot
+from books.utils.http import conditional_response
 from rest_framework import permissions
+from django.conf import settings
 from django.http import JsonResponse
 
 
@@ -59,16 +60,18 @@ class LoginView(APIView):
 
 
 class HomeView(APIView):
+    """
+    Public catalog, served from a snapshot rebuilt when books change
+    (books.utils.catalog), with ETag revalidation.
+    """
     permission_classes = [permissions.AllowAny]
 
     def get(self, request):
-        books = Book.objects.filter(is_published=True)
-        serializer = BookListSerializer(books, many=True)
-        return Response({
-            "message": "Welcome to BookReader API",
-            "total_books": books.count(),
-            "books": serializer.data
-        }, status=status.HTTP_200_OK)
+        snapshot = get_home_snapshot()
+        return conditional_response(
+            request, snapshot['content'], snapshot['etag'], 'application/json',
+            public=True, max_age=settings.HOME_CATALOG_CACHE.get('MAX_AGE', 60),
+        )
 
 
 class ProfileView(APIView):
@@ -1,29 +1,47 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from books.models import Book, Chapter, YouTubeLink, TableOfContentEntry, BookAccess, BookContent
+from books.utils.content_tree import get_content_children
+from books.utils.loaders import BatchListSerializer, get_loader
 import json
 
 User = get_user_model()
 
 
 class UserListSerializer(serializers.ModelSerializer):
-    """Serializer for listing users with their book access information."""
+    """Serializer for listing users with their most recent book accesses."""
     book_access_count = serializers.SerializerMethodField()
-    book_accesses = serializers.SerializerMethodField()
+    recent_book_accesses = serializers.SerializerMethodField()
+    
+    # Accesses shown per user; the full list is on the detail endpoint
+    RECENT_ACCESS_LIMIT = 5
     
     class Meta:
         model = User
         fields = ['id', 'email', 'name', 'phone', 'is_blocked', 'is_staff', 'is_superuser', 
-                  'date_joined', 'book_access_count', 'book_accesses']
+                  'date_joined', 'book_access_count', 'recent_book_accesses']
         read_only_fields = ['id', 'date_joined', 'is_staff', 'is_superuser']
+        list_serializer_class = BatchListSerializer
+    
+    def prime_loader(self, loader, users):
+        # Users from UserListView come annotated and prefetched
+        user_ids = [user.pk for user in users if not hasattr(user, 'recent_book_accesses')]
+        if user_ids:
+            loader.prime('user_book_access_count', user_ids)
+            loader.prime('user_book_accesses', user_ids)
     
     def get_book_access_count(self, obj):
-        return BookAccess.objects.filter(user=obj).count()
+        count = getattr(obj, 'book_access_count', None)
+        if count is None:
+            count = get_loader(self.context).load('user_book_access_count', obj.pk)
+        return count
     
-    def get_book_accesses(self, obj):
-        accesses = BookAccess.objects.filter(user=obj).select_related('book')
+    def get_recent_book_accesses(self, obj):
+        accesses = getattr(obj, 'recent_book_accesses', None)
+        if accesses is None:
+            accesses = get_loader(self.context).load('user_book_accesses', obj.pk)
         return [{'book_id': access.book.id, 'book_title': access.book.title, 
-                'unlocked_at': access.unlocked_at} for access in accesses]
+                'unlocked_at': access.unlocked_at} for access in accesses[:self.RECENT_ACCESS_LIMIT]]
 
 
 class UserDetailSerializer(serializers.ModelSerializer):
@@ -67,6 +85,28 @@ class AdminBookSerializer(serializers.ModelSerializer):
                   'content', 'markdown_content', 'toc_position', 'price', 'is_published', 'created_at', 'chapters_count', 
                   'youtube_links_count', 'toc_entries_count', 'users_count']
         read_only_fields = ['id', 'created_at']
+        list_serializer_class = BatchListSerializer
+    
+    # Count field -> loader kind used when the queryset wasn't annotated
+    # (see annotate_book_counts), e.g. for create/update responses
+    COUNT_KINDS = {
+        'chapters_count': 'book_chapters_count',
+        'youtube_links_count': 'book_youtube_links_count',
+        'toc_entries_count': 'book_toc_entries_count',
+        'users_count': 'book_users_count',
+    }
+    
+    def prime_loader(self, loader, books):
+        book_ids = [book.pk for book in books if not hasattr(book, 'chapters_count')]
+        if book_ids:
+            for kind in self.COUNT_KINDS.values():
+                loader.prime(kind, book_ids)
+    
+    def _count(self, obj, field):
+        value = getattr(obj, field, None)
+        if value is None:
+            value = get_loader(self.context).load(self.COUNT_KINDS[field], obj.pk)
+        return value
     
     def to_internal_value(self, data):
         """Override to handle content field before validation."""
@@ -126,16 +166,24 @@ class AdminBookSerializer(serializers.ModelSerializer):
         return {}
     
     def get_chapters_count(self, obj):
-        return obj.chapters.count()
+        return self._count(obj, 'chapters_count')
     
     def get_youtube_links_count(self, obj):
-        return obj.youtube_links.count()
+        return self._count(obj, 'youtube_links_count')
     
     def get_toc_entries_count(self, obj):
-        return obj.toc_entries.count()
+        return self._count(obj, 'toc_entries_count')
     
     def get_users_count(self, obj):
-        return obj.access_records.count()
+        return self._count(obj, 'users_count')
+
+
+class AdminBookListSerializer(AdminBookSerializer):
+    """Admin book list entry: AdminBookSerializer without the content fields."""
+    
+    class Meta(AdminBookSerializer.Meta):
+        fields = [field for field in AdminBookSerializer.Meta.fields
+                  if field not in ('content', 'markdown_content')]
 
 
 class AdminChapterSerializer(serializers.ModelSerializer):
@@ -149,6 +197,19 @@ class AdminChapterSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
+class AdminChapterListSerializer(serializers.ModelSerializer):
+    """Chapter list entry for admin pages: everything but the chapter text."""
+    book_title = serializers.CharField(source='book.title', read_only=True)
+    
+    class Meta:
+        model = Chapter
+        fields = ['id', 'book', 'book_title', 'title', 'order', 'is_preview', 'voice_file', 'word_count']
+        read_only_fields = fields
+    
+    # Columns the fields above read, for QuerySet.only()
+    COLUMNS = ('id', 'book', 'title', 'order', 'is_preview', 'voice_file', 'word_count', 'book__title')
+
+
 class AdminYouTubeLinkSerializer(serializers.ModelSerializer):
     """YouTube link serializer for admin operations."""
     book_title = serializers.CharField(source='book.title', read_only=True)
@@ -159,7 +220,16 @@ class AdminYouTubeLinkSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class AdminTOCEntrySerializer(serializers.ModelSerializer):
+class TreeNodeSerializerMixin:
+    """Rejects a parent inside the node's own subtree (see MaterializedPathModel)."""
+    
+    def validate_parent(self, parent):
+        if parent is not None and self.instance is not None and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError('A node cannot be moved under itself or its descendants.')
+        return parent
+
+
+class AdminTOCEntrySerializer(TreeNodeSerializerMixin, serializers.ModelSerializer):
     """Table of Contents entry serializer for admin operations."""
     book_title = serializers.CharField(source='book.title', read_only=True)
     chapter_title = serializers.CharField(source='chapter.title', read_only=True, allow_null=True)
@@ -172,10 +242,14 @@ class AdminTOCEntrySerializer(serializers.ModelSerializer):
                   'title', 'level', 'order', 'parent', 'parent_title', 
                   'anchor_id', 'children_count']
         read_only_fields = ['id']
+        list_serializer_class = BatchListSerializer
+    
+    def prime_loader(self, loader, entries):
+        loader.prime('toc_entry_children_count', [entry.pk for entry in entries])
     
     def get_children_count(self, obj):
         """Get the number of child entries."""
-        return obj.children.count() if hasattr(obj, 'children') else 0
+        return get_loader(self.context).load('toc_entry_children_count', obj.pk)
 
 
 class BulkBookAccessSerializer(serializers.Serializer):
@@ -212,7 +286,13 @@ class BulkBookAccessSerializer(serializers.Serializer):
         return attrs
 
 
-class BookContentSerializer(serializers.ModelSerializer):
+class TreeMoveSerializer(serializers.Serializer):
+    """Serializer for moving a tree node (with its subtree)."""
+    parent = serializers.IntegerField(allow_null=True, help_text="New parent ID, null for a root node")
+    order = serializers.IntegerField(min_value=0, help_text="Position among the new siblings")
+
+
+class BookContentSerializer(TreeNodeSerializerMixin, serializers.ModelSerializer):
     """Serializer for BookContent with nested children support."""
     children = serializers.SerializerMethodField()
     book_title = serializers.CharField(source='book.title', read_only=True)
@@ -223,9 +303,9 @@ class BookContentSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
     
     def get_children(self, obj):
-        """Recursively get all children."""
-        children = obj.children.all().order_by('order', 'id')
-        return BookContentSerializer(children, many=True).data
+        """Recursively get all children (the book's tree is loaded once per request)."""
+        children = get_content_children(self.context, obj.book_id).get(obj.id, [])
+        return BookContentSerializer(children, many=True, context=self.context).data
 
 
 class BookContentTreeSerializer(serializers.ModelSerializer):
@@ -238,7 +318,7 @@ class BookContentTreeSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
     
     def get_children(self, obj):
-        """Recursively get all children."""
-        children = obj.children.all().order_by('order', 'id')
-        return BookContentTreeSerializer(children, many=True).data
+        """Recursively get all children (the book's tree is loaded once per request)."""
+        children = get_content_children(self.context, obj.book_id).get(obj.id, [])
+        return BookContentTreeSerializer(children, many=True, context=self.context).data
 
@@ -2,6 +2,7 @@ from django.urls import path
 from .views import (
     # User Management
     UserListView,
+    UserSearchView,
     UserDetailView,
     UserBlockToggleView,
     UserBookAccessView,
@@ -26,11 +27,17 @@ from .views import (
     AdminTOCEntryCreateView,
     AdminTOCEntryUpdateView,
     AdminTOCEntryDeleteView,
+    AdminTOCEntrySubtreeView,
+    AdminTOCEntryMoveView,
     # Book Content Management
     BookContentListView,
     BookContentCreateView,
     BookContentUpdateView,
     BookContentDeleteView,
+    BookContentSubtreeView,
+    BookContentMoveView,
+    # Markdown Preview
+    MarkdownPreviewView,
     # Audio Upload
     AudioUploadView,
 )
@@ -38,6 +45,7 @@ from .views import (
 urlpatterns = [
     # User Management
     path('users/', UserListView.as_view(), name='admin-user-list'),
+    path('users/search/', UserSearchView.as_view(), name='admin-user-search'),
     path('users/<int:pk>/', UserDetailView.as_view(), name='admin-user-detail'),
     path('users/<int:user_id>/block-toggle/', UserBlockToggleView.as_view(), name='admin-user-block-toggle'),
     path('users/book-access/', UserBookAccessView.as_view(), name='admin-user-book-access'),
@@ -66,12 +74,19 @@ urlpatterns = [
     path('toc-entries/create/', AdminTOCEntryCreateView.as_view(), name='admin-toc-entry-create'),
     path('toc-entries/<int:pk>/update/', AdminTOCEntryUpdateView.as_view(), name='admin-toc-entry-update'),
     path('toc-entries/<int:pk>/delete/', AdminTOCEntryDeleteView.as_view(), name='admin-toc-entry-delete'),
+    path('toc-entries/<int:pk>/subtree/', AdminTOCEntrySubtreeView.as_view(), name='admin-toc-entry-subtree'),
+    path('toc-entries/<int:pk>/move/', AdminTOCEntryMoveView.as_view(), name='admin-toc-entry-move'),
     
     # Book Content Management
     path('books/<int:book_id>/contents/', BookContentListView.as_view(), name='admin-book-content-list'),
     path('books/<int:book_id>/contents/create/', BookContentCreateView.as_view(), name='admin-book-content-create'),
     path('books/<int:book_id>/contents/<int:pk>/update/', BookContentUpdateView.as_view(), name='admin-book-content-update'),
     path('books/<int:book_id>/contents/<int:pk>/delete/', BookContentDeleteView.as_view(), name='admin-book-content-delete'),
+    path('books/<int:book_id>/contents/<int:pk>/subtree/', BookContentSubtreeView.as_view(), name='admin-book-content-subtree'),
+    path('books/<int:book_id>/contents/<int:pk>/move/', BookContentMoveView.as_view(), name='admin-book-content-move'),
+    
+    # Markdown Preview
+    path('markdown/preview/', MarkdownPreviewView.as_view(), name='admin-markdown-preview'),
     
     # Audio Upload
     path('upload-audio/', AudioUploadView.as_view(), name='admin-audio-upload'),
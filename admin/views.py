@@ -1,17 +1,26 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.generics import ListAPIView, CreateAPIView, UpdateAPIView, DestroyAPIView, RetrieveAPIView
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.generics import ListAPIView, CreateAPIView, UpdateAPIView, DestroyAPIView, RetrieveAPIView, get_object_or_404
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Prefetch, Q
 from django.conf import settings
 from books.models import Book, Chapter, YouTubeLink, TableOfContentEntry, BookAccess, BookContent
 from .serializers import (
-    UserListSerializer, UserDetailSerializer, AdminBookSerializer, AdminChapterSerializer,
+    UserListSerializer, UserDetailSerializer, AdminBookSerializer, AdminBookListSerializer, AdminChapterSerializer, AdminChapterListSerializer,
     AdminYouTubeLinkSerializer, AdminTOCEntrySerializer, BulkBookAccessSerializer,
-    BookContentSerializer, BookContentTreeSerializer
+    BookContentSerializer, BookContentTreeSerializer, TreeMoveSerializer
 )
 from .permissions import IsAdminUser
+from accounts.search import DEFAULT_LIMIT, search_users
+from books.entitlements import invalidate_entitlements
+from books.utils.content_tree import content_nodes
+from books.utils.tree_paths import group_children, iter_preorder
+from books.utils.incremental import render_markdown_incremental
+from books.utils.loaders import annotate_book_counts, count_subquery
 import os
 
 User = get_user_model()
@@ -19,15 +28,34 @@ User = get_user_model()
 
 # ==================== USER MANAGEMENT ====================
 
+class UserListPagination(CursorPagination):
+    """Newest users first; keyset pagination, so no COUNT(*) or OFFSET scans."""
+    ordering = ('-date_joined', '-id')
+
+
+def user_list_queryset():
+    """Users annotated with their access count and recent accesses, as UserListSerializer reads them."""
+    recent_accesses = BookAccess.objects.select_related('book').only(
+        'id', 'user_id', 'unlocked_at', 'book__id', 'book__title',
+    ).order_by('-unlocked_at', '-id')[:UserListSerializer.RECENT_ACCESS_LIMIT]
+    return User.objects.annotate(
+        book_access_count=count_subquery(BookAccess, 'user_id'),
+    ).prefetch_related(
+        Prefetch('book_access', queryset=recent_accesses, to_attr='recent_book_accesses'),
+    )
+
+
 class UserListView(ListAPIView):
     """List all users with search and pagination (admin only)."""
     serializer_class = UserListSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = UserListPagination
     
     def get_queryset(self):
-        queryset = User.objects.all().order_by('-date_joined')
+        queryset = user_list_queryset()
         
         # Search functionality - filter by name, email, or phone
+        # (substring matches; users/search/ is the ranked, indexed search)
         search = self.request.query_params.get('search', None)
         if search:
             queryset = queryset.filter(
@@ -39,6 +67,26 @@ class UserListView(ListAPIView):
         return queryset
 
 
+class UserSearchView(ListAPIView):
+    """
+    Ranked user search for the admin console (admin only):
+    GET users/search/?q=...&limit=20. See accounts.search.
+    """
+    serializer_class = UserListSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = None
+    
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': ['This query parameter is required.']})
+        try:
+            limit = int(self.request.query_params.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': ['A valid integer is required.']})
+        return search_users(query, limit, queryset=user_list_queryset())
+
+
 class UserDetailView(RetrieveAPIView):
     """Get detailed information about a single user (admin only)."""
     queryset = User.objects.all()
@@ -88,33 +136,45 @@ class UserBookAccessView(APIView):
         
         results = {'granted': 0, 'revoked': 0, 'errors': []}
         
-        for user in users:
-            for book in books:
-                if action == 'grant':
-                    access, created = BookAccess.objects.get_or_create(
-                        user=user,
-                        book=book
-                    )
-                    if created:
-                        results['granted'] += 1
-                elif action == 'revoke':
-                    deleted_count, _ = BookAccess.objects.filter(
-                        user=user,
-                        book=book
-                    ).delete()
-                    if deleted_count > 0:
-                        results['revoked'] += 1
+        with transaction.atomic():
+            existing = BookAccess.objects.filter(user__in=users, book__in=books)
+            if action == 'grant':
+                granted = set(existing.values_list('user_id', 'book_id'))
+                found_book_ids = list(books.values_list('id', flat=True))
+                new_accesses = [
+                    BookAccess(user_id=user_id, book_id=book_id)
+                    for user_id in users.values_list('id', flat=True)
+                    for book_id in found_book_ids
+                    if (user_id, book_id) not in granted
+                ]
+                BookAccess.objects.bulk_create(new_accesses, ignore_conflicts=True)
+                results['granted'] = len(new_accesses)
+            elif action == 'revoke':
+                _, deleted = existing.delete()
+                results['revoked'] = deleted.get(BookAccess._meta.label, 0)
+        
+        # bulk_create doesn't send the signals that keep entitlements fresh
+        invalidate_entitlements(user_ids)
         
         return Response(results, status=status.HTTP_200_OK)
 
 
 # ==================== BOOK MANAGEMENT ====================
 
+# Stored render output, never part of admin book responses
+RENDERED_COLUMNS = ('rendered_html', 'rendered_toc', 'rendered_sections')
+
+
 class AdminBookListView(ListAPIView):
     """List all books including unpublished (admin only)."""
-    queryset = Book.objects.all().order_by('-created_at')
-    serializer_class = AdminBookSerializer
+    serializer_class = AdminBookListSerializer
     permission_classes = [IsAdminUser]
+    
+    def get_queryset(self):
+        # The count fields come from annotations, not columns
+        columns = [name for name in AdminBookListSerializer.Meta.fields if name not in AdminBookSerializer.COUNT_KINDS]
+        books = Book.objects.only(*columns)
+        return annotate_book_counts(books).order_by('-created_at')
 
 
 class AdminBookCreateView(CreateAPIView):
@@ -126,9 +186,11 @@ class AdminBookCreateView(CreateAPIView):
 
 class AdminBookDetailView(RetrieveAPIView):
     """Get book details (admin only)."""
-    queryset = Book.objects.all()
     serializer_class = AdminBookSerializer
     permission_classes = [IsAdminUser]
+    
+    def get_queryset(self):
+        return annotate_book_counts(Book.objects.defer(*RENDERED_COLUMNS))
 
 
 class AdminBookUpdateView(UpdateAPIView):
@@ -186,14 +248,15 @@ class AdminChapterDeleteView(DestroyAPIView):
 
 class AdminChapterListView(ListAPIView):
     """List chapters for a book (admin only)."""
-    serializer_class = AdminChapterSerializer
+    serializer_class = AdminChapterListSerializer
     permission_classes = [IsAdminUser]
     
     def get_queryset(self):
+        chapters = Chapter.objects.select_related('book').only(*AdminChapterListSerializer.COLUMNS)
         book_id = self.request.query_params.get('book_id', None)
         if book_id:
-            return Chapter.objects.filter(book_id=book_id).order_by('order', 'id')
-        return Chapter.objects.all().order_by('book', 'order', 'id')
+            return chapters.filter(book_id=book_id).order_by('order', 'id')
+        return chapters.order_by('book', 'order', 'id')
 
 
 # ==================== YOUTUBE LINK MANAGEMENT ====================
@@ -239,6 +302,45 @@ class AdminYouTubeLinkListView(ListAPIView):
         return YouTubeLink.objects.all().order_by('book', 'order', 'id')
 
 
+# ==================== TREE MOVES ====================
+
+class TreeNodeMoveView(APIView):
+    """
+    Move a tree node with its whole subtree under a new parent of the same
+    book (admin only). Subclasses set serializer_class and queryset (or
+    override get_queryset()), as with DRF's generic views.
+    """
+    permission_classes = [IsAdminUser]
+    queryset = None
+    serializer_class = None
+    
+    def get_queryset(self):
+        return self.queryset.all()
+    
+    def post(self, request, **kwargs):
+        node = get_object_or_404(self.get_queryset(), pk=kwargs['pk'])
+        move = TreeMoveSerializer(data=request.data)
+        move.is_valid(raise_exception=True)
+        
+        parent = None
+        parent_id = move.validated_data['parent']
+        if parent_id is not None:
+            parent = type(node).objects.filter(pk=parent_id, book_id=node.book_id).first()
+            if parent is None:
+                return Response(
+                    {'detail': 'Parent not found in this book.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        try:
+            node.move_to(parent, move.validated_data['order'])
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = self.serializer_class(node, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 # ==================== TABLE OF CONTENTS MANAGEMENT ====================
 
 class AdminTOCEntryCreateView(CreateAPIView):
@@ -270,6 +372,26 @@ class AdminTOCEntryDeleteView(DestroyAPIView):
         )
 
 
+class AdminTOCEntrySubtreeView(APIView):
+    """A TOC entry and its descendants, flattened in display order (admin only)."""
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request, pk):
+        entry = get_object_or_404(TableOfContentEntry, pk=pk)
+        # One prefix scan on path instead of walking children level by level
+        entries = entry.get_subtree().select_related('book', 'chapter', 'parent')
+        children = group_children(entries)
+        subtree = [entry] + list(iter_preorder(children, entry.pk))
+        serializer = AdminTOCEntrySerializer(subtree, many=True, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class AdminTOCEntryMoveView(TreeNodeMoveView):
+    """Move a TOC entry with its children (admin only)."""
+    queryset = TableOfContentEntry.objects.all()
+    serializer_class = AdminTOCEntrySerializer
+
+
 class AdminTOCEntryListView(ListAPIView):
     """List TOC entries for a book (admin only)."""
     serializer_class = AdminTOCEntrySerializer
@@ -295,6 +417,27 @@ class BookContentListView(ListAPIView):
         return BookContent.objects.filter(book_id=book_id, parent=None).order_by('order', 'id')
 
 
+class BookContentSubtreeView(APIView):
+    """A BookContent entry with its nested children (admin only)."""
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request, book_id, pk):
+        node = get_object_or_404(BookContent, book_id=book_id, pk=pk)
+        # One prefix scan on path; the serializer nests from the grouped rows
+        children = group_children(content_nodes(node.get_subtree()))
+        context = {'request': request, 'content_children': {node.book_id: children}}
+        serializer = BookContentTreeSerializer(node, context=context)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class BookContentMoveView(TreeNodeMoveView):
+    """Move a BookContent entry with its children (admin only)."""
+    serializer_class = BookContentSerializer
+    
+    def get_queryset(self):
+        return BookContent.objects.filter(book_id=self.kwargs['book_id'])
+
+
 class BookContentCreateView(CreateAPIView):
     """Create a new BookContent entry (admin only)."""
     queryset = BookContent.objects.all()
@@ -337,6 +480,23 @@ class BookContentDeleteView(DestroyAPIView):
         )
 
 
+class MarkdownPreviewView(APIView):
+    """Render markdown the way it will be stored on save (admin only)."""
+    permission_classes = [IsAdminUser]
+    
+    def post(self, request):
+        markdown_content = request.data.get('markdown_content', '')
+        if not isinstance(markdown_content, str):
+            return Response(
+                {'detail': 'markdown_content must be a string.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Same block-level engine as render-on-save: only edited blocks are rendered
+        result = render_markdown_incremental(markdown_content)
+        return Response({'html': result['html'], 'toc': result['toc']})
+
+
 class AudioUploadView(APIView):
     """Upload audio file for book content (admin only)."""
     permission_classes = [IsAdminUser]
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the markdown rendering pipeline.
+
+Run with:  python manage.py benchmark_markdown
+"""
+from .corpus import generate_corpus
+from .runner import STAGES, run_benchmarks, compare_results, load_baseline, save_baseline
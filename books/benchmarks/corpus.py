@@ -0,0 +1,100 @@
+"""
+Synthetic markdown corpora for the rendering benchmarks.
+
+Documents are built from book-like blocks weighted towards what makes
+rendering expensive: many (and duplicated) headings, fenced code that goes
+through Pygments, and pipe tables. Generation is seeded, so a given size
+always produces the same document and timings stay comparable between runs.
+"""
+import random
+
+KB = 1024
+MB = 1024 * KB
+
+# Document sizes (bytes) for the standard benchmark runs
+SIZE_PRESETS = {
+    'quick': [10 * KB, 100 * KB, 1 * MB],
+    'full': [10 * KB, 100 * KB, 1 * MB, 5 * MB, 20 * MB],
+}
+
+_WORDS = (
+    'reader chapter margin binding folio verse index preface spine lantern '
+    'harbor orchard copper meadow quiet river window thread winter signal '
+    'journey anchor compass ledger fable garden echo velvet summit candle'
+).split()
+
+_CODE_SAMPLES = [
+    ('python', 'def chapter_{n}(pages):\n    """Count words."""\n    total = 0\n'
+               '    for page in pages:\n        total += len(page.split())  # words\n'
+               '    return {{"chapter": {n}, "words": total}}\n'),
+    ('javascript', 'function chapter{n}(pages) {{\n  // count words\n'
+                   '  return pages.reduce((n, p) => n + p.split(" ").length, 0);\n}}\n'),
+    ('sql', 'SELECT id, title FROM books_chapter\nWHERE book_id = {n} AND is_preview\n'
+            'ORDER BY "order";\n'),
+    ('', '$ python manage.py rerender_content --model book\nBook: checked {n}, re-rendered {n}\n'),
+]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.choices(_WORDS, k=rng.randint(6, 16))
+    sentence = ' '.join(words).capitalize()
+    if rng.random() < 0.3:
+        words = sentence.split(' ')
+        index = rng.randrange(len(words))
+        words[index] = rng.choice(['*{}*', '**{}**', '`{}`', '[{}](https://example.com/{})']).format(
+            words[index], words[index].lower())
+        sentence = ' '.join(words)
+    return sentence + '.'
+
+
+def _heading(rng: random.Random, n: int) -> str:
+    level = rng.choices([1, 2, 3, 4], weights=[1, 3, 4, 2])[0]
+    # Reuse titles often so id de-duplication is exercised
+    title = rng.choice(['Overview', 'Notes', 'Summary', f'Part {n % 50}', _sentence(rng)[:40].rstrip('.')])
+    return '#' * level + ' ' + title
+
+
+def _paragraph(rng: random.Random, n: int) -> str:
+    return ' '.join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+
+
+def _code(rng: random.Random, n: int) -> str:
+    lang, code = rng.choice(_CODE_SAMPLES)
+    return f'```{lang}\n{code.format(n=n)}```'
+
+
+def _table(rng: random.Random, n: int) -> str:
+    columns = rng.randint(2, 5)
+    rows = ['| ' + ' | '.join(rng.choice(_WORDS).title() for _ in range(columns)) + ' |',
+            '|' + '---|' * columns]
+    for _ in range(rng.randint(2, 8)):
+        rows.append('| ' + ' | '.join(rng.choice(_WORDS) for _ in range(columns)) + ' |')
+    return '\n'.join(rows)
+
+
+def _list(rng: random.Random, n: int) -> str:
+    marker = rng.choice(['-', '*', '1.'])
+    return '\n'.join(f'{marker} {_sentence(rng)}' for _ in range(rng.randint(2, 6)))
+
+
+_BLOCKS = [(_heading, 4), (_paragraph, 5), (_code, 3), (_table, 2), (_list, 1)]
+
+
+def generate_corpus(size: int, seed: int = 0) -> str:
+    """
+    Build a markdown document of roughly size bytes (UTF-8).
+
+    The result is deterministic for a given (size, seed).
+    """
+    rng = random.Random(f'{seed}:{size}')
+    makers = [maker for maker, _ in _BLOCKS]
+    weights = [weight for _, weight in _BLOCKS]
+    blocks = [f'# Benchmark document ({size} bytes)']
+    total = len(blocks[0])
+    n = 0
+    while total < size:
+        n += 1
+        block = rng.choices(makers, weights=weights)[0](rng, n)
+        blocks.append(block)
+        total += len(block.encode('utf-8')) + 2
+    return '\n\n'.join(blocks)
@@ -0,0 +1,159 @@
+"""
+Timing and memory measurement for the markdown rendering pipeline.
+
+Each stage of the reference pipeline is measured on its own:
+
+    convert    Markdown -> HTML with the configured extensions
+    toc        re-parse the HTML and assign heading ids / collect the TOC
+    serialize  write the re-parsed tree back out as HTML
+    pipeline   an uncached process_markdown() call, as a read endpoint pays
+               on a cache miss
+
+Timings are wall-clock (perf_counter) over several runs; peak memory comes
+from a separate tracemalloc-traced run, so tracing doesn't skew timings.
+The code highlighting cache is cleared before every run, so conversion
+timings include Pygments.
+"""
+import json
+import platform
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from bs4 import BeautifulSoup
+
+from books.utils.markdown_processor import (
+    assign_heading_ids, create_markdown, render_signature, _render_markdown,
+)
+from books.utils.highlighting import highlight_cache
+from .corpus import generate_corpus
+
+STAGES = ('convert', 'toc', 'serialize', 'pipeline')
+
+
+def _convert(text: str) -> str:
+    return create_markdown().convert(text)
+
+
+def _extract_toc(html: str) -> BeautifulSoup:
+    soup = BeautifulSoup(html, 'html.parser')
+    assign_heading_ids(soup)
+    return soup
+
+
+def _stage_inputs(text: str) -> Dict[str, tuple]:
+    """(function, argument) for each stage, prepared from text."""
+    html = _convert(text)
+    soup = _extract_toc(html)
+    return {
+        'convert': (_convert, text),
+        'toc': (_extract_toc, html),
+        'serialize': (str, soup),
+        'pipeline': (_render_markdown, text),
+    }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Linearly interpolated percentile of values (fraction in 0..1)."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def measure(func: Callable, argument, repeat: int) -> Dict[str, float]:
+    """Time repeat calls of func(argument), then trace one more for peak memory."""
+    timings = []
+    for _ in range(repeat):
+        highlight_cache.clear()
+        start = time.perf_counter()
+        func(argument)
+        timings.append(time.perf_counter() - start)
+
+    highlight_cache.clear()
+    tracemalloc.start()
+    try:
+        func(argument)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'runs': repeat,
+        'p50': percentile(timings, 0.50),
+        'p95': percentile(timings, 0.95),
+        'min': min(timings),
+        'mean': sum(timings) / len(timings),
+        'peak_bytes': peak,
+    }
+
+
+def run_benchmarks(sizes: List[int], repeat: int = 5, stages=STAGES, seed: int = 0,
+                   progress: Optional[Callable[[int, str, Dict], None]] = None) -> Dict:
+    """
+    Benchmark each stage on a generated corpus of each size.
+
+    Returns:
+        {'meta': {...}, 'results': {size: {stage: measurements}}}, with sizes
+        as strings so the result round-trips through JSON unchanged.
+    """
+    results = {}
+    for size in sizes:
+        inputs = _stage_inputs(generate_corpus(size, seed=seed))
+        results[str(size)] = {}
+        for stage in stages:
+            func, argument = inputs[stage]
+            results[str(size)][stage] = measure(func, argument, repeat)
+            if progress:
+                progress(size, stage, results[str(size)][stage])
+    return {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'render_signature': render_signature(),
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float = 0.10,
+                    metrics=('p50', 'p95', 'peak_bytes')) -> List[Dict]:
+    """
+    Regressions of current against baseline.
+
+    A metric regresses when it grew by more than threshold (a fraction, e.g.
+    0.10 for 10%). Only sizes and stages present in both runs are compared.
+
+    Returns:
+        List of {'size', 'stage', 'metric', 'baseline', 'current', 'change'}.
+    """
+    regressions = []
+    for size, stages in current['results'].items():
+        for stage, measured in stages.items():
+            reference = baseline['results'].get(size, {}).get(stage)
+            if not reference:
+                continue
+            for metric in metrics:
+                before, after = reference.get(metric), measured.get(metric)
+                if not before or after is None:
+                    continue
+                change = (after - before) / before
+                if change > threshold:
+                    regressions.append({
+                        'size': int(size), 'stage': stage, 'metric': metric,
+                        'baseline': before, 'current': after, 'change': change,
+                    })
+    return regressions
+
+
+def save_baseline(results: Dict, path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,113 @@
+"""
+Per-user entitlements: the set of book ids a user has unlocked.
+
+The set is cached in Django's cache as a sorted array of book ids (8 bytes
+per book) under a per-user versioned key, and rebuilt with one query on a
+miss, so is_locked checks for a whole page are in-memory membership tests.
+Only a shared cache (CACHES) is used: with the process-local default the
+set is loaded per call, since other workers would miss a revoke.
+BookAccess changes invalidate a user's entry (books.signals, and explicitly
+on bulk paths that bypass signals).
+
+Endpoints serving one book's full content use get_readable_book instead,
+which checks the book and the user's access in the query loading the book.
+"""
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Optional, Tuple
+
+from django.db.models import Exists, OuterRef
+
+from .models import Book, BookAccess
+from .utils.versioned_cache import VersionedCache
+
+# Bump the prefix when the cached representation changes
+entitlement_cache = VersionedCache('entitlements-1', 'ENTITLEMENT_CACHE')
+
+
+class Entitlements:
+    """Sorted array of unlocked book ids with binary-search membership."""
+
+    __slots__ = ('book_ids',)
+
+    def __init__(self, book_ids: array):
+        self.book_ids = book_ids
+
+    @classmethod
+    def from_ids(cls, book_ids: Iterable[int]) -> 'Entitlements':
+        return cls(array('q', sorted(set(book_ids))))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Entitlements':
+        book_ids = array('q')
+        book_ids.frombytes(data)
+        return cls(book_ids)
+
+    def to_bytes(self) -> bytes:
+        return self.book_ids.tobytes()
+
+    def __contains__(self, book_id) -> bool:
+        index = bisect_left(self.book_ids, book_id)
+        return index < len(self.book_ids) and self.book_ids[index] == book_id
+
+    def __iter__(self):
+        return iter(self.book_ids)
+
+    def __len__(self) -> int:
+        return len(self.book_ids)
+
+
+def get_entitlements(user) -> Entitlements:
+    """Book ids user has unlocked (empty for anonymous users)."""
+    if not user or not user.is_authenticated:
+        return Entitlements.from_ids([])
+
+    def build():
+        book_ids = BookAccess.objects.filter(user=user).values_list('book_id', flat=True)
+        return Entitlements.from_ids(book_ids).to_bytes()
+
+    return Entitlements.from_bytes(entitlement_cache.get_or_build(user.pk, build))
+
+
+def has_book_access(user, book_id: int) -> bool:
+    return book_id in get_entitlements(user)
+
+
+def invalidate_entitlements(user_ids: Iterable[int]) -> None:
+    """Drop the cached entitlements of user_ids."""
+    entitlement_cache.invalidate(user_ids)
+
+
+# Why get_readable_book refused a book
+BOOK_NOT_FOUND, BOOK_UNPUBLISHED, BOOK_LOCKED = 'not_found', 'unpublished', 'locked'
+
+
+def get_readable_book(user, book_id, queryset=None) -> Tuple[Optional[Book], Optional[str]]:
+    """
+    Load book_id for a user who wants to read its full content.
+
+    The user's BookAccess is an Exists() annotation of the book query, so
+    loading and checking the book is a single query. Admins (staff +
+    superuser) may read every book, including unpublished ones.
+
+    Returns:
+        (book, None) when the user may read it, otherwise (None, BOOK_NOT_FOUND,
+        BOOK_UNPUBLISHED or BOOK_LOCKED).
+    """
+    queryset = Book.objects.all() if queryset is None else queryset
+    is_admin = user.is_staff and user.is_superuser
+    if not is_admin:
+        queryset = queryset.annotate(
+            has_access=Exists(BookAccess.objects.filter(user=user, book=OuterRef('pk'))),
+        )
+    try:
+        book = queryset.get(pk=book_id)
+    except Book.DoesNotExist:
+        return None, BOOK_NOT_FOUND
+    if is_admin:
+        return book, None
+    if not book.is_published:
+        return None, BOOK_UNPUBLISHED
+    if not book.has_access:
+        return None, BOOK_LOCKED
+    return book, None
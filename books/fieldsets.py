@@ -0,0 +1,136 @@
+"""
+Sparse fieldsets for the book serializers.
+
+Query parameters pick the fields of a response:
+
+    ?fields=id,title       only these fields
+    ?omit=content,html     everything but these
+    ?expand=chapters       also these optional fields (Meta.expandable_fields)
+
+Nested serializers are addressed with a dotted prefix, e.g.
+?omit=chapters.content. Fields that are not selected are dropped before
+serialization, so their method fields (renders, loader queries) never run,
+and views don't load the columns only those fields read
+(Meta.column_dependencies).
+"""
+from typing import Iterable, List, Optional, Set
+
+
+def parse_names(value: Optional[str]) -> Set[str]:
+    """Comma separated names of a query parameter."""
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class FieldSelection:
+    """The fields, omit and expand names requested for one serializer."""
+
+    def __init__(self, fields: Optional[Iterable[str]] = None, omit: Iterable[str] = (),
+                 expand: Iterable[str] = ()):
+        # None: no ?fields=, so every default field
+        self.fields = set(fields) if fields is not None else None
+        self.omit = set(omit)
+        self.expand = set(expand)
+
+    @classmethod
+    def from_request(cls, request) -> 'FieldSelection':
+        params = getattr(request, 'query_params', None) or getattr(request, 'GET', {})
+        fields = params.get('fields')
+        return cls(
+            parse_names(fields) if fields is not None else None,
+            parse_names(params.get('omit')),
+            parse_names(params.get('expand')),
+        )
+
+    def nested(self, name: str) -> 'FieldSelection':
+        """Selection for the serializer of field name, from the 'name.' prefixed names."""
+        prefix = name + '.'
+
+        def strip(names):
+            return {n[len(prefix):] for n in names if n.startswith(prefix)}
+
+        fields = strip(self.fields) if self.fields is not None else set()
+        return FieldSelection(fields or None, strip(self.omit), strip(self.expand))
+
+    def select(self, names: Iterable[str], expandable: Iterable[str] = ()) -> List[str]:
+        """The names (in order) this selection keeps."""
+        expandable = set(expandable)
+        selected = []
+        for name in names:
+            if name in expandable and name not in self.expand:
+                continue
+            if self.fields is not None and name not in self.fields and not any(
+                    field.startswith(name + '.') for field in self.fields):
+                continue
+            if name in self.omit:
+                continue
+            selected.append(name)
+        return selected
+
+
+class SparseFieldsetMixin:
+    """
+    ModelSerializer mixin applying a FieldSelection: the selection= kwarg,
+    else the request's query parameters for top-level serializers (nested
+    ones get theirs from the parent, see FieldSelection.nested).
+
+    Meta options:
+        expandable_fields: fields only included with ?expand=
+        deferrable_columns: heavy model columns views may leave unloaded
+        column_dependencies: field -> the deferrable columns it reads
+            (a field reads its own column by default)
+    """
+
+    def __init__(self, *args, selection: Optional[FieldSelection] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if selection is None:
+            request = self.context.get('request')
+            selection = FieldSelection.from_request(request) if request is not None else FieldSelection()
+        self.selection = selection
+        keep = set(self.selected_field_names(selection))
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+    @classmethod
+    def selected_field_names(cls, selection: FieldSelection) -> List[str]:
+        return selection.select(cls.Meta.fields, getattr(cls.Meta, 'expandable_fields', ()))
+
+    @classmethod
+    def deferred_columns(cls, selection: FieldSelection) -> List[str]:
+        """The Meta.deferrable_columns none of the selected fields read."""
+        dependencies = getattr(cls.Meta, 'column_dependencies', {})
+        needed = set()
+        for name in cls.selected_field_names(selection):
+            needed.update(dependencies.get(name, (name,)))
+        return [column for column in getattr(cls.Meta, 'deferrable_columns', ()) if column not in needed]
+
+    @classmethod
+    def loaded_columns(cls, selection: FieldSelection) -> List[str]:
+        """The model columns the selected fields read, for QuerySet.only()."""
+        meta = cls.Meta.model._meta
+        concrete = {field.name for field in meta.concrete_fields}
+        dependencies = getattr(cls.Meta, 'column_dependencies', {})
+        columns = {meta.pk.name}
+        for name in cls.selected_field_names(selection):
+            columns.update(column for column in dependencies.get(name, (name,)) if column in concrete)
+        return sorted(columns)
+
+    def nested_selection(self, name: str) -> FieldSelection:
+        return self.selection.nested(name)
+
+
+class SparseFieldsetViewMixin:
+    """View mixin leaving unloaded the columns the serializer's selected fields don't read."""
+
+    def get_field_selection(self) -> FieldSelection:
+        return FieldSelection.from_request(self.request)
+
+    def only_selected(self, queryset, *extra_columns):
+        """queryset loading just the columns the selected fields read (plus extra_columns)."""
+        columns = self.get_serializer_class().loaded_columns(self.get_field_selection())
+        return queryset.only(*columns, *extra_columns)
+
+    def defer_unselected(self, queryset, serializer_class=None):
+        serializer_class = serializer_class or self.get_serializer_class()
+        deferred = serializer_class.deferred_columns(self.get_field_selection())
+        return queryset.defer(*deferred) if deferred else queryset
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand, CommandError
+from books.benchmarks import STAGES, run_benchmarks, compare_results, load_baseline, save_baseline
+from books.benchmarks.corpus import SIZE_PRESETS, KB, MB
+
+
+def parse_size(value):
+    """'10KB', '20MB' or a plain byte count."""
+    text = value.strip().upper()
+    for suffix, unit in (('KB', KB), ('MB', MB), ('K', KB), ('M', MB)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * unit)
+    return int(text)
+
+
+def format_size(size):
+    if size >= MB:
+        return f'{size / MB:g}MB'
+    return f'{size / KB:g}KB'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the markdown rendering pipeline (conversion, TOC extraction, serialization) '
+        'on synthetic corpora, and optionally compare against a saved JSON baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', choices=sorted(SIZE_PRESETS), default='quick',
+                            help='Corpus sizes to run: quick (10KB-1MB) or full (10KB-20MB) (default: quick)')
+        parser.add_argument('--sizes', nargs='+', type=parse_size,
+                            help='Explicit corpus sizes, e.g. 10KB 2MB (overrides --preset)')
+        parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                            help='Stages to measure (default: all)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed runs per stage and size (default: 5)')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Corpus generator seed (default: 0)')
+        parser.add_argument('--save', metavar='PATH',
+                            help='Write the results to PATH as a JSON baseline')
+        parser.add_argument('--compare', metavar='PATH',
+                            help='Compare against the JSON baseline at PATH and fail on regressions')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Allowed slowdown/memory growth in percent for --compare (default: 10)')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        baseline = load_baseline(options['compare']) if options['compare'] else None
+        sizes = options['sizes'] or SIZE_PRESETS[options['preset']]
+
+        self.stdout.write(f'{"size":>8} {"stage":<10} {"p50 ms":>10} {"p95 ms":>10} {"peak KiB":>10}')
+        results = run_benchmarks(
+            sizes, repeat=options['repeat'], stages=options['stages'], seed=options['seed'],
+            progress=self.report,
+        )
+
+        if options['save']:
+            save_baseline(results, options['save'])
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {options["save"]}'))
+
+        if baseline is None:
+            return
+        if baseline['meta'].get('render_signature') != results['meta']['render_signature']:
+            self.stdout.write(self.style.WARNING(
+                f'Baseline was recorded with {baseline["meta"].get("render_signature")}, '
+                f'now {results["meta"]["render_signature"]}'
+            ))
+        regressions = compare_results(results, baseline, threshold=options['threshold'] / 100)
+        for item in regressions:
+            self.stdout.write(self.style.ERROR(
+                f'{format_size(item["size"])} {item["stage"]} {item["metric"]}: '
+                f'{item["baseline"]:.6g} -> {item["current"]:.6g} (+{item["change"]:.0%})'
+            ))
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) over {options["threshold"]:g}%')
+        self.stdout.write(self.style.SUCCESS(f'No regressions over {options["threshold"]:g}%'))
+
+    def report(self, size, stage, measured):
+        self.stdout.write(
+            f'{format_size(size):>8} {stage:<10} {measured["p50"] * 1000:>10.2f} '
+            f'{measured["p95"] * 1000:>10.2f} {measured["peak_bytes"] / 1024:>10.0f}'
+        )
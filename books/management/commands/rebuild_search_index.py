@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from books.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the catalog search index from all books and chapters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Documents indexed per batch (default: 200)')
+
+    def handle(self, *args, **options):
+        counts = rebuild_search_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {counts["books"]} books and {counts["chapters"]} chapters'
+        ))
@@ -0,0 +1,120 @@
+import os
+import time
+from concurrent.futures import as_completed
+from datetime import datetime, time as dt_time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from books.models import Book, Chapter
+from books.utils.rendering import RENDERED_FIELDS, render_fields, apply_rendered_fields, needs_render
+from books.utils.render_writes import save_rendered
+from books.utils.workers import worker_pool
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-render the whole catalog (books and chapters) in parallel worker processes. '
+        'Use after changing markdown extensions or after a bulk content import.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes; 1 renders in this process (default: CPU count)')
+        parser.add_argument('--since',
+                            help='Only books changed on/after this date or datetime (ISO 8601), and their chapters')
+        parser.add_argument('--book-ids', type=int, nargs='+',
+                            help='Only these books and their chapters')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Rows rendered and written per batch (default: 200)')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-render rows whose content hash is already current')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Render and report, but do not write anything')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        books = Book.objects.all()
+        if options['since']:
+            # updated_at also moves when a book's chapters change (Book.touch)
+            books = books.filter(updated_at__gte=self.parse_since(options['since']))
+        if options['book_ids']:
+            books = books.filter(pk__in=options['book_ids'])
+        chapters = Chapter.objects.filter(book__in=books.values('pk'))
+
+        executor = worker_pool(options['workers']) if options['workers'] > 1 else None
+        try:
+            for model, queryset in ((Book, books), (Chapter, chapters)):
+                self.render_model(model, queryset, executor, options)
+        finally:
+            if executor:
+                executor.shutdown()
+
+    def parse_since(self, value):
+        since = parse_datetime(value)
+        if since is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f'Invalid --since value: {value!r}')
+            since = datetime.combine(day, dt_time.min)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def render_model(self, model, queryset, executor, options):
+        name = model.__name__
+        chunk_size = options['chunk_size']
+        started = time.monotonic()
+        stats = {'checked': 0, 'rendered': 0, 'failed': 0, 'chars': 0}
+
+        batch = []
+        for pk in queryset.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk_size):
+            batch.append(pk)
+            if len(batch) >= chunk_size:
+                self.render_batch(model, batch, executor, options, stats)
+                batch = []
+        if batch:
+            self.render_batch(model, batch, executor, options, stats)
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: checked {stats["checked"]}, rendered {stats["rendered"]}, failed {stats["failed"]} '
+            f'in {elapsed:.1f}s ({stats["rendered"] / elapsed:.1f} docs/s, '
+            f'{stats["chars"] / elapsed / 1024:.0f} KiB/s of markdown)'
+            + (' [dry run]' if options['dry_run'] else '')
+        ))
+
+    def render_batch(self, model, pks, executor, options, stats):
+        objects = model.objects.only('pk', 'markdown_content', *RENDERED_FIELDS).in_bulk(pks)
+        stats['checked'] += len(objects)
+        pending = [obj for obj in objects.values() if options['force'] or needs_render(obj)]
+
+        rendered = []
+        if executor:
+            futures = {executor.submit(render_fields, obj.markdown_content): obj for obj in pending}
+            for future in as_completed(futures):
+                self.collect(model, futures[future], future.result, rendered, stats)
+        else:
+            for obj in pending:
+                self.collect(model, obj, lambda: render_fields(obj.markdown_content), rendered, stats)
+
+        if rendered and not options['dry_run']:
+            save_rendered(model, rendered)
+        self.stdout.write(
+            f'  {model.__name__} {pks[0]}-{pks[-1]}: {len(rendered)}/{len(objects)} rendered '
+            f'(total {stats["checked"]} checked)'
+        )
+
+    def collect(self, model, obj, get_result, rendered, stats):
+        try:
+            fields = get_result()
+        except Exception as exc:
+            stats['failed'] += 1
+            self.stderr.write(f'  {model.__name__} {obj.pk} failed: {exc!r}')
+            return
+        apply_rendered_fields(obj, fields)
+        rendered.append(obj)
+        stats['rendered'] += 1
+        stats['chars'] += len(obj.markdown_content or '')
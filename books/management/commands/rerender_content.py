@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from books.models import Book, Chapter
+from books.utils.rendering import refresh_rendered_content, RENDERED_FIELDS
+from books.utils.render_writes import save_rendered
+
+
+class Command(BaseCommand):
+    help = 'Backfill or repair the stored rendered HTML/TOC of books and chapters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='Rows loaded and written per batch (default: 100)')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-render every row, even when its content hash is current')
+        parser.add_argument('--model', choices=['book', 'chapter', 'all'], default='all',
+                            help='Which content to re-render (default: all)')
+
+    def handle(self, *args, **options):
+        models = {'book': [Book], 'chapter': [Chapter], 'all': [Book, Chapter]}[options['model']]
+        for model in models:
+            checked, updated = self.rerender(model, options['chunk_size'], options['force'])
+            self.stdout.write(self.style.SUCCESS(
+                f'{model.__name__}: checked {checked}, re-rendered {updated}'
+            ))
+
+    def rerender(self, model, chunk_size, force):
+        queryset = model.objects.only('pk', 'markdown_content', *RENDERED_FIELDS).order_by('pk')
+        checked = updated = 0
+        pending = []
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            checked += 1
+            if refresh_rendered_content(obj, force=force):
+                pending.append(obj)
+            if len(pending) >= chunk_size:
+                save_rendered(model, pending)
+                updated += len(pending)
+                pending = []
+        if pending:
+            save_rendered(model, pending)
+            updated += len(pending)
+        return checked, updated
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.2 on 2026-10-17 00:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_rendered_markdown_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rendered_sections',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='rendered_sections',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.2 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+# Frozen copy of books.utils.tree_paths.path_segment as of this migration,
+# so later changes to it don't change what it does
+PATH_STEP = 6
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_segment(pk):
+    digits, rest = '', pk
+    while rest:
+        rest, digit = divmod(rest, 36)
+        digits = PATH_DIGITS[digit] + digits
+    if len(digits) > PATH_STEP:
+        raise ValueError(f'id {pk} does not fit in a tree path segment')
+    return digits.rjust(PATH_STEP, '0')
+
+
+def fill_paths(apps, schema_editor):
+    for model_name in ('BookContent', 'TableOfContentEntry'):
+        model = apps.get_model('books', model_name)
+        parents = dict(model.objects.values_list('pk', 'parent_id'))
+        paths = {}
+
+        def path_of(pk):
+            # Iterative, so deep trees don't hit the recursion limit
+            chain = []
+            while pk is not None and pk not in paths:
+                chain.append(pk)
+                pk = parents.get(pk)
+            prefix = paths.get(pk, '')
+            for node_pk in reversed(chain):
+                prefix = paths[node_pk] = prefix + path_segment(node_pk)
+            return prefix
+
+        nodes = [model(pk=pk, path=path_of(pk)) for pk in parents]
+        model.objects.bulk_update(nodes, ['path'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookcontent',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='tableofcontententry',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.2 on 2026-10-17 01:15
+
+import re
+
+from django.db import migrations, models
+
+# Frozen copy of books.utils.rendering.count_words as of this migration, so
+# later changes to the renderer can't break or change it
+WORD_RE = re.compile(r"\w+(?:['’-]\w+)*")
+
+
+def count_words(text):
+    return len(WORD_RE.findall(text or ''))
+
+
+def fill_word_counts(apps, schema_editor):
+    Chapter = apps.get_model('books', 'Chapter')
+    chapters = Chapter.objects.only('pk', 'content', 'markdown_content')
+    batch = []
+    for chapter in chapters.iterator(chunk_size=500):
+        chapter.word_count = count_words(chapter.markdown_content or chapter.content)
+        batch.append(chapter)
+        if len(batch) >= 500:
+            Chapter.objects.bulk_update(batch, ['word_count'])
+            batch = []
+    Chapter.objects.bulk_update(batch, ['word_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0014_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_word_counts, migrations.RunPython.noop),
+    ]
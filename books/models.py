@@ -1,8 +1,111 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Max, Value
+from django.db.models.functions import Concat, Length, Substr
 from django.conf import settings
+from django.utils import timezone
+from django.contrib.postgres.search import SearchVectorField
 from accounts.models import User
+from .utils.rendering import count_words, refresh_rendered_content, RENDERED_FIELDS
+from .utils.tree_paths import PATH_MAX_LENGTH, PATH_STEP, path_segment
 
-class Book(models.Model):
+
+class RenderedMarkdownModel(models.Model):
+    """Stores the rendered form of markdown_content, refreshed on save."""
+    rendered_html = models.TextField(blank=True, default='', editable=False)
+    rendered_toc = models.JSONField(blank=True, default=list, editable=False)
+    # Top-level h1/h2 sections of rendered_html, see books.utils.sections
+    rendered_sections = models.JSONField(blank=True, default=list, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'markdown_content' in update_fields:
+            if refresh_rendered_content(self) and update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(RENDERED_FIELDS)
+        super().save(*args, **kwargs)
+
+
+class MaterializedPathModel(models.Model):
+    """
+    Per-book tree node (subclasses define book and parent) that also stores
+    its materialized path, kept in sync on save. See books.utils.tree_paths.
+    """
+    path = models.CharField(max_length=PATH_MAX_LENGTH, blank=True, default='', editable=False, db_index=True)
+
+    # Added to siblings' order while shifting them, see move_to()
+    ORDER_SHIFT = 1_000_000
+
+    class Meta:
+        abstract = True
+
+    @property
+    def depth(self) -> int:
+        return len(self.path) // PATH_STEP
+
+    def get_subtree(self):
+        """This node and all its descendants (one prefix scan on path within the book)."""
+        if not self.path:
+            # Every path starts with '', so this would be every node
+            raise ValueError('The node has no path yet; save it first.')
+        return type(self).objects.filter(book_id=self.book_id, path__startswith=self.path)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._sync_path()
+
+    def _sync_path(self):
+        model = type(self)
+        stored = dict(model.objects.filter(pk__in=[self.pk, self.parent_id]).values_list('pk', 'path'))
+        old_path = stored.get(self.pk, '')
+        parent_path = stored.get(self.parent_id, '') if self.parent_id else ''
+        if old_path and parent_path.startswith(old_path):
+            raise ValueError('A node cannot be moved under itself or its descendants.')
+        path = parent_path + path_segment(self.pk)
+        if path == old_path:
+            self.path = path
+            return
+        descendants = model.objects.filter(
+            book_id=self.book_id, path__startswith=old_path,
+        ).exclude(pk=self.pk) if old_path else None
+        deepest = len(path)
+        if descendants is not None and len(path) > len(old_path):
+            longest = descendants.aggregate(longest=Max(Length('path')))['longest'] or 0
+            deepest = max(deepest, longest - len(old_path) + len(path))
+        if deepest > PATH_MAX_LENGTH:
+            raise ValueError('The tree would become too deep.')
+        model.objects.filter(pk=self.pk).update(path=path)
+        if descendants is not None:
+            descendants.update(path=Concat(
+                Value(path), Substr('path', len(old_path) + 1), output_field=models.CharField(),
+            ))
+        self.path = path
+
+    def move_to(self, parent, order: int) -> None:
+        """
+        Make this node (with its subtree) the child of parent (None for a
+        root) at position order, shifting the siblings from order on.
+        """
+        if parent is not None and parent.path.startswith(self.path):
+            raise ValueError('A node cannot be moved under itself or its descendants.')
+        with transaction.atomic():
+            siblings = type(self).objects.filter(book_id=self.book_id, parent=parent).exclude(pk=self.pk)
+            if siblings.filter(order=order).exists():
+                # Two set-based updates: a single order + 1 would hit the
+                # (book, order, parent) unique constraint mid-statement
+                siblings.filter(order__gte=order).update(order=F('order') + self.ORDER_SHIFT)
+                siblings.filter(order__gte=order + self.ORDER_SHIFT).update(
+                    order=F('order') - (self.ORDER_SHIFT - 1),
+                )
+            self.parent = parent
+            self.order = order
+            self.save()
+
+
+class Book(RenderedMarkdownModel):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=100)
     description = models.TextField()
@@ -16,6 +119,9 @@ class Book(models.Model):
     price = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
     is_published = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Also bumped when the book's chapters, TOC entries or YouTube links
+    # change (books.signals); the version the book endpoints validate against
+    updated_at = models.DateTimeField(auto_now=True)
     # Table of Contents position setting
     toc_position = models.CharField(
         max_length=20,
@@ -33,6 +139,11 @@ class Book(models.Model):
     
     def __str__(self):
         return self.title
+
+    @classmethod
+    def touch(cls, book_ids):
+        """Bump updated_at of book_ids without saving (or signalling) them."""
+        cls.objects.filter(pk__in=set(book_ids)).update(updated_at=timezone.now())
     
 class BookAccess(models.Model):
     """Represents which books a user has purchased/unlocked"""
@@ -47,7 +158,7 @@ class BookAccess(models.Model):
         return f"{self.user.email} → {self.book.title}"
 
 
-class Chapter(models.Model):
+class Chapter(RenderedMarkdownModel):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='chapters')
     title = models.CharField(max_length=200)
     order = models.PositiveIntegerField(default=0)
@@ -57,11 +168,21 @@ class Chapter(models.Model):
     markdown_content = models.TextField(blank=True, null=True, help_text="Markdown content for chapter")
     is_preview = models.BooleanField(default=False)
     voice_file = models.FileField(upload_to='book_voices/', blank=True, null=True)
+    # Of markdown_content (or the legacy content), maintained on save
+    word_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['order', 'id']
         unique_together = ('book', 'order')
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'markdown_content', 'content'} & set(update_fields):
+            self.word_count = count_words(self.markdown_content or self.content)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'word_count'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.book.title} • {self.order}. {self.title}"
 
@@ -79,7 +200,7 @@ class YouTubeLink(models.Model):
         return f"{self.book.title} • {self.title}"
 
 
-class TableOfContentEntry(models.Model):
+class TableOfContentEntry(MaterializedPathModel):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='toc_entries')
     chapter = models.ForeignKey('Chapter', on_delete=models.SET_NULL, null=True, blank=True, related_name='toc_entries')
     title = models.CharField(max_length=200)
@@ -96,7 +217,7 @@ class TableOfContentEntry(models.Model):
         return f"{self.book.title} • L{self.level} • {self.title}"
 
 
-class BookContent(models.Model):
+class BookContent(MaterializedPathModel):
     """Nested table of contents structure for books."""
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='book_contents')
     title = models.CharField(max_length=200)
@@ -111,3 +232,42 @@ class BookContent(models.Model):
 
     def __str__(self):
         return f"{self.book.title} • {self.title}"
+
+
+class SearchDocument(models.Model):
+    """
+    Searchable plain text of a book (chapter=None: title, author and
+    description) or of one of its chapters. Maintained by books.search.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='search_documents')
+    chapter = models.ForeignKey(Chapter, on_delete=models.CASCADE, null=True, blank=True, related_name='search_documents')
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True, default='')
+    # PostgreSQL only (GIN-indexed); other databases use SearchTerm
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book'], condition=models.Q(chapter__isnull=True),
+                                    name='unique_book_search_document'),
+            models.UniqueConstraint(fields=['chapter'], condition=models.Q(chapter__isnull=False),
+                                    name='unique_chapter_search_document'),
+        ]
+
+    def __str__(self):
+        return f"{self.book.title} • {self.title}"
+
+
+class SearchTerm(models.Model):
+    """Inverted index entry used for search on databases without full-text search."""
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='terms')
+    term = models.CharField(max_length=64)
+    weight = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('document', 'term')
+        indexes = [models.Index(fields=['term', 'document'], name='books_searchterm_term_idx')]
+
+    def __str__(self):
+        return f"{self.term} → {self.document_id}"
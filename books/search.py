@@ -0,0 +1,268 @@
+"""
+Full-text search over the catalog.
+
+Every book has one SearchDocument for its title, author and description,
+and every chapter one for its title and the plain text of its rendered
+markdown. On PostgreSQL documents are matched through a GIN-indexed
+search_vector; on other databases (SQLite in development and tests) through
+the SearchTerm inverted index built here. Documents are refreshed when a
+book or chapter is saved (books.signals) and can be rebuilt with
+`python manage.py rebuild_search_index`.
+"""
+import html
+import math
+import re
+from collections import Counter
+from itertools import chain
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connections, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Left
+from django.utils.html import escape
+
+from .models import Book, BookAccess, Chapter, SearchDocument, SearchTerm
+from .utils.rendering import get_rendered
+
+# Title matches count this many times as much as body matches
+TITLE_WEIGHT = 4
+# tsvector values are limited to 1MB; longer bodies are indexed up to here
+MAX_VECTOR_CHARS = 500_000
+SNIPPET_CHARS = 160
+# Chapter columns chapter_document_fields reads
+CHAPTER_DOCUMENT_COLUMNS = (
+    'pk', 'book_id', 'title', 'content', 'markdown_content', 'rendered_html', 'rendered_toc', 'content_hash',
+)
+# PostgreSQL headline delimiters, swapped for <b>...</b> once the text
+# around them is escaped (private use characters, absent from real text)
+HEADLINE_START, HEADLINE_STOP = '\ue000', '\ue001'
+
+_TAG_RE = re.compile(r'<[^>]*>')
+_WORD_RE = re.compile(r'\w+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def search_config() -> str:
+    """PostgreSQL text search configuration (settings.SEARCH_CONFIG)."""
+    return getattr(settings, 'SEARCH_CONFIG', 'simple')
+
+
+def uses_postgres_search() -> bool:
+    return connections[SearchDocument.objects.db].vendor == 'postgresql'
+
+
+def html_to_text(rendered_html: str) -> str:
+    """Plain text of rendered HTML, with whitespace collapsed."""
+    text = html.unescape(_TAG_RE.sub(' ', rendered_html or ''))
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens of text, as stored in SearchTerm."""
+    return [token[:64] for token in _WORD_RE.findall((text or '').lower())]
+
+
+def book_document_fields(book: Book) -> dict:
+    return {
+        'title': book.title,
+        'body': ' '.join(part for part in (book.author, book.description) if part),
+    }
+
+
+def chapter_document_fields(chapter: Chapter) -> dict:
+    if chapter.markdown_content:
+        # Rendered on the fly for rows not rendered since the columns were added
+        body = html_to_text(get_rendered(chapter)['html'])
+    else:
+        body = chapter.content or ''
+    return {'title': chapter.title, 'body': body}
+
+
+def index_book(book: Book) -> SearchDocument:
+    return _update_document(book.pk, None, book_document_fields(book))
+
+
+def index_chapter(chapter: Chapter) -> SearchDocument:
+    return _update_document(chapter.book_id, chapter, chapter_document_fields(chapter))
+
+
+def index_chapters(chapter_ids: Iterable[int]) -> None:
+    """Refresh the documents of chapter_ids, e.g. after their HTML was re-rendered in bulk."""
+    for chapter in Chapter.objects.filter(pk__in=list(chapter_ids)).only(*CHAPTER_DOCUMENT_COLUMNS):
+        index_chapter(chapter)
+
+
+@transaction.atomic
+def _update_document(book_id: int, chapter: Optional[Chapter], fields: dict) -> SearchDocument:
+    # A chapter's document is found by the chapter alone: the chapter may
+    # have been moved to another book
+    if chapter is not None:
+        document = SearchDocument.objects.filter(chapter=chapter).first()
+    else:
+        document = SearchDocument.objects.filter(book_id=book_id, chapter=None).first()
+    if document is None:
+        document = SearchDocument.objects.create(book_id=book_id, chapter=chapter, **fields)
+        refresh_search_index([document])
+        return document
+
+    if document.book_id != book_id:
+        document.book_id = book_id
+        document.save(update_fields=['book', 'updated_at'])
+    if document.title != fields['title'] or document.body != fields['body']:
+        document.title, document.body = fields['title'], fields['body']
+        document.save(update_fields=['title', 'body', 'updated_at'])
+        refresh_search_index([document])
+    return document
+
+
+def refresh_search_index(documents: Iterable[SearchDocument]) -> None:
+    """Recompute the search vector (PostgreSQL) or terms of documents."""
+    documents = list(documents)
+    if not documents:
+        return
+    if uses_postgres_search():
+        config = search_config()
+        SearchDocument.objects.filter(pk__in=[document.pk for document in documents]).update(
+            search_vector=(
+                SearchVector('title', weight='A', config=config)
+                + SearchVector(Left('body', MAX_VECTOR_CHARS), weight='B', config=config)
+            ),
+        )
+        return
+
+    SearchTerm.objects.filter(document__in=documents).delete()
+    terms = []
+    for document in documents:
+        title_counts = Counter(tokenize(document.title))
+        body_tokens = tokenize(document.body)
+        body_counts = Counter(body_tokens)
+        # Dampen long documents so a short chapter about a term outranks a
+        # long one that mentions it in passing
+        norm = 1 + math.log1p(len(body_tokens))
+        for term in title_counts.keys() | body_counts.keys():
+            weight = (TITLE_WEIGHT * title_counts[term] + body_counts[term]) / norm
+            terms.append(SearchTerm(document=document, term=term, weight=weight))
+    SearchTerm.objects.bulk_create(terms, batch_size=1000)
+
+
+def search_documents(query: str, user):
+    """
+    SearchDocuments matching query that user may see, best match first.
+
+    Unpublished books are hidden from everyone but admins, and chapter text
+    is only searchable in preview chapters and books the user has unlocked.
+    Each result is annotated with `rank`; on PostgreSQL also `headline`.
+    """
+    documents = SearchDocument.objects.select_related('book', 'chapter').only(
+        'id', 'title', 'body',
+        'book__id', 'book__title', 'book__author', 'book__cover_image',
+        'chapter__id', 'chapter__title', 'chapter__order', 'chapter__is_preview',
+    )
+    if not (user.is_staff and user.is_superuser):
+        unlocked = BookAccess.objects.filter(user=user, book=OuterRef('book_id'))
+        documents = documents.filter(book__is_published=True).filter(
+            Q(chapter__isnull=True) | Q(chapter__is_preview=True) | Exists(unlocked)
+        )
+
+    if uses_postgres_search():
+        config = search_config()
+        search_query = SearchQuery(query, config=config, search_type='websearch')
+        return documents.defer('body').filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query),
+            headline=SearchHeadline(
+                'body', search_query, config=config, start_sel=HEADLINE_START, stop_sel=HEADLINE_STOP,
+                max_fragments=1, min_words=15, max_words=30,
+            ),
+        ).order_by('-rank', 'pk')
+
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return documents.none()
+    # Every term must match; rank is the sum of their weights
+    term_rows = SearchTerm.objects.filter(term__in=terms)
+    matching = term_rows.values('document').annotate(matched=Count('term')).filter(matched=len(terms))
+    rank = term_rows.filter(document=OuterRef('pk')).values('document').annotate(
+        total=Sum('weight'),
+    ).values('total')
+    return documents.filter(pk__in=matching.values('document')).annotate(
+        rank=Subquery(rank),
+    ).order_by('-rank', 'pk')
+
+
+def headline_html(headline: str) -> str:
+    """HTML of a PostgreSQL headline: escaped text with the matches in <b>...</b>."""
+    return escape(headline).replace(HEADLINE_START, '<b>').replace(HEADLINE_STOP, '</b>')
+
+
+def make_snippet(body: str, query: str, length: int = SNIPPET_CHARS) -> str:
+    """
+    HTML excerpt of body around the first query term: the text escaped
+    (bodies are plain text and may contain markup characters), terms in
+    <b>...</b> like headline_html.
+    """
+    terms = set(tokenize(query))
+    words = (match for match in _WORD_RE.finditer(body) if match.group().lower()[:64] in terms)
+    first = next(words, None)
+    if first is None:
+        return escape(body[:length]) + ('…' if len(body) > length else '')
+
+    start = max(0, first.start() - length // 3)
+    if start:
+        # Don't cut a word in half
+        space = body.find(' ', start, first.start())
+        start = space + 1 if space >= 0 else first.start()
+    end = min(len(body), start + length)
+
+    parts = []
+    position = start
+    for match in chain([first], words):
+        if match.end() > end:
+            break
+        parts.append(escape(body[position:match.start()]))
+        parts.append(f'<b>{escape(match.group())}</b>')
+        position = match.end()
+    parts.append(escape(body[position:end]))
+    return ('…' if start else '') + ''.join(parts) + ('…' if end < len(body) else '')
+
+
+@transaction.atomic
+def rebuild_search_index(chunk_size: int = 200) -> dict:
+    """
+    Recreate every SearchDocument from the books and chapters tables.
+
+    Runs in one transaction, so searches keep using the old index until the
+    new one is complete, and a failed rebuild leaves the old index in place.
+    """
+    SearchDocument.objects.all().delete()
+    counts = {'books': 0, 'chapters': 0}
+
+    for model, key, fields_for in (
+        (Book, 'books', book_document_fields),
+        (Chapter, 'chapters', chapter_document_fields),
+    ):
+        queryset = model.objects.order_by('pk')
+        if model is Chapter:
+            queryset = queryset.only(*CHAPTER_DOCUMENT_COLUMNS)
+        else:
+            queryset = queryset.only('pk', 'title', 'author', 'description')
+
+        batch = []
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            book_id = obj.pk if model is Book else obj.book_id
+            chapter_id = obj.pk if model is Chapter else None
+            batch.append(SearchDocument(book_id=book_id, chapter_id=chapter_id, **fields_for(obj)))
+            if len(batch) >= chunk_size:
+                _create_documents(batch)
+                counts[key] += len(batch)
+                batch = []
+        if batch:
+            _create_documents(batch)
+            counts[key] += len(batch)
+    return counts
+
+
+@transaction.atomic
+def _create_documents(documents: List[SearchDocument]) -> None:
+    refresh_search_index(SearchDocument.objects.bulk_create(documents))
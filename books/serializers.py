@@ -1,16 +1,54 @@
 from rest_framework import serializers
-from .models import Book, Chapter, YouTubeLink, BookAccess, TableOfContentEntry
-from .utils.markdown_processor import process_markdown
+from .fieldsets import SparseFieldsetMixin
+from .models import Book, Chapter, YouTubeLink, SearchDocument
+from .search import headline_html, make_snippet
+from .utils.loaders import BatchListSerializer, get_loader
+from .utils.rendering import get_rendered_html, get_rendered_toc
+from .utils.toc import get_manual_toc
 
 
-class BookListSerializer(serializers.ModelSerializer):
+# Columns of Book/Chapter that list and detail views may leave unloaded
+HEAVY_COLUMNS = ('content', 'markdown_content', 'rendered_html', 'rendered_toc', 'rendered_sections')
+# What the html/toc method fields read, see utils.rendering.get_rendered_html
+# and get_rendered_toc
+RENDERED_COLUMN_DEPENDENCIES = {
+    'html': ('markdown_content', 'content_hash', 'rendered_html'),
+    'toc': ('markdown_content', 'content_hash', 'rendered_toc'),
+}
+
+
+class ChapterOutlineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Chapter
+        fields = ('id', 'title', 'order', 'is_preview')
+
+
+class BookListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     is_locked = serializers.SerializerMethodField()
+    chapters = serializers.SerializerMethodField()
 
     class Meta:
         model = Book
         fields = (
-            'id', 'title', 'author', 'cover_image', 'price', 'is_published', 'is_locked',
+            'id', 'title', 'author', 'cover_image', 'price', 'is_published', 'is_locked', 'chapters',
         )
+        list_serializer_class = BatchListSerializer
+        expandable_fields = ('chapters',)
+        deferrable_columns = ('description',) + HEAVY_COLUMNS
+        column_dependencies = {'is_locked': (), 'chapters': ()}
+
+    def prime_loader(self, loader, books):
+        book_ids = [book.pk for book in books]
+        loader.prime('unlocked_book', book_ids)
+        if 'chapters' in self.fields:
+            loader.prime('book_chapter_outlines', book_ids)
+
+    def get_chapters(self, obj):
+        """Chapter outline (?expand=chapters); preview chapters only while locked."""
+        chapters = get_loader(self.context).load('book_chapter_outlines', obj.pk)
+        if self.get_is_locked(obj):
+            chapters = [chapter for chapter in chapters if chapter.is_preview]
+        return ChapterOutlineSerializer(chapters, many=True).data
 
     def get_is_locked(self, obj):
         request = self.context.get('request')
@@ -20,30 +58,51 @@ class BookListSerializer(serializers.ModelSerializer):
         # Admins (staff + superuser) have access to all books
         if user.is_staff and user.is_superuser:
             return False
-        return not BookAccess.objects.filter(user=user, book=obj).exists()
+        return not get_loader(self.context).load('unlocked_book', obj.pk)
+
+
+class PurchasedBookSerializer(BookListSerializer):
+    unlocked_at = serializers.DateTimeField(read_only=True)
 
+    class Meta(BookListSerializer.Meta):
+        fields = BookListSerializer.Meta.fields + ('unlocked_at',)
 
-class ChapterSerializer(serializers.ModelSerializer):
+
+class ChapterSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     html = serializers.SerializerMethodField()
     toc = serializers.SerializerMethodField()
     
     class Meta:
         model = Chapter
         fields = ('id', 'title', 'order', 'content', 'markdown_content', 'html', 'toc', 'is_preview', 'voice_file')
+        deferrable_columns = HEAVY_COLUMNS
+        column_dependencies = RENDERED_COLUMN_DEPENDENCIES
     
     def get_html(self, obj):
-        """Generate HTML from markdown_content"""
+        """Rendered HTML for markdown_content"""
         if not obj.markdown_content:
             return None
-        result = process_markdown(obj.markdown_content)
-        return result.get('html')
+        return get_rendered_html(obj)
     
     def get_toc(self, obj):
-        """Generate TOC from markdown_content"""
+        """TOC extracted from markdown_content"""
         if not obj.markdown_content:
             return []
-        result = process_markdown(obj.markdown_content)
-        return result.get('toc', [])
+        return get_rendered_toc(obj)
+
+
+class ChapterStubSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Chapter without its text: the book detail lists these, readers fetch chapters one by one."""
+    has_voice = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Chapter
+        fields = ('id', 'title', 'order', 'is_preview', 'has_voice', 'word_count')
+        deferrable_columns = HEAVY_COLUMNS
+        column_dependencies = {'has_voice': ('voice_file',)}
+
+    def get_has_voice(self, obj):
+        return bool(obj.voice_file)
 
 
 class YouTubeLinkSerializer(serializers.ModelSerializer):
@@ -52,7 +111,7 @@ class YouTubeLinkSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'url', 'order')
 
 
-class BookDetailSerializer(serializers.ModelSerializer):
+class BookDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     is_locked = serializers.SerializerMethodField()
     chapters = serializers.SerializerMethodField()
     youtube_links = YouTubeLinkSerializer(many=True, read_only=True)
@@ -66,65 +125,26 @@ class BookDetailSerializer(serializers.ModelSerializer):
             'markdown_content', 'html', 'toc', 'toc_position', 'price', 'is_published', 'is_locked', 
             'chapters', 'youtube_links',
         )
+        deferrable_columns = HEAVY_COLUMNS
+        column_dependencies = dict(RENDERED_COLUMN_DEPENDENCIES, is_locked=(), chapters=(), youtube_links=())
     
     def get_html(self, obj):
-        """Generate HTML from markdown_content"""
+        """Rendered HTML for markdown_content"""
         if not obj.markdown_content:
             return None
-        result = process_markdown(obj.markdown_content)
-        return result.get('html')
+        return get_rendered_html(obj)
     
     def get_toc(self, obj):
         """Get TOC from manual entries (TableOfContentEntry) or auto-generate from markdown"""
-        # Check if manual TOC entries exist
-        manual_entries = TableOfContentEntry.objects.filter(book=obj).order_by('order', 'id')
-        
-        if manual_entries.exists():
-            # Return manual TOC entries with hierarchical numbering
-            return self._build_manual_toc(manual_entries)
+        # Manual TOC entries with hierarchical numbering, cached per book
+        manual_toc = get_manual_toc(obj.pk)
+        if manual_toc:
+            return manual_toc
         
         # Fallback to auto-generated TOC from markdown
         if not obj.markdown_content:
             return []
-        result = process_markdown(obj.markdown_content)
-        return result.get('toc', [])
-    
-    def _build_manual_toc(self, entries):
-        """Build hierarchical TOC from manual entries with numbering"""
-        # Build tree structure
-        entries_list = list(entries)
-        root_entries = [entry for entry in entries_list if entry.parent is None]
-        
-        def build_tree(entry_list, parent_number=""):
-            """Recursively build TOC tree with numbers"""
-            toc_list = []
-            for idx, entry in enumerate(entry_list):
-                # Calculate display number (1, 1.1, 1.2.1, etc.)
-                number = parent_number + str(idx + 1) if parent_number else str(idx + 1)
-                
-                # Get children
-                children = [e for e in entries_list if e.parent_id == entry.id]
-                
-                # Create TOC entry
-                toc_entry = {
-                    'id': entry.anchor_id or f'toc-entry-{entry.id}',
-                    'title': entry.title,
-                    'level': entry.level,
-                    'number': number,
-                }
-                
-                # Add children if any
-                if children:
-                    sorted_children = sorted(children, key=lambda e: e.order)
-                    toc_entry['children'] = build_tree(sorted_children, number + '.')
-                
-                toc_list.append(toc_entry)
-            
-            return toc_list
-        
-        # Sort root entries by order
-        sorted_roots = sorted(root_entries, key=lambda e: e.order)
-        return build_tree(sorted_roots)
+        return get_rendered_toc(obj)
 
     def get_is_locked(self, obj):
         request = self.context.get('request')
@@ -134,7 +154,8 @@ class BookDetailSerializer(serializers.ModelSerializer):
         # Admins (staff + superuser) have access to all books
         if user.is_staff and user.is_superuser:
             return False
-        return not BookAccess.objects.filter(user=user, book=obj).exists()
+        # Memoized by the loader, so get_chapters doesn't query again
+        return not get_loader(self.context).load('unlocked_book', obj.pk)
 
     def get_chapters(self, obj):
         request = self.context.get('request')
@@ -148,11 +169,46 @@ class BookDetailSerializer(serializers.ModelSerializer):
                 qs = obj.chapters.filter(is_preview=True)
             else:
                 qs = obj.chapters.all()
-        return ChapterSerializer(qs, many=True).data
+        # Stubs unless ?expand=chapters; readers load chapter text through
+        # the chapter endpoint as they go
+        serializer_class = ChapterSerializer if 'chapters' in self.selection.expand else ChapterStubSerializer
+        selection = self.nested_selection('chapters')
+        qs = qs.defer(*serializer_class.deferred_columns(selection))
+        return serializer_class(qs, many=True, selection=selection).data
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        # Hide content_file when locked
-        if data.get('is_locked'):
+        # Hide content_file when locked (even if is_locked itself wasn't requested)
+        if 'content_file' in data and self.get_is_locked(instance):
             data['content_file'] = None
         return data
+
+
+class SearchBookSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ('id', 'title', 'author', 'cover_image')
+
+
+class SearchChapterSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Chapter
+        fields = ('id', 'title', 'order')
+
+
+class SearchResultSerializer(serializers.ModelSerializer):
+    book = SearchBookSerializer(read_only=True)
+    chapter = SearchChapterSerializer(read_only=True)
+    snippet = serializers.SerializerMethodField()
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = SearchDocument
+        fields = ('book', 'chapter', 'title', 'snippet', 'rank')
+
+    def get_snippet(self, obj):
+        """Matching excerpt (HTML) with query terms in <b>...</b>"""
+        headline = getattr(obj, 'headline', None)
+        if headline is not None:
+            return headline_html(headline)
+        return make_snippet(obj.body, self.context.get('query', ''))
@@ -0,0 +1,69 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .entitlements import invalidate_entitlements
+from .models import Book, BookAccess, Chapter, TableOfContentEntry, YouTubeLink
+from .search import index_book, index_chapter
+from .utils.catalog import invalidate_home_snapshot
+from .utils.toc import invalidate_manual_toc
+
+# Fields a search document is built from (see books.search)
+BOOK_SEARCH_FIELDS = {'title', 'author', 'description'}
+CHAPTER_SEARCH_FIELDS = {'title', 'content', 'markdown_content', 'rendered_html'}
+
+
+@receiver(post_save, sender=Book, dispatch_uid='books_index_book')
+def update_book_search_document(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not BOOK_SEARCH_FIELDS & set(update_fields)):
+        return
+    index_book(instance)
+
+
+@receiver(post_save, sender=Book, dispatch_uid='books_book_saved_home')
+@receiver(post_delete, sender=Book, dispatch_uid='books_book_deleted_home')
+def invalidate_home_catalog(sender, instance, **kwargs):
+    invalidate_home_snapshot()
+
+
+@receiver(post_save, sender=Chapter, dispatch_uid='books_index_chapter')
+def update_chapter_search_document(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not CHAPTER_SEARCH_FIELDS & set(update_fields)):
+        return
+    index_chapter(instance)
+
+
+@receiver(post_save, sender=BookAccess, dispatch_uid='books_grant_access')
+@receiver(post_delete, sender=BookAccess, dispatch_uid='books_revoke_access')
+def invalidate_user_entitlements(sender, instance, **kwargs):
+    invalidate_entitlements([instance.user_id])
+
+
+@receiver(pre_save, sender=TableOfContentEntry, dispatch_uid='books_toc_entry_moved')
+def invalidate_previous_book_toc(sender, instance, raw=False, **kwargs):
+    # An entry moved to another book also changes the TOC it left
+    if raw or instance.pk is None:
+        return
+    previous_book_id = sender.objects.filter(pk=instance.pk).values_list('book_id', flat=True).first()
+    if previous_book_id is not None and previous_book_id != instance.book_id:
+        invalidate_manual_toc([previous_book_id])
+        Book.touch([previous_book_id])
+
+
+@receiver(post_save, sender=TableOfContentEntry, dispatch_uid='books_toc_entry_saved')
+@receiver(post_delete, sender=TableOfContentEntry, dispatch_uid='books_toc_entry_deleted')
+def invalidate_book_toc(sender, instance, **kwargs):
+    invalidate_manual_toc([instance.book_id])
+
+
+@receiver(post_save, sender=Chapter, dispatch_uid='books_chapter_saved_touch')
+@receiver(post_delete, sender=Chapter, dispatch_uid='books_chapter_deleted_touch')
+@receiver(post_save, sender=TableOfContentEntry, dispatch_uid='books_toc_entry_saved_touch')
+@receiver(post_delete, sender=TableOfContentEntry, dispatch_uid='books_toc_entry_deleted_touch')
+@receiver(post_save, sender=YouTubeLink, dispatch_uid='books_youtube_link_saved_touch')
+@receiver(post_delete, sender=YouTubeLink, dispatch_uid='books_youtube_link_deleted_touch')
+def touch_book(sender, instance, raw=False, origin=None, **kwargs):
+    # The book's detail/content validators (updated_at) cover these rows;
+    # nothing to bump when they go because the book itself is deleted
+    if raw or isinstance(origin, Book):
+        return
+    Book.touch([instance.book_id])
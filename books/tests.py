@@ -1,12 +1,57 @@
-from django.test import TestCase
+import json
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Model
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 from accounts.models import User
-from .models import Book, BookAccess, Chapter
+from .models import Book, BookAccess, BookContent, Chapter, SearchDocument, TableOfContentEntry
+from .utils.markdown_processor import (
+    process_markdown, render_cache, render_markdown_reference, render_markdown_single_pass,
+)
+from .entitlements import (
+    BOOK_LOCKED, BOOK_NOT_FOUND, BOOK_UNPUBLISHED, Entitlements, get_entitlements, get_readable_book,
+    invalidate_entitlements,
+)
+from .search import HEADLINE_START, HEADLINE_STOP, headline_html, make_snippet
+from .benchmarks import compare_results, generate_corpus, run_benchmarks
+from .utils.highlighting import highlight_cache
+from .utils.incremental import render_markdown_incremental, split_blocks
+from .utils.render_cache import RenderCache
+from .utils.sections import iter_section_html
+from .utils.toc import build_manual_toc, get_manual_toc
+from .utils.tree_paths import path_segment
+from .utils.versioned_cache import VersionedCache
+
+
+@contextmanager
+def forbid_deferred_loads():
+    """Fail when a deferred column is loaded (one query per object) inside the block."""
+    loads = []
+    refresh_from_db = Model.refresh_from_db
+
+    def record(instance, using=None, fields=None, **kwargs):
+        loads.append(f'{type(instance).__name__}.{",".join(fields or ["*"])}')
+        return refresh_from_db(instance, using=using, fields=fields, **kwargs)
+
+    with mock.patch.object(Model, 'refresh_from_db', record):
+        yield
+    if loads:
+        raise AssertionError(f'Deferred columns loaded: {", ".join(loads)}')
 
 
 class BookAccessTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = User.objects.create_user(email='u@example.com', password='pass')
         self.book = Book.objects.create(title='B', author='A', description='D', is_published=True)
@@ -42,3 +87,1132 @@ class BookAccessTests(TestCase):
         url = reverse('book-list-create')
         res = self.client.get(url)
         self.assertEqual(res.status_code, 403)
+
+
+class RenderCacheTests(TestCase):
+    def setUp(self):
+        render_cache.clear()
+
+    def test_repeated_render_hits_cache(self):
+        first = process_markdown('# Title\n\nBody')
+        second = process_markdown('# Title\n\nBody')
+        self.assertEqual(first, second)
+        stats = render_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_returned_toc_is_a_copy(self):
+        process_markdown('# Title')['toc'][0]['title'] = 'Changed'
+        self.assertEqual(process_markdown('# Title')['toc'][0]['title'], 'Title')
+
+    def test_lru_evicts_over_budget(self):
+        cache = RenderCache(max_bytes=10, sizeof=len)
+        cache.set('a', 'xxxxxx')
+        cache.set('b', 'yyyyyy')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'yyyyyy')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class RenderedContentTests(TestCase):
+    def test_save_renders_markdown(self):
+        book = Book.objects.create(title='B', author='A', description='D', markdown_content='# Intro')
+        self.assertIn('id="intro"', book.rendered_html)
+        self.assertEqual(book.rendered_toc, [{'id': 'intro', 'title': 'Intro', 'level': 1}])
+        self.assertTrue(book.content_hash)
+
+    def test_changed_source_is_rerendered(self):
+        book = Book.objects.create(title='B', author='A', description='D', markdown_content='# Intro')
+        book.markdown_content = '# Outro'
+        book.save(update_fields=['markdown_content'])
+        book.refresh_from_db()
+        self.assertEqual(book.rendered_toc[0]['id'], 'outro')
+
+    def test_rerender_command_backfills(self):
+        book = Book.objects.create(title='B', author='A', description='D', markdown_content='# Intro')
+        Book.objects.filter(pk=book.pk).update(rendered_html='', rendered_toc=[], content_hash='')
+        updated_at = Book.objects.get(pk=book.pk).updated_at
+        call_command('rerender_content', stdout=StringIO())
+        book.refresh_from_db()
+        self.assertIn('id="intro"', book.rendered_html)
+        # A new version, so clients don't revalidate the old HTML
+        self.assertGreater(book.updated_at, updated_at)
+
+
+class SinglePassRenderCompatibilityTests(TestCase):
+    """render_markdown_single_pass must match the BeautifulSoup reference byte for byte."""
+
+    SAMPLES = [
+        '# Intro\n\n## Intro\n\n## Intro\n\n# Intro-1\n\ntext & more < > "quotes" \'single\'',
+        '# \n\n## ***\n\n# !!!\n\n## ¿Qué?\n\n### Ünïcödé heading',
+        '# Heading with *emphasis* and **bold** and [link](http://x.com "t")\n\n> ## Quoted\n\n- item\n- # in list',
+        'Setext\n======\n\nSub\n---\n\n##### h5\n\n###### h6',
+        '# A &copy; `x<y` "q"\n\n```python\nprint("hi" if a<b else \'x\')\n```\n\n    indented "x"',
+        '# A &nbsp; B &#169; &#x27; &amp; &lt;',
+        'line  \nbreak\n\n---\n\n![alt "x"](a.png "T \'x\'")',
+        '[a](http://x.com/?a=1&b=2 "He said \\"hi\\" it\'s")',
+        '```\nno lang & <tag> "q" \'s\' &quot;\n\n\n  spaced\n```',
+        '`code &amp; stuff` and `&copy;` and `<b>`',
+        '[TOC]\n\n# One\n\n## Two',
+        '\\&copy; escaped \\*star\\*',
+        '# Dup\n# Dup\n# Dup-1\n# Dup\n# dup',
+        '# a `  ` b\n\n# a *x*&#32;&#32;*y* b',
+    ]
+    # Documents the single-pass renderer hands to the reference renderer
+    REFERENCE_ONLY = [
+        '<div>raw</div>\n\n# after',
+        'mail <me@example.com>',
+        'inline <b>html</b>',
+    ]
+
+    def test_samples_match_reference(self):
+        for text in self.SAMPLES:
+            with self.subTest(text=text):
+                result = render_markdown_single_pass(text)
+                self.assertIsNotNone(result)
+                self.assertEqual(result, render_markdown_reference(text))
+
+    def test_reference_only_documents_fall_back(self):
+        for text in self.REFERENCE_ONLY:
+            with self.subTest(text=text):
+                self.assertIsNone(render_markdown_single_pass(text))
+                self.assertEqual(process_markdown(text), render_markdown_reference(text))
+
+    def test_generated_documents_match_reference(self):
+        rng = random.Random(7)
+        blocks = self.SAMPLES + self.REFERENCE_ONLY + ['- a\n- b\n\n- c', '1. x\n2. y', '> quote']
+        for _ in range(100):
+            text = '\n\n'.join(rng.choice(blocks) for _ in range(rng.randint(1, 8)))
+            with self.subTest(text=text):
+                self.assertEqual(process_markdown(text), render_markdown_reference(text))
+
+
+class IncrementalRenderTests(TestCase):
+    """Block-level rendering must produce exactly what a full render does."""
+
+    SAMPLES = [
+        '# Intro\n\ntext\n\n# Intro\n\n## Intro\n\n# Intro-1\n\n# Intro',
+        '# Code\n\n```python\n# not a heading\n\n# still code\n```\n\n# Code',
+        'para\n# heading right after a paragraph\n\n> # quoted\n\n# quoted',
+        '# Empty next\n\n#\n\n##### h5\n\n# Empty next',
+        '```\nunclosed fence\n\n# real heading',
+    ]
+    # Documents that can't be split and are rendered whole
+    WHOLE_DOCUMENTS = [
+        '[TOC]\n\n# One\n\n# Two',
+        '# One\n\n[link][ref]\n\n# Two\n\n[ref]: http://x.com',
+        '# One\n\n<div>\n\n# inside raw html\n\n</div>',
+    ]
+
+    def setUp(self):
+        render_cache.clear()
+
+    def test_matches_full_render(self):
+        for text in self.SAMPLES + self.WHOLE_DOCUMENTS:
+            with self.subTest(text=text):
+                self.assertEqual(render_markdown_incremental(text), render_markdown_reference(text))
+
+    def test_unsplittable_documents(self):
+        for text in self.WHOLE_DOCUMENTS:
+            with self.subTest(text=text):
+                self.assertIsNone(split_blocks(text))
+
+    def test_edit_only_renders_changed_block(self):
+        chapters = [f'# Chapter {n}\n\nBody of chapter {n}.' for n in range(5)]
+        render_markdown_incremental('\n\n'.join(chapters))
+        misses = render_cache.stats()['misses']
+
+        chapters[2] = '# Chapter 2\n\nEdited body.'
+        text = '\n\n'.join(chapters)
+        self.assertEqual(render_markdown_incremental(text), render_markdown_reference(text))
+        self.assertEqual(render_cache.stats()['misses'], misses + 1)
+
+    def test_admin_preview(self):
+        client = APIClient()
+        url = reverse('admin-markdown-preview')
+        text = '# Intro\n\n# Intro'
+        res = client.post(url, {'markdown_content': text}, format='json')
+        self.assertEqual(res.status_code, 401)
+
+        admin = User.objects.create_user(email='admin@example.com', password='pass', is_staff=True, is_superuser=True)
+        client.force_authenticate(admin)
+        res = client.post(url, {'markdown_content': text}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, render_markdown_reference(text))
+
+
+class HighlightCacheTests(TestCase):
+    def setUp(self):
+        render_cache.clear()
+        highlight_cache.clear()
+
+    def test_snippet_highlighted_once(self):
+        snippet = '```python\nprint("hi")\n```'
+        first = process_markdown('# One\n\n' + snippet)
+        process_markdown('# Two\n\n' + snippet)
+        stats = highlight_cache.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (1, 1))
+        self.assertIn('<span class="nb">print</span>', first['html'])
+
+    def test_stylesheet_is_cacheable(self):
+        url = reverse('highlight-stylesheet')
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'text/css; charset=utf-8')
+        self.assertIn('.codehilite .k', res.content.decode())
+        self.assertIn('public', res['Cache-Control'])
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+
+
+class BookContentSectionTests(TestCase):
+    MARKDOWN = 'Opening words.\n\n# Part One\n\nFirst.\n\n## Chapter A\n\n> ## Quoted heading\n\n### Detail\n\nMore.\n\n# Part Two\n\nLast.'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.book = Book.objects.create(title='B', author='A', description='D', markdown_content=self.MARKDOWN)
+        self.client.force_authenticate(self.user)
+
+    def test_section_index_splits_at_top_level_h1_h2(self):
+        self.assertEqual(
+            [section['id'] for section in self.book.rendered_sections],
+            ['_intro', 'part-one', 'chapter-a', 'part-two'],
+        )
+        html = ''.join(
+            self.book.rendered_html[section['start']:section['end']] for section in self.book.rendered_sections
+        )
+        self.assertEqual(html, self.book.rendered_html)
+
+    def test_sections_require_access(self):
+        res = self.client.get(reverse('book-content-sections', args=[self.book.id]))
+        self.assertEqual(res.status_code, 403)
+        res = self.client.get(reverse('book-content-section', args=[self.book.id, 'part-one']))
+        self.assertEqual(res.status_code, 403)
+
+    def test_section_list_and_detail(self):
+        BookAccess.objects.create(user=self.user, book=self.book)
+        res = self.client.get(reverse('book-content-sections', args=[self.book.id]))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['sections'][1]['title'], 'Part One')
+
+        res = self.client.get(reverse('book-content-section', args=[self.book.id, 'chapter-a']))
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.data['html'].startswith('<h2 id="chapter-a">'))
+        self.assertIn('quoted-heading', res.data['html'])
+        self.assertEqual((res.data['previous'], res.data['next']), ('part-one', 'part-two'))
+
+        res = self.client.get(reverse('book-content-section', args=[self.book.id, 'missing']))
+        self.assertEqual(res.status_code, 404)
+
+    def test_streamed_content_matches_full_response(self):
+        BookAccess.objects.create(user=self.user, book=self.book)
+        url = reverse('book-content', args=[self.book.id])
+        full = self.client.get(url)
+        streamed = self.client.get(url, {'stream': '1'})
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(json.loads(b''.join(streamed.streaming_content)), full.json())
+
+        streamed = self.client.get(url, HTTP_ACCEPT='application/json; stream=true')
+        self.assertTrue(streamed.streaming)
+
+    def test_streamed_html_chunks_cover_document(self):
+        chunks = iter_section_html(self.book, self.book.rendered_sections, chunk_size=7)
+        self.assertEqual(''.join(chunks), self.book.rendered_html)
+
+
+class RenderCatalogCommandTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='B', author='A', description='D', markdown_content='# Intro')
+        self.other = Book.objects.create(title='C', author='A', description='D', markdown_content='# Other')
+        Chapter.objects.create(book=self.book, title='One', order=1, content='', markdown_content='## Part')
+        Book.objects.update(rendered_html='', rendered_toc=[], content_hash='')
+        Chapter.objects.update(rendered_html='', rendered_toc=[], content_hash='')
+
+    def test_renders_selected_books_with_worker_pool(self):
+        out = StringIO()
+        call_command('render_catalog', '--workers', '2', '--book-ids', str(self.book.pk), stdout=out)
+        self.book.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertIn('id="intro"', self.book.rendered_html)
+        self.assertEqual(self.other.rendered_html, '')
+        self.assertIn('id="part"', Chapter.objects.get().rendered_html)
+        self.assertIn('Book: checked 1, rendered 1, failed 0', out.getvalue())
+
+    def test_since_selects_recently_changed_books(self):
+        week_ago = timezone.now() - timedelta(days=7)
+        # Created long ago but edited recently, and the other way round
+        Book.objects.filter(pk=self.book.pk).update(created_at=week_ago - timedelta(days=30))
+        Book.objects.filter(pk=self.other.pk).update(updated_at=week_ago - timedelta(days=1))
+        call_command('render_catalog', '--workers', '1', '--since', week_ago.date().isoformat(), stdout=StringIO())
+        self.book.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertIn('id="intro"', self.book.rendered_html)
+        self.assertEqual(self.other.rendered_html, '')
+
+    def test_chapter_renders_bump_the_book_version(self):
+        call_command('render_catalog', '--workers', '1', '--book-ids', str(self.book.pk), stdout=StringIO())
+        Book.objects.filter(pk=self.book.pk).update(updated_at=timezone.now() - timedelta(days=1))
+        # Only the chapter is re-rendered this time
+        Chapter.objects.update(rendered_html='', content_hash='')
+        call_command('render_catalog', '--workers', '1', '--book-ids', str(self.book.pk), stdout=StringIO())
+        self.book.refresh_from_db()
+        self.assertGreater(self.book.updated_at, timezone.now() - timedelta(minutes=1))
+
+    def test_dry_run_writes_nothing(self):
+        call_command('render_catalog', '--workers', '1', '--dry-run', stdout=StringIO())
+        self.assertFalse(Book.objects.exclude(rendered_html='').exists())
+
+
+class MarkdownBenchmarkTests(TestCase):
+    def test_corpus_is_deterministic(self):
+        corpus = generate_corpus(4096)
+        self.assertEqual(corpus, generate_corpus(4096))
+        self.assertGreaterEqual(len(corpus.encode('utf-8')), 4096)
+        self.assertIn('```', corpus)
+
+    def test_compare_flags_regressions(self):
+        baseline = run_benchmarks([2048], repeat=1)
+        self.assertEqual(set(baseline['results']['2048']), {'convert', 'toc', 'serialize', 'pipeline'})
+        self.assertEqual(compare_results(baseline, baseline), [])
+
+        slower = json.loads(json.dumps(baseline))
+        slower['results']['2048']['toc']['p50'] *= 2
+        regressions = compare_results(slower, baseline, threshold=0.5)
+        self.assertEqual([(r['stage'], r['metric']) for r in regressions], [('toc', 'p50')])
+
+
+class BookSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+        self.book = Book.objects.create(title='Harbor Lights', author='Ann Writer', description='A novel', is_published=True)
+        self.preview = Chapter.objects.create(
+            book=self.book, title='Arrival', order=1, content='', is_preview=True,
+            markdown_content='# Arrival\n\nThe lantern keeper walked to the **harbor**.',
+        )
+        self.locked = Chapter.objects.create(
+            book=self.book, title='Storm', order=2, content='', is_preview=False,
+            markdown_content='The lantern went out in the storm.',
+        )
+        Book.objects.create(title='Hidden Harbor', author='X', description='Draft', is_published=False)
+
+    def search(self, query):
+        return self.client.get(reverse('book-search'), {'q': query})
+
+    def test_index_updates_on_save(self):
+        self.assertEqual(SearchDocument.objects.filter(book=self.book).count(), 3)
+        self.preview.markdown_content = 'Now about a lighthouse.'
+        self.preview.save()
+        res = self.search('lighthouse')
+        self.assertEqual([r['chapter']['id'] for r in res.data['results']], [self.preview.id])
+
+    def test_ranked_and_respects_visibility(self):
+        res = self.search('harbor')
+        self.assertEqual(res.status_code, 200)
+        results = res.data['results']
+        # Title match first; the unpublished book is not searched
+        self.assertEqual([(r['book']['id'], r['chapter']) for r in results][0], (self.book.id, None))
+        self.assertEqual({r['book']['id'] for r in results}, {self.book.id})
+        self.assertIn('<b>harbor</b>', results[1]['snippet'])
+
+    def test_locked_chapters_need_access(self):
+        res = self.search('lantern')
+        self.assertEqual([r['chapter']['id'] for r in res.data['results']], [self.preview.id])
+
+        BookAccess.objects.create(user=self.user, book=self.book)
+        res = self.search('lantern')
+        self.assertEqual({r['chapter']['id'] for r in res.data['results']}, {self.preview.id, self.locked.id})
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(len(self.search('lantern storm').data['results']), 0)
+        BookAccess.objects.create(user=self.user, book=self.book)
+        self.assertEqual(len(self.search('lantern storm').data['results']), 1)
+
+    def test_query_required_and_blocked_user_denied(self):
+        self.assertEqual(self.search('').status_code, 400)
+        self.user.is_blocked = True
+        self.user.save()
+        self.assertEqual(self.search('harbor').status_code, 403)
+
+    def test_rebuild_command(self):
+        SearchDocument.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 2 books and 2 chapters', out.getvalue())
+        self.assertEqual(len(self.search('harbor').data['results']), 2)
+
+    def test_document_follows_a_moved_chapter(self):
+        other = Book.objects.create(title='Tides', author='B', description='D', is_published=True)
+        self.preview.book = other
+        self.preview.save()
+        document = SearchDocument.objects.get(chapter=self.preview)
+        self.assertEqual(document.book_id, other.id)
+        results = self.search('lantern').data['results']
+        self.assertEqual([(r['book']['id'], r['chapter']['id']) for r in results], [(other.id, self.preview.id)])
+
+    def test_failed_rebuild_keeps_the_index(self):
+        with mock.patch('books.search.chapter_document_fields', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(SearchDocument.objects.count(), 4)
+        self.assertEqual(len(self.search('harbor').data['results']), 2)
+
+    def test_unrendered_chapters_are_indexed(self):
+        # A chapter saved before the rendered columns existed
+        Chapter.objects.filter(pk=self.locked.pk).update(rendered_html='', rendered_toc=[], content_hash='')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertIn('storm', SearchDocument.objects.get(chapter=self.locked).body)
+
+    def test_rerender_commands_reindex(self):
+        BookAccess.objects.create(user=self.user, book=self.book)
+        for word, command in (('beacon', ['rerender_content']), ('lighthouse', ['render_catalog', '--workers', '1'])):
+            # Changed without save(), as bulk imports do
+            Chapter.objects.filter(pk=self.locked.pk).update(markdown_content=f'The {word}.')
+            call_command(*command, stdout=StringIO())
+            self.assertEqual([r['chapter']['id'] for r in self.search(word).data['results']], [self.locked.id])
+
+    def test_snippet(self):
+        body = 'word ' * 50 + 'the Harbor at night ' + 'word ' * 50
+        snippet = make_snippet(body, 'harbor')
+        self.assertIn('<b>Harbor</b>', snippet)
+        self.assertTrue(snippet.startswith('…') and snippet.endswith('…'))
+
+    def test_snippet_escapes_markup_in_content(self):
+        chapter = Chapter.objects.create(
+            book=self.book, title='Code', order=3, content='', is_preview=True,
+            markdown_content='The harbor uses `<script>alert(1)</script>` &amp; <img src=x onerror=alert(1)>',
+        )
+        results = self.search('harbor').data['results']
+        snippet = next(r['snippet'] for r in results if r['chapter'] and r['chapter']['id'] == chapter.id)
+        self.assertIn('<b>harbor</b>', snippet)
+        self.assertNotIn('<script', snippet)
+        self.assertNotIn('<img', snippet)
+        self.assertIn('&lt;script&gt;', snippet)
+
+        headline = f'x &lt;script&gt; <script> {HEADLINE_START}harbor{HEADLINE_STOP}'
+        self.assertEqual(headline_html(headline), 'x &amp;lt;script&amp;gt; &lt;script&gt; <b>harbor</b>')
+
+
+class BatchLoaderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.admin = User.objects.create_user(email='a@example.com', password='pass', is_staff=True, is_superuser=True)
+
+    def create_books(self, count):
+        for n in range(count):
+            book = Book.objects.create(title=f'B{n}', author='A', description='D', is_published=True)
+            Chapter.objects.create(book=book, title='C', order=1, content='C')
+            if n % 2:
+                BookAccess.objects.create(user=self.user, book=book)
+
+    def count_queries(self, user, url):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return res, len(queries)
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        self.create_books(2)
+        _, few = self.count_queries(self.user, reverse('book-list-create'))
+        self.create_books(6)
+        res, many = self.count_queries(self.user, reverse('book-list-create'))
+        self.assertEqual(few, many)
+        locked = {book['title']: book['is_locked'] for book in res.data['results']}
+        self.assertFalse(locked['B1'])
+        self.assertTrue(locked['B0'])
+
+        _, purchased = self.count_queries(self.user, reverse('user-purchased-books'))
+        self.assertLessEqual(purchased, few)
+
+    def test_admin_book_counts_batched(self):
+        self.create_books(2)
+        _, few = self.count_queries(self.admin, reverse('admin-book-list'))
+        self.create_books(6)
+        res, many = self.count_queries(self.admin, reverse('admin-book-list'))
+        self.assertEqual(few, many)
+        self.assertEqual({book['chapters_count'] for book in res.data['results']}, {1})
+        self.assertEqual(sum(book['users_count'] for book in res.data['results']), 4)
+
+    def test_admin_book_counts_annotated(self):
+        self.create_books(3)
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(2):
+            res = self.client.get(reverse('admin-book-list'))
+        first = res.data['results'][0]
+        self.assertNotIn('markdown_content', first)
+        self.assertEqual((first['chapters_count'], first['toc_entries_count']), (1, 0))
+
+        book = Book.objects.get(title='B1')
+        with self.assertNumQueries(1):
+            res = self.client.get(reverse('admin-book-detail', args=[book.id]))
+        self.assertIn('markdown_content', res.data)
+        self.assertEqual((res.data['chapters_count'], res.data['users_count']), (1, 1))
+
+        # Not annotated: counted through the loader instead
+        res = self.client.patch(reverse('admin-book-update', args=[book.id]), {'title': 'Renamed'}, format='json')
+        self.assertEqual((res.data['chapters_count'], res.data['users_count']), (1, 1))
+
+    def test_detail_checks_access_once(self):
+        self.create_books(2)
+        book = Book.objects.get(title='B1')
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(reverse('book-detail', args=[book.id]))
+        access_queries = [q for q in queries.captured_queries if 'books_bookaccess' in q['sql']]
+        self.assertEqual(len(access_queries), 1)
+        self.assertFalse(res.data['is_locked'])
+        self.assertEqual(len(res.data['chapters']), 1)
+
+
+class EntitlementTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.admin = User.objects.create_user(email='a@example.com', password='pass', is_staff=True, is_superuser=True)
+        self.books = [
+            Book.objects.create(title=f'B{n}', author='A', description='D', is_published=True) for n in range(3)
+        ]
+
+    @override_settings(ENTITLEMENT_CACHE={'CACHE_ALIAS': 'default', 'LOCAL_TIMEOUT': 60})
+    def test_cached_after_first_lookup(self):
+        BookAccess.objects.create(user=self.user, book=self.books[1])
+        self.assertEqual(list(get_entitlements(self.user)), [self.books[1].id])
+        with self.assertNumQueries(0):
+            entitlements = get_entitlements(self.user)
+        self.assertIn(self.books[1].id, entitlements)
+        self.assertNotIn(self.books[0].id, entitlements)
+
+    def test_not_cached_in_a_process_local_cache(self):
+        # Other workers would never see the invalidation of a revoke
+        get_entitlements(self.user)
+        with self.assertNumQueries(1):
+            get_entitlements(self.user)
+
+    def test_grant_and_revoke_invalidate(self):
+        self.assertEqual(len(get_entitlements(self.user)), 0)
+        access = BookAccess.objects.create(user=self.user, book=self.books[0])
+        self.assertIn(self.books[0].id, get_entitlements(self.user))
+        access.delete()
+        self.assertNotIn(self.books[0].id, get_entitlements(self.user))
+
+    def test_bulk_access_view_invalidates(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        url = reverse('admin-user-book-access')
+        book_ids = [book.id for book in self.books]
+        self.assertEqual(len(get_entitlements(self.user)), 0)
+
+        res = client.post(url, {'user_ids': [self.user.id], 'book_ids': book_ids, 'action': 'grant'}, format='json')
+        self.assertEqual(res.data['granted'], 3)
+        self.assertEqual(list(get_entitlements(self.user)), sorted(book_ids))
+
+        res = client.post(url, {'user_ids': [self.user.id], 'book_ids': book_ids[:2], 'action': 'revoke'}, format='json')
+        self.assertEqual(res.data['revoked'], 2)
+        self.assertEqual(list(get_entitlements(self.user)), book_ids[2:])
+
+    def test_compact_representation(self):
+        entitlements = Entitlements.from_ids([9, 3, 3, 2 ** 40])
+        self.assertEqual(len(entitlements.to_bytes()), 24)
+        restored = Entitlements.from_bytes(entitlements.to_bytes())
+        self.assertEqual(list(restored), [3, 9, 2 ** 40])
+        self.assertIn(2 ** 40, restored)
+        self.assertNotIn(4, restored)
+
+
+class PurchasedBooksTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def grant(self, count):
+        for n in range(count):
+            book = Book.objects.create(title=f'B{n}', author='A', description='D', is_published=True)
+            access = BookAccess.objects.create(user=self.user, book=book)
+            # Distinct, increasing unlock dates
+            BookAccess.objects.filter(pk=access.pk).update(unlocked_at=timezone.now() + timedelta(minutes=n))
+        Book.objects.create(title='Not unlocked', author='A', description='D', is_published=True)
+
+    def test_newest_unlocks_first_with_cursor(self):
+        self.grant(25)
+        res = self.client.get(reverse('user-purchased-books'))
+        self.assertEqual(res.status_code, 200)
+        results = res.data['results']
+        self.assertEqual(len(results), 20)
+        self.assertEqual(results[0]['title'], 'B24')
+        self.assertFalse(results[0]['is_locked'])
+        self.assertTrue(results[0]['unlocked_at'])
+        self.assertIn('cursor=', res.data['next'])
+
+        res = self.client.get(res.data['next'])
+        self.assertEqual([book['title'] for book in res.data['results']], ['B4', 'B3', 'B2', 'B1', 'B0'])
+        self.assertIsNone(res.data['next'])
+
+    def test_constant_query_count(self):
+        self.grant(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('user-purchased-books'))
+        self.grant(15)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('user-purchased-books'))
+        self.assertEqual(len(few), len(many))
+
+
+class ManualTocTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title='B', author='A', description='D', is_published=True)
+
+    def add(self, title, order, parent=None, anchor_id=None):
+        return TableOfContentEntry.objects.create(
+            book=self.book, title=title, order=order, parent=parent, anchor_id=anchor_id,
+            level=parent.level + 1 if parent else 1,
+        )
+
+    def test_numbered_tree(self):
+        second = self.add('Second', 2)
+        first = self.add('First', 1, anchor_id='first')
+        self.add('1.2', 2, parent=first)
+        sub = self.add('1.1', 1, parent=first)
+        self.add('1.1.1', 0, parent=sub)
+        self.add('2.1', 5, parent=second)
+
+        def outline(toc):
+            return [(e['number'], e['title'], outline(e.get('children', []))) for e in toc]
+
+        toc = get_manual_toc(self.book.id)
+        self.assertEqual(toc[0]['id'], 'first')
+        self.assertEqual(outline(toc), [
+            ('1', 'First', [('1.1', '1.1', [('1.1.1', '1.1.1', [])]), ('1.2', '1.2', [])]),
+            ('2', 'Second', [('2.1', '2.1', [])]),
+        ])
+
+    def test_builds_large_tree_from_parent_ids_only(self):
+        entries = [TableOfContentEntry(id=n, book=self.book, title=str(n), level=1, order=n,
+                                       parent_id=(n - 1) // 10 or None) for n in range(1, 3001)]
+        with self.assertNumQueries(0):
+            toc = build_manual_toc(entries)
+        self.assertEqual(len(toc), 10)
+        self.assertEqual(toc[0]['children'][0]['number'], '1.1')
+
+    @override_settings(MANUAL_TOC_CACHE={'CACHE_ALIAS': 'default', 'LOCAL_TIMEOUT': 60})
+    def test_cached_until_entries_change(self):
+        self.add('First', 1)
+        self.assertEqual(len(get_manual_toc(self.book.id)), 1)
+        with self.assertNumQueries(0):
+            get_manual_toc(self.book.id)
+
+        entry = self.add('Second', 2)
+        self.assertEqual(len(get_manual_toc(self.book.id)), 2)
+        entry.title = 'Renamed'
+        entry.save()
+        self.assertEqual(get_manual_toc(self.book.id)[1]['title'], 'Renamed')
+        entry.delete()
+        self.assertEqual(len(get_manual_toc(self.book.id)), 1)
+
+    def test_not_cached_in_a_process_local_cache(self):
+        entry = self.add('First', 1)
+        get_manual_toc(self.book.id)
+        # An edit whose invalidation only reached another worker
+        TableOfContentEntry.objects.filter(pk=entry.pk).update(title='Renamed')
+        self.assertEqual(get_manual_toc(self.book.id)[0]['title'], 'Renamed')
+
+    def test_detail_uses_manual_toc(self):
+        self.add('First', 1)
+        user = User.objects.create_user(email='u@example.com', password='pass')
+        client = APIClient()
+        client.force_authenticate(user)
+        res = client.get(reverse('book-detail', args=[self.book.id]))
+        self.assertEqual(res.data['toc'], [{'id': f'toc-entry-{self.book.toc_entries.get().id}',
+                                            'title': 'First', 'level': 1, 'number': '1'}])
+
+
+class BookContentTreeTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        admin = User.objects.create_user(email='a@example.com', password='pass', is_staff=True, is_superuser=True)
+        self.client.force_authenticate(admin)
+        self.book = Book.objects.create(title='B', author='A', description='D')
+
+    def build_chain(self, depth, parent=None):
+        for n in range(depth):
+            parent = BookContent.objects.create(book=self.book, title=f'L{n}', order=0, parent=parent)
+        return parent
+
+    def list_contents(self):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(reverse('admin-book-content-list', args=[self.book.id]))
+        self.assertEqual(res.status_code, 200)
+        return res.data, len(queries)
+
+    def test_deep_tree_in_constant_queries(self):
+        self.build_chain(3)
+        _, shallow = self.list_contents()
+        self.build_chain(30)
+        BookContent.objects.create(book=self.book, title='Root 2', order=1)
+        data, deep = self.list_contents()
+        self.assertEqual(deep, shallow)
+
+        roots = data['results'] if isinstance(data, dict) else data
+        self.assertEqual([root['title'] for root in roots], ['L0', 'L0', 'Root 2'])
+        node, depth = roots[1], 1
+        while node['children']:
+            node, depth = node['children'][0], depth + 1
+        self.assertEqual(depth, 30)
+        self.assertEqual(set(node), {'id', 'book', 'title', 'url', 'parent', 'order', 'created_at', 'children'})
+
+    def test_update_response_keeps_nested_children(self):
+        leaf = self.build_chain(4)
+        root = BookContent.objects.get(book=self.book, parent=None)
+        url = reverse('admin-book-content-update', args=[self.book.id, root.id])
+        res = self.client.patch(url, {'title': 'Renamed'}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['title'], 'Renamed')
+        node = res.data
+        while node['children']:
+            node = node['children'][0]
+        self.assertEqual((node['id'], node['book_title']), (leaf.id, 'B'))
+
+
+class TreePathTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        admin = User.objects.create_user(email='a@example.com', password='pass', is_staff=True, is_superuser=True)
+        self.client.force_authenticate(admin)
+        self.book = Book.objects.create(title='B', author='A', description='D')
+
+    def add(self, title, order, parent=None):
+        return BookContent.objects.create(book=self.book, title=title, order=order, parent=parent)
+
+    def test_path_extends_parent_path(self):
+        root = self.add('Root', 0)
+        child = self.add('Child', 0, parent=root)
+        grandchild = self.add('Grandchild', 0, parent=child)
+        grandchild.refresh_from_db()
+        self.assertEqual(grandchild.path, path_segment(root.pk) + path_segment(child.pk) + path_segment(grandchild.pk))
+        self.assertEqual(grandchild.depth, 3)
+        self.assertEqual(set(root.get_subtree()), {root, child, grandchild})
+        self.assertEqual(path_segment(36 ** 2), '000100')
+
+    def test_subtree_is_scoped_to_the_book(self):
+        root = self.add('Root', 0)
+        other_book = Book.objects.create(title='C', author='A', description='D')
+        # A row of another book whose path happens to share the prefix
+        stray = BookContent.objects.create(book=other_book, title='Stray', order=0)
+        BookContent.objects.filter(pk=stray.pk).update(path=root.path + path_segment(stray.pk))
+        self.assertEqual(set(root.get_subtree()), {root})
+        with self.assertRaises(ValueError):
+            BookContent(book=self.book, title='Unsaved', order=1).get_subtree()
+
+    def test_move_rewrites_descendant_paths_and_shifts_siblings(self):
+        first = self.add('First', 0)
+        second = self.add('Second', 1)
+        kept = self.add('Kept', 0, parent=second)
+        branch = self.add('Branch', 1, parent=first)
+        leaf = self.add('Leaf', 0, parent=branch)
+
+        res = self.client.post(reverse('admin-book-content-move', args=[self.book.id, branch.id]),
+                               {'parent': second.id, 'order': 0}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['parent'], second.id)
+        self.assertEqual([child['title'] for child in res.data['children']], ['Leaf'])
+
+        kept.refresh_from_db()
+        leaf.refresh_from_db()
+        self.assertEqual(kept.order, 1)
+        self.assertEqual(leaf.path, second.path + path_segment(branch.pk) + path_segment(leaf.pk))
+        self.assertEqual(set(first.get_subtree()), {first})
+
+    def test_move_under_own_descendant_is_rejected(self):
+        root = self.add('Root', 0)
+        child = self.add('Child', 0, parent=root)
+        url = reverse('admin-book-content-move', args=[self.book.id, root.id])
+        res = self.client.post(url, {'parent': child.id, 'order': 0}, format='json')
+        self.assertEqual(res.status_code, 400)
+        root.refresh_from_db()
+        self.assertIsNone(root.parent_id)
+
+        res = self.client.patch(reverse('admin-book-content-update', args=[self.book.id, root.id]),
+                                {'parent': child.id}, format='json')
+        self.assertEqual(res.status_code, 400)
+
+    def test_subtree_endpoints(self):
+        root = self.add('Root', 0)
+        later = self.add('Later', 2, parent=root)
+        earlier = self.add('Earlier', 1, parent=root)
+        self.add('Deep', 0, parent=later)
+        self.add('Other', 1)
+
+        with self.assertNumQueries(2):
+            res = self.client.get(reverse('admin-book-content-subtree', args=[self.book.id, root.id]))
+        self.assertEqual([child['title'] for child in res.data['children']], ['Earlier', 'Later'])
+        self.assertEqual(res.data['children'][1]['children'][0]['title'], 'Deep')
+
+        toc_root = TableOfContentEntry.objects.create(book=self.book, title='1', order=0)
+        TableOfContentEntry.objects.create(book=self.book, title='1.2', order=2, parent=toc_root)
+        sub = TableOfContentEntry.objects.create(book=self.book, title='1.1', order=1, parent=toc_root)
+        TableOfContentEntry.objects.create(book=self.book, title='1.1.1', order=0, parent=sub)
+        res = self.client.get(reverse('admin-toc-entry-subtree', args=[toc_root.id]))
+        self.assertEqual([entry['title'] for entry in res.data], ['1', '1.1', '1.1.1', '1.2'])
+        self.assertEqual(earlier.depth, 2)
+
+
+class AdminUserListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(email='admin@example.com', password='pass', is_staff=True, is_superuser=True)
+        self.client.force_authenticate(self.admin)
+        self.books = [Book.objects.create(title=f'B{n}', author='A', description='D') for n in range(7)]
+
+    def create_users(self, count, accesses):
+        for n in range(count):
+            user = User.objects.create_user(email=f'user{User.objects.count()}@example.com', password='pass')
+            for book in self.books[:accesses]:
+                BookAccess.objects.create(user=user, book=book)
+
+    def list_users(self, url=None):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url or reverse('admin-user-list'))
+        self.assertEqual(res.status_code, 200)
+        return res.data, len(queries)
+
+    def test_constant_queries_and_recent_accesses(self):
+        self.create_users(2, 1)
+        _, few = self.list_users()
+        self.create_users(10, 7)
+        data, many = self.list_users()
+        self.assertEqual(few, many)
+
+        newest = data['results'][0]
+        self.assertEqual(newest['book_access_count'], 7)
+        self.assertEqual([a['book_title'] for a in newest['recent_book_accesses']], ['B6', 'B5', 'B4', 'B3', 'B2'])
+
+        res = self.client.get(reverse('admin-user-detail', args=[newest['id']]))
+        self.assertEqual(len(res.data['book_accesses']), 7)
+
+    def test_cursor_pagination_visits_every_user_once(self):
+        self.create_users(25, 0)
+        seen, url = [], None
+        while True:
+            data, _ = self.list_users(url)
+            self.assertNotIn('count', data)
+            seen += [user['id'] for user in data['results']]
+            url = data['next']
+            if not url:
+                break
+        self.assertEqual(sorted(seen), sorted(User.objects.values_list('id', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+
+class ConditionalBookTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+        self.book = Book.objects.create(title='B', author='A', description='D', is_published=True,
+                                        markdown_content='# Title\n\nText')
+        self.chapter = Chapter.objects.create(book=self.book, title='C', order=1, content='C', is_preview=True)
+
+    def get(self, name, **headers):
+        return self.client.get(reverse(name, args=[self.book.id]), **headers)
+
+    def test_revalidation_is_one_query(self):
+        BookAccess.objects.create(user=self.user, book=self.book)
+        for name in ('book-detail', 'book-read', 'book-content'):
+            res = self.get(name)
+            self.assertEqual(res.status_code, 200)
+            self.assertIn('private', res['Cache-Control'])
+            with self.assertNumQueries(1):
+                not_modified = self.get(name, HTTP_IF_NONE_MATCH=res['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified['ETag'], res['ETag'])
+
+            since = self.get(name, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+            self.assertEqual(since.status_code, 304)
+
+        etags = {self.get(name)['ETag'] for name in ('book-detail', 'book-read', 'book-content')}
+        self.assertEqual(len(etags), 3)
+
+    def test_related_changes_bump_the_version(self):
+        etag = self.get('book-detail')['ETag']
+        updated_at = Book.objects.get().updated_at
+
+        for change in (
+            lambda: Chapter.objects.filter(pk=self.chapter.pk).get().save(),
+            lambda: TableOfContentEntry.objects.create(book=self.book, title='T', order=1),
+            lambda: self.book.youtube_links.create(title='Y', url='https://example.com', order=1),
+            lambda: self.chapter.delete(),
+        ):
+            change()
+            self.assertGreater(Book.objects.get().updated_at, updated_at)
+            updated_at = Book.objects.get().updated_at
+            res = self.get('book-detail', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(res.status_code, 200)
+            etag = res['ETag']
+
+    def test_entitlement_is_part_of_the_validator(self):
+        locked = self.get('book-detail')
+        self.assertTrue(locked.data['is_locked'])
+        # Locked users are never told their (missing) copy of the content is current
+        self.assertEqual(self.get('book-content', HTTP_IF_NONE_MATCH='*').status_code, 403)
+
+        access = BookAccess.objects.create(user=self.user, book=self.book)
+        # Unlocked after the cached copy (HTTP dates have second precision)
+        BookAccess.objects.filter(pk=access.pk).update(unlocked_at=timezone.now() + timedelta(seconds=2))
+        res = self.get('book-detail', HTTP_IF_NONE_MATCH=locked['ETag'])
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(res.data['is_locked'])
+        self.assertEqual(self.get('book-detail', HTTP_IF_MODIFIED_SINCE=locked['Last-Modified']).status_code, 200)
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+        self.book = Book.objects.create(title='B', author='A', description='D', is_published=True,
+                                        markdown_content='# Title\n\nText', content_file='book_files/b.pdf')
+        Chapter.objects.create(book=self.book, title='Preview', order=1, content='P', is_preview=True,
+                               markdown_content='## One')
+        Chapter.objects.create(book=self.book, title='Paid', order=2, content='X')
+
+    def get_detail(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(reverse('book-detail', args=[self.book.id]), params)
+        self.assertEqual(res.status_code, 200)
+        return res.data, [q['sql'] for q in queries.captured_queries]
+
+    def test_fields_limits_output_and_loaded_columns(self):
+        data, queries = self.get_detail(fields='id,title,is_locked')
+        self.assertEqual(set(data), {'id', 'title', 'is_locked'})
+        book_query = next(sql for sql in queries if 'FROM "books_book"' in sql and '"books_book"."title"' in sql)
+        self.assertNotIn('markdown_content', book_query)
+        self.assertFalse(any('books_chapter' in sql for sql in queries))
+
+    def test_omit_and_nested_selection(self):
+        data, queries = self.get_detail(omit='content,markdown_content,chapters.content,chapters.markdown_content',
+                                        expand='chapters')
+        self.assertNotIn('markdown_content', data)
+        self.assertIn('html', data)
+        self.assertEqual(set(data['chapters'][0]) & {'content', 'markdown_content'}, set())
+        self.assertIn('html', data['chapters'][0])
+
+        data, _ = self.get_detail(fields='chapters.title')
+        self.assertEqual(data, {'chapters': [{'title': 'Preview'}]})
+
+    def test_rendered_fields_load_no_deferred_columns(self):
+        BookAccess.objects.create(user=self.user, book=self.book)
+        for order in range(3, 6):
+            Chapter.objects.create(book=self.book, title=f'C{order}', order=order, content='',
+                                   markdown_content=f'# Part {order}')
+        url = reverse('book-detail', args=[self.book.id])
+        # Version check, book, chapters: no per-row load of a deferred column
+        for params, count in (({'expand': 'chapters', 'fields': 'chapters.toc'}, 3),
+                              ({'expand': 'chapters', 'fields': 'chapters.html'}, 3),
+                              ({'fields': 'html'}, 2), ({'fields': 'toc'}, 3)):
+            with self.subTest(params=params), forbid_deferred_loads(), self.assertNumQueries(count):
+                res = self.client.get(url, params)
+            self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['toc'][0]['id'], 'title')
+
+    def test_locked_book_hides_content_file_without_is_locked(self):
+        data, _ = self.get_detail(fields='content_file')
+        self.assertIsNone(data['content_file'])
+
+    def test_list_expand_chapters(self):
+        res = self.client.get(reverse('book-list-create'))
+        self.assertNotIn('chapters', res.data['results'][0])
+
+        res = self.client.get(reverse('book-list-create'), {'expand': 'chapters', 'fields': 'id,chapters'})
+        self.assertEqual(res.data['results'][0], {
+            'id': self.book.id,
+            'chapters': [{'id': self.book.chapters.get(order=1).id, 'title': 'Preview', 'order': 1, 'is_preview': True}],
+        })
+        BookAccess.objects.create(user=self.user, book=self.book)
+        res = self.client.get(reverse('book-list-create'), {'expand': 'chapters'})
+        self.assertEqual([c['title'] for c in res.data['results'][0]['chapters']], ['Preview', 'Paid'])
+
+
+class ChapterReadingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+        self.book = Book.objects.create(title='B', author='A', description='D', is_published=True)
+        self.preview = Chapter.objects.create(book=self.book, title='Preview', order=1, content='legacy text',
+                                              is_preview=True, markdown_content="# One\n\nIt's a well-known *fact*.")
+        self.paid = Chapter.objects.create(book=self.book, title='Paid', order=2, content='Paid words here')
+
+    def chapter_url(self, chapter):
+        return reverse('book-chapter', args=[self.book.id, chapter.id])
+
+    def test_detail_lists_stubs(self):
+        BookAccess.objects.create(user=self.user, book=self.book)
+        res = self.client.get(reverse('book-detail', args=[self.book.id]))
+        self.assertEqual(res.data['chapters'][0], {
+            'id': self.preview.id, 'title': 'Preview', 'order': 1, 'is_preview': True,
+            'has_voice': False, 'word_count': 5,
+        })
+        self.assertEqual(res.data['chapters'][1]['word_count'], 3)
+
+        res = self.client.get(reverse('book-detail', args=[self.book.id]), {'expand': 'chapters'})
+        self.assertIn('<h1', res.data['chapters'][0]['html'])
+
+    def test_chapter_endpoint_checks_preview_and_access(self):
+        res = self.client.get(self.chapter_url(self.preview))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('<h1', res.data['html'])
+        self.assertEqual(self.client.get(self.chapter_url(self.paid)).status_code, 403)
+
+        other = Book.objects.create(title='Other', author='A', description='D')
+        wrong_book = reverse('book-chapter', args=[other.id, self.preview.id])
+        self.assertEqual(self.client.get(wrong_book).status_code, 404)
+
+        BookAccess.objects.create(user=self.user, book=self.book)
+        res = self.client.get(self.chapter_url(self.paid), {'fields': 'id,content'})
+        self.assertEqual(res.data, {'id': self.paid.id, 'content': 'Paid words here'})
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(self.chapter_url(self.paid), {'fields': 'id,content'},
+                                           HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_unpublished_book_chapters_hidden(self):
+        self.book.is_published = False
+        self.book.save()
+        self.assertEqual(self.client.get(self.chapter_url(self.preview)).status_code, 404)
+
+
+class ListColumnTests(TestCase):
+    """List endpoints only load the columns they serialize."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.admin = User.objects.create_user(email='a@example.com', password='pass', is_staff=True, is_superuser=True)
+        for n in range(3):
+            book = Book.objects.create(title=f'B{n}', author='A', description='D', is_published=True,
+                                       markdown_content='# Heavy\n\n' + 'text ' * 500, content={'doc': 'x' * 500})
+            Chapter.objects.create(book=book, title='C', order=1, content='long ' * 500, is_preview=True)
+            BookAccess.objects.create(user=self.user, book=book)
+
+    def test_guard_catches_deferred_loads(self):
+        with self.assertRaises(AssertionError):
+            with forbid_deferred_loads():
+                Book.objects.only('id').first().markdown_content
+
+    def test_list_endpoints_skip_heavy_columns(self):
+        endpoints = [
+            (self.user, reverse('book-list-create'), {}),
+            (self.user, reverse('book-list-create'), {'expand': 'chapters'}),
+            (self.admin, reverse('book-list-create'), {}),
+            (self.user, reverse('user-purchased-books'), {}),
+            (self.admin, reverse('user-purchased-books'), {}),
+            (None, reverse('home'), {}),
+            (self.admin, reverse('admin-book-list'), {}),
+            (self.admin, reverse('admin-chapter-list'), {}),
+        ]
+        for user, url, params in endpoints:
+            with self.subTest(url=url, params=params, admin=user == self.admin):
+                self.client.force_authenticate(user)
+                with forbid_deferred_loads(), CaptureQueriesContext(connection) as queries:
+                    res = self.client.get(url, params)
+                self.assertEqual(res.status_code, 200)
+                for query in queries.captured_queries:
+                    self.assertNotIn('markdown_content', query['sql'])
+                    self.assertNotIn('"content"', query['sql'])
+                    self.assertNotIn('rendered_html', query['sql'])
+
+        self.client.force_authenticate(self.admin)
+        res = self.client.get(reverse('admin-chapter-list'))
+        self.assertEqual(set(res.data['results'][0]), {
+            'id', 'book', 'book_title', 'title', 'order', 'is_preview', 'voice_file', 'word_count',
+        })
+
+
+class ReadableBookTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='u@example.com', password='pass')
+        self.admin = User.objects.create_user(email='a@example.com', password='pass', is_staff=True, is_superuser=True)
+        self.book = Book.objects.create(title='B', author='A', description='D', is_published=True,
+                                        markdown_content='# Title\n\nText')
+        TableOfContentEntry.objects.create(book=self.book, title='Intro', order=1)
+
+    def test_refusals(self):
+        draft = Book.objects.create(title='Draft', author='A', description='D', is_published=False)
+        self.assertEqual(get_readable_book(self.user, self.book.id), (None, BOOK_LOCKED))
+        self.assertEqual(get_readable_book(self.user, draft.id), (None, BOOK_UNPUBLISHED))
+        self.assertEqual(get_readable_book(self.user, 0), (None, BOOK_NOT_FOUND))
+        self.assertEqual(get_readable_book(self.admin, draft.id), (draft, None))
+
+        BookAccess.objects.create(user=self.user, book=self.book)
+        with self.assertNumQueries(1):
+            book, refusal = get_readable_book(self.user, self.book.id)
+        self.assertEqual((book, refusal), (self.book, None))
+
+        self.client.force_authenticate(self.user)
+        for name, book_id, status in (('book-content', 0, 404), ('book-read', draft.id, 404)):
+            self.assertEqual(self.client.get(reverse(name, args=[book_id])).status_code, status)
+
+    @override_settings(MANUAL_TOC_CACHE={'CACHE_ALIAS': 'default', 'LOCAL_TIMEOUT': 60})
+    def test_content_is_two_queries(self):
+        BookAccess.objects.create(user=self.user, book=self.book)
+        self.client.force_authenticate(self.user)
+        url = reverse('book-content', args=[self.book.id])
+        self.assertEqual(self.client.get(url).data['toc'][0]['title'], 'Intro')
+
+        # Cached TOC, but no cached entitlements: the book query checks access
+        invalidate_entitlements([self.user.id])
+        with self.assertNumQueries(2):
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['toc'][0]['title'], 'Intro')
+
+    def test_read_checks_access_with_the_book(self):
+        BookAccess.objects.create(user=self.user, book=self.book)
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(reverse('book-read', args=[self.book.id]))
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(res.data['book']['is_locked'])
+        # The version query and the book query, no entitlement lookup
+        access_queries = [q for q in queries.captured_queries if 'books_bookaccess' in q['sql']]
+        self.assertEqual(len(access_queries), 2)
+
+
+class VersionedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cache = VersionedCache('test', 'TEST_VERSIONED_CACHE')
+
+    def test_lost_version_does_not_revive_old_entries(self):
+        self.assertEqual(self.cache.get_or_build(1, lambda: 'old'), 'old')
+        self.cache.invalidate([1])
+        self.assertEqual(self.cache.get_or_build(1, lambda: 'new'), 'new')
+        # Version key evicted (or the cache restarted without the values)
+        cache.delete(self.cache._version_key(1))
+        self.assertEqual(self.cache.get_or_build(1, lambda: 'rebuilt'), 'rebuilt')
+
+    def test_local_timeout(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as set_value:
+            with override_settings(TEST_VERSIONED_CACHE={'TIMEOUT': 3600, 'LOCAL_TIMEOUT': 60}):
+                self.cache.get_or_build(1, lambda: 'value')
+            self.assertEqual(set_value.call_args.kwargs['timeout'], 60)
+
+            with override_settings(TEST_VERSIONED_CACHE={'LOCAL_TIMEOUT': None}):
+                self.cache.get_or_build(2, lambda: 'first')
+                self.assertEqual(self.cache.get_or_build(2, lambda: 'second'), 'second')
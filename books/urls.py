@@ -1,13 +1,24 @@
 from django.urls import path
 from .views import (
     BookListCreateView, BookDetailView, BookReadView, BookContentView, UserPurchasedBooksView,
+    BookContentSectionListView, BookContentSectionView, HighlightStylesheetView,
+    BookSearchView, BookChapterView,
 )
 
 urlpatterns = [
     # /api/books/purchased/
     path('purchased/', UserPurchasedBooksView.as_view(), name='user-purchased-books'),
 
+    # /books/search/?q=...
+    path('search/', BookSearchView.as_view(), name='book-search'),
+
+    # /books/highlight.css
+    path('highlight.css', HighlightStylesheetView.as_view(), name='highlight-stylesheet'),
+
     # Book-specific routes
+    path('<int:pk>/content/sections/<str:anchor>/', BookContentSectionView.as_view(), name='book-content-section'),
+    path('<int:pk>/content/sections/', BookContentSectionListView.as_view(), name='book-content-sections'),
+    path('<int:pk>/chapters/<int:chapter_id>/', BookChapterView.as_view(), name='book-chapter'),
     path('<int:pk>/content/', BookContentView.as_view(), name='book-content'),
     path('<int:pk>/read/', BookReadView.as_view(), name='book-read'),
     path('<int:pk>/', BookDetailView.as_view(), name='book-detail'),
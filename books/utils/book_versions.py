@@ -0,0 +1,61 @@
+"""
+Version of one user's view of a book, for conditional GETs.
+
+A book endpoint's response depends on the book's content version
+(Book.updated_at, bumped on chapter/TOC/YouTube link changes too) and on
+whether the user may read it. Both come from one query on the book's
+primary key, joined with the user's BookAccess row through its unique
+(user, book) index, so an unchanged book is revalidated without loading or
+serializing it.
+"""
+from typing import Optional
+
+from django.db.models import OuterRef, Subquery
+
+from ..models import Book, BookAccess
+from .http import make_etag
+
+ADMIN, UNLOCKED, LOCKED = 'admin', 'unlocked', 'locked'
+
+# Responses are per user: only the browser may store them, and it must
+# revalidate every time
+BOOK_CACHE_CONTROL = {'private': True, 'no_cache': True}
+
+
+class BookVersion:
+    __slots__ = ('book_id', 'updated_at', 'unlocked_at', 'is_published', 'access')
+
+    def __init__(self, book_id, updated_at, unlocked_at, is_published, access):
+        self.book_id = book_id
+        self.updated_at = updated_at
+        self.unlocked_at = unlocked_at
+        self.is_published = is_published
+        self.access = access
+
+    def etag(self, variant: str) -> str:
+        """Strong ETag of the representation variant (endpoint, format, ...) at this version."""
+        key = f'{variant}:{self.book_id}:{self.updated_at.isoformat()}:{self.access}'
+        return make_etag(key.encode('utf-8'))
+
+    @property
+    def last_modified(self):
+        # Unlocking changes what the user sees as much as editing does
+        if self.unlocked_at and self.unlocked_at > self.updated_at:
+            return self.unlocked_at
+        return self.updated_at
+
+
+def get_book_version(user, book_id) -> Optional[BookVersion]:
+    """The version of book_id as user sees it, or None if there is no such book."""
+    is_admin = user.is_staff and user.is_superuser
+    unlocked_at = BookAccess.objects.filter(user=user, book=OuterRef('pk')).values('unlocked_at')[:1]
+    row = Book.objects.filter(pk=book_id).annotate(
+        access_unlocked_at=Subquery(unlocked_at),
+    ).values('updated_at', 'is_published', 'access_unlocked_at').first()
+    if row is None:
+        return None
+    if is_admin:
+        access = ADMIN
+    else:
+        access = UNLOCKED if row['access_unlocked_at'] else LOCKED
+    return BookVersion(book_id, row['updated_at'], row['access_unlocked_at'], row['is_published'], access)
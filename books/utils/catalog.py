@@ -0,0 +1,45 @@
+"""
+Precomputed public catalog for the home page (accounts.views.HomeView).
+
+The JSON body and its ETag are built once and cached until a Book is saved
+or deleted (books.signals), so serving it, or answering a conditional GET
+with 304, costs two cache reads and no queries. Without a shared cache each
+worker keeps it for HOME_CATALOG_CACHE['LOCAL_TIMEOUT'] seconds at most.
+"""
+from typing import Dict
+
+from rest_framework.renderers import JSONRenderer
+
+from ..fieldsets import FieldSelection
+from ..models import Book
+from ..serializers import BookListSerializer
+from .http import make_etag
+from .versioned_cache import VersionedCache
+
+catalog_cache = VersionedCache('home-catalog', 'HOME_CATALOG_CACHE')
+# One snapshot for everybody: the home page is anonymous
+CATALOG_SCOPE = 'published'
+
+
+def build_home_payload() -> Dict:
+    columns = BookListSerializer.loaded_columns(FieldSelection())
+    books = list(Book.objects.filter(is_published=True).only(*columns))
+    return {
+        "message": "Welcome to BookReader API",
+        "total_books": len(books),
+        "books": BookListSerializer(books, many=True).data,
+    }
+
+
+def build_home_snapshot() -> Dict:
+    content = JSONRenderer().render(build_home_payload())
+    return {'content': content, 'etag': make_etag(content)}
+
+
+def get_home_snapshot() -> Dict:
+    """{'content': JSON bytes, 'etag': strong ETag} of the home payload."""
+    return catalog_cache.get_or_build(CATALOG_SCOPE, build_home_snapshot)
+
+
+def invalidate_home_snapshot() -> None:
+    catalog_cache.invalidate([CATALOG_SCOPE])
@@ -0,0 +1,31 @@
+"""
+In-memory assembly of BookContent trees.
+
+Every node of a book's content tree belongs to the same book, so the whole
+tree is loaded with one query on book_id and grouped by parent_id, instead
+of one children query per node.
+"""
+from typing import Dict, List
+
+from ..models import BookContent
+from .tree_paths import group_children
+
+CONTENT_FIELDS = ('id', 'book_id', 'title', 'url', 'parent_id', 'order', 'created_at', 'path')
+
+
+def content_nodes(queryset):
+    """queryset restricted to the columns the content serializers read."""
+    return queryset.select_related('book').only(*CONTENT_FIELDS, 'book__title')
+
+
+def load_content_children(book_id: int) -> Dict[int, List[BookContent]]:
+    """parent id (None for roots) -> child nodes ordered by (order, id), for one book."""
+    return group_children(content_nodes(BookContent.objects.filter(book_id=book_id)))
+
+
+def get_content_children(context: Dict, book_id: int) -> Dict[int, List[BookContent]]:
+    """The children map of book_id kept in a serializer context, loaded on first use."""
+    trees = context.setdefault('content_children', {})
+    if book_id not in trees:
+        trees[book_id] = load_content_children(book_id)
+    return trees[book_id]
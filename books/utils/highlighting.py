@@ -0,0 +1,174 @@
+"""
+Cached syntax highlighting for code blocks.
+
+CodeHilite runs Pygments on every code block each time a document is
+rendered. The extensions below are drop-in replacements for fenced_code and
+codehilite that memoize each highlighted fragment by a hash of its source,
+language and formatter options (including the style), so a given snippet is
+highlighted at most once across the catalog. Output is unchanged.
+
+Highlighting is configured by settings.MARKDOWN_CODEHILITE. With NOCLASSES
+off (the default) Pygments emits short CSS classes instead of inline styles;
+the matching stylesheet is served by HighlightStylesheetView.
+"""
+import hashlib
+import json
+from functools import lru_cache
+from typing import Dict
+
+from django.conf import settings
+from markdown.extensions.attr_list import get_attrs
+from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension, HiliteTreeprocessor, parse_hl_lines
+from markdown.extensions.fenced_code import FencedCodeExtension, FencedBlockPreprocessor
+from markdown.serializers import _escape_attrib_html
+
+from .render_cache import RenderCache
+
+try:
+    import pygments
+    from pygments.formatters import HtmlFormatter
+except ImportError:  # pragma: no cover
+    pygments = None
+
+
+def codehilite_config() -> Dict[str, any]:
+    """CodeHiliteExtension options from settings.MARKDOWN_CODEHILITE."""
+    config = getattr(settings, 'MARKDOWN_CODEHILITE', {})
+    return {
+        'pygments_style': config.get('STYLE', 'default'),
+        'noclasses': config.get('NOCLASSES', False),
+        'css_class': config.get('CSS_CLASS', 'codehilite'),
+        'guess_lang': config.get('GUESS_LANG', True),
+    }
+
+
+def highlighter_signature() -> str:
+    """Identify the highlighter (Pygments version) behind cached fragments."""
+    return f"pygments-{pygments.__version__}" if pygments else 'pygments-none'
+
+
+highlight_cache = RenderCache.from_settings('MARKDOWN_HIGHLIGHT_CACHE', sizeof=len, prefix='markdown-highlight')
+
+
+class CachedCodeHilite(CodeHilite):
+    """CodeHilite whose hilite() output is memoized in highlight_cache."""
+
+    def hilite(self, shebang=True) -> str:
+        if not pygments or not self.use_pygments:
+            return super().hilite(shebang=shebang)
+
+        key_data = json.dumps(
+            [highlighter_signature(), self.src.strip('\n'), self.lang, shebang, self.guess_lang,
+             str(self.pygments_formatter), self.options],
+            sort_keys=True, default=repr,
+        )
+        key = hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+        return highlight_cache.get_or_render(key, lambda: super(CachedCodeHilite, self).hilite(shebang=shebang))
+
+
+class CachedHiliteTreeprocessor(HiliteTreeprocessor):
+    """Highlight indented code blocks through CachedCodeHilite."""
+
+    def run(self, root):
+        for block in root.iter('pre'):
+            if len(block) == 1 and block[0].tag == 'code':
+                local_config = self.config.copy()
+                code = CachedCodeHilite(
+                    self.code_unescape(block[0].text),
+                    tab_length=self.md.tab_length,
+                    style=local_config.pop('pygments_style', 'default'),
+                    **local_config
+                )
+                placeholder = self.md.htmlStash.store(code.hilite())
+                # Same as HiliteTreeprocessor: the <p> is dropped when the stash is inserted
+                block.clear()
+                block.tag = 'p'
+                block.text = placeholder
+
+
+class CachedFencedBlockPreprocessor(FencedBlockPreprocessor):
+    """
+    FencedBlockPreprocessor that highlights through CachedCodeHilite.
+
+    Mirrors FencedBlockPreprocessor.run() from Markdown 3.5 (minus attr_list
+    key/value pairs, which we don't enable); only the highlighter differs.
+    """
+
+    def run(self, lines):
+        if not self.checked_for_deps:
+            for ext in self.md.registeredExtensions:
+                if isinstance(ext, CodeHiliteExtension):
+                    self.codehilite_conf = ext.getConfigs()
+            self.checked_for_deps = True
+
+        text = "\n".join(lines)
+        while True:
+            m = self.FENCED_BLOCK_RE.search(text)
+            if not m:
+                break
+
+            lang, id, classes, config = None, '', [], {}
+            if m.group('attrs'):
+                id, classes, config = self.handle_attrs(get_attrs(m.group('attrs')))
+                if len(classes):
+                    lang = classes.pop(0)
+            else:
+                if m.group('lang'):
+                    lang = m.group('lang')
+                if m.group('hl_lines'):
+                    config['hl_lines'] = parse_hl_lines(m.group('hl_lines'))
+
+            if self.codehilite_conf and self.codehilite_conf['use_pygments'] and config.get('use_pygments', True):
+                local_config = self.codehilite_conf.copy()
+                local_config.update(config)
+                if classes:
+                    local_config['css_class'] = '{} {}'.format(' '.join(classes), local_config['css_class'])
+                highliter = CachedCodeHilite(
+                    m.group('code'),
+                    lang=lang,
+                    style=local_config.pop('pygments_style', 'default'),
+                    **local_config
+                )
+                code = highliter.hilite(shebang=False)
+            else:
+                id_attr = lang_attr = class_attr = ''
+                if lang:
+                    prefix = self.config.get('lang_prefix', 'language-')
+                    lang_attr = f' class="{prefix}{_escape_attrib_html(lang)}"'
+                if classes:
+                    class_attr = f' class="{_escape_attrib_html(" ".join(classes))}"'
+                if id:
+                    id_attr = f' id="{_escape_attrib_html(id)}"'
+                code = self._escape(m.group('code'))
+                code = f'<pre{id_attr}{class_attr}><code{lang_attr}>{code}</code></pre>'
+
+            placeholder = self.md.htmlStash.store(code)
+            text = f'{text[:m.start()]}\n{placeholder}\n{text[m.end():]}'
+        return text.split("\n")
+
+
+class CachedFencedCodeExtension(FencedCodeExtension):
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        md.preprocessors.register(CachedFencedBlockPreprocessor(md, self.getConfigs()), 'fenced_code_block', 25)
+
+
+class CachedCodeHiliteExtension(CodeHiliteExtension):
+    def extendMarkdown(self, md):
+        hiliter = CachedHiliteTreeprocessor(md)
+        hiliter.config = self.getConfigs()
+        md.treeprocessors.register(hiliter, 'hilite', 30)
+        md.registerExtension(self)
+
+
+@lru_cache(maxsize=8)
+def _stylesheet(style: str, css_class: str) -> str:
+    return HtmlFormatter(style=style).get_style_defs(f'.{css_class}')
+
+
+def highlight_stylesheet() -> str:
+    """CSS for the configured Pygments style, scoped to the code block class."""
+    if not pygments:
+        return ''
+    config = codehilite_config()
+    return _stylesheet(config['pygments_style'], config['css_class'])
@@ -0,0 +1,65 @@
+"""
+Conditional GET helpers.
+
+Validators (ETag, Last-Modified) are computed from cached or cheaply
+queried versions, so a request that matches them gets a 304 without
+rendering or serializing anything.
+"""
+import hashlib
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+
+def make_etag(content: bytes) -> str:
+    """Strong (quoted) ETag of content."""
+    return '"%s"' % hashlib.sha256(content).hexdigest()[:32]
+
+
+def etag_matches(request, etag: str) -> bool:
+    """Whether the request's If-None-Match matches etag (weak comparison, as RFC 9110 specifies)."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    if etags == ['*']:
+        return True
+    strip_weak = lambda value: value[2:] if value.startswith('W/') else value
+    return strip_weak(etag) in {strip_weak(value) for value in etags}
+
+
+def is_not_modified(request, etag: str, last_modified=None) -> bool:
+    """
+    Whether the client's copy is current. If-None-Match takes precedence;
+    If-Modified-Since is only consulted without it.
+    """
+    if request.META.get('HTTP_IF_NONE_MATCH'):
+        return etag_matches(request, etag)
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    if since is None or last_modified is None:
+        return False
+    # HTTP dates have second precision
+    return int(last_modified.timestamp()) <= since
+
+
+def set_validators(response, etag: str, last_modified=None, **cache_control):
+    """Add ETag, Last-Modified and the Cache-Control directives to response."""
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    if cache_control:
+        patch_cache_control(response, **cache_control)
+    return response
+
+
+def conditional_response(request, content: bytes, etag: str, content_type: str, **cache_control) -> HttpResponse:
+    """
+    200 with content, or 304 when the client already has etag; both carry
+    the ETag and the Cache-Control directives in cache_control.
+    """
+    if is_not_modified(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=content_type)
+    return set_validators(response, etag, **cache_control)
@@ -0,0 +1,106 @@
+"""
+Incremental (block-level) markdown rendering.
+
+The source is split into top-level blocks at ATX headings, each block is
+rendered through process_markdown() (and so cached by its own content hash),
+and heading ids are then de-duplicated across the whole document exactly as
+a full render would. Editing one paragraph of a long book only re-renders
+the block containing it.
+"""
+import re
+from typing import Dict, List, Optional
+
+from .markdown_processor import process_markdown, HeadingIdAllocator
+
+_FENCE_RE = re.compile(r'^(~{3,}|`{3,})')
+_ATX_HEADING_RE = re.compile(r'^#{1,6}')
+# Constructs whose meaning depends on the rest of the document, or that can
+# span blank lines: documents using them are rendered in one piece.
+_REFERENCE_DEFINITION_RE = re.compile(r'^[ ]{0,3}\[[^\]]+\]:', re.M)
+_HTML_BLOCK_RE = re.compile(r'^[ ]{0,3}<[A-Za-z!?/]', re.M)
+_TOC_MARKER = '[TOC]'
+
+_HEADING_ID_RE = re.compile(r'(<h[1-6](?:\s[^>]*)?\sid=")([^"]*)(")')
+
+
+def split_blocks(markdown_text: str) -> Optional[List[str]]:
+    """
+    Split markdown into blocks that render independently.
+
+    A new block starts at each ATX heading that follows a blank line and is
+    not inside a fenced code block.
+
+    Returns:
+        The blocks (which join back into markdown_text), or None if the
+        document can't be split safely.
+    """
+    if (_TOC_MARKER in markdown_text
+            or _REFERENCE_DEFINITION_RE.search(markdown_text)
+            or _HTML_BLOCK_RE.search(markdown_text)):
+        return None
+
+    lines = markdown_text.split('\n')
+    blocks = []
+    start = 0
+    closing_fence = None
+    previous_blank = True
+    for index, line in enumerate(lines):
+        if closing_fence is not None:
+            if line.rstrip(' ') == closing_fence:
+                closing_fence = None
+            previous_blank = False
+            continue
+
+        fence = _FENCE_RE.match(line)
+        if fence:
+            # Only an opening fence with a matching closing fence is a code block
+            closing = fence.group(1)
+            if any(later.rstrip(' ') == closing for later in lines[index + 1:]):
+                closing_fence = closing
+        elif previous_blank and index > start and _ATX_HEADING_RE.match(line):
+            blocks.append('\n'.join(lines[start:index]))
+            start = index
+        previous_blank = not line.strip()
+    blocks.append('\n'.join(lines[start:]))
+    return blocks
+
+
+def render_markdown_incremental(markdown_text: str) -> Dict[str, any]:
+    """
+    Render markdown block by block; same result as process_markdown().
+
+    Returns:
+        Dictionary with 'html' (string) and 'toc' (list) keys.
+    """
+    blocks = split_blocks(markdown_text or '')
+    if blocks is None or len(blocks) == 1:
+        return process_markdown(markdown_text)
+
+    ids = HeadingIdAllocator()
+    toc = []
+    parts = []
+    for block in blocks:
+        result = process_markdown(block)
+        if not result['html']:
+            continue
+
+        # Re-allocate the block-local heading ids in document order
+        block_ids = {}
+        for entry in result['toc']:
+            heading_id = ids.allocate(entry['title'], len(toc))
+            block_ids[entry['id']] = heading_id
+            toc.append({'id': heading_id, 'title': entry['title'], 'level': entry['level']})
+
+        html = result['html']
+        if any(match.group(2) not in block_ids for match in _HEADING_ID_RE.finditer(html)):
+            # Headings without a TOC entry (h5/h6, empty titles) keep the ids
+            # the toc extension gave them, which depend on every earlier heading
+            return process_markdown(markdown_text)
+        if any(local != heading_id for local, heading_id in block_ids.items()):
+            html = _HEADING_ID_RE.sub(
+                lambda match: match.group(1) + block_ids.get(match.group(2), match.group(2)) + match.group(3),
+                html,
+            )
+        parts.append(html)
+
+    return {'html': '\n'.join(parts), 'toc': toc}
@@ -0,0 +1,148 @@
+"""
+Request-scoped batch loading for serializer method fields.
+
+Method fields like is_locked or chapters_count used to run one query per
+object. A BatchLoader lives in the serializer context for the duration of a
+request: list serializers prime it with every object on the page, and the
+first load() of a kind resolves all pending keys of that kind in a single
+query (in the spirit of DataLoader). Results are memoized, so asking again
+for the same key (e.g. is_locked from get_chapters) is free.
+"""
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from rest_framework import serializers
+
+from ..entitlements import get_entitlements
+from ..models import BookAccess, Chapter, TableOfContentEntry, YouTubeLink
+
+
+def _unlocked_books(loader, book_ids) -> Dict[int, bool]:
+    """book id -> whether loader.user has a BookAccess for it."""
+    # Cached per user, so usually no query at all
+    entitlements = get_entitlements(loader.user)
+    return {book_id: book_id in entitlements for book_id in book_ids}
+
+
+def _count_by(model, field: str) -> Callable:
+    """Batch function counting model rows per value of field."""
+    def count(loader, keys) -> Dict[Any, int]:
+        rows = model.objects.filter(**{f'{field}__in': keys}).values(field).annotate(total=Count('pk'))
+        return {row[field]: row['total'] for row in rows}
+    return count
+
+
+def _group_by(queryset_factory: Callable, field: str) -> Callable:
+    """Batch function listing rows per value of field, in queryset order."""
+    def group(loader, keys) -> Dict[Any, list]:
+        grouped = defaultdict(list)
+        for obj in queryset_factory().filter(**{f'{field}__in': keys}):
+            grouped[getattr(obj, field)].append(obj)
+        return grouped
+    return group
+
+
+# kind -> (batch function, value for keys it returns nothing for)
+BATCH_FUNCTIONS = {
+    'unlocked_book': (_unlocked_books, False),
+    'book_chapters_count': (_count_by(Chapter, 'book_id'), 0),
+    'book_youtube_links_count': (_count_by(YouTubeLink, 'book_id'), 0),
+    'book_toc_entries_count': (_count_by(TableOfContentEntry, 'book_id'), 0),
+    'book_users_count': (_count_by(BookAccess, 'book_id'), 0),
+    'toc_entry_children_count': (_count_by(TableOfContentEntry, 'parent_id'), 0),
+    'user_book_access_count': (_count_by(BookAccess, 'user_id'), 0),
+    'book_chapter_outlines': (
+        _group_by(lambda: Chapter.objects.only('id', 'book_id', 'title', 'order', 'is_preview'), 'book_id'),
+        [],
+    ),
+    'user_book_accesses': (
+        _group_by(lambda: BookAccess.objects.select_related('book').order_by('-unlocked_at', '-id'), 'user_id'),
+        [],
+    ),
+}
+
+
+def count_subquery(model, field: str):
+    """Correlated subquery counting model rows whose field is the outer row's pk."""
+    counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        total=Count('pk'),
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+# Book annotation -> (model, field) it counts; read by the admin book serializers
+BOOK_COUNT_ANNOTATIONS = {
+    'chapters_count': (Chapter, 'book_id'),
+    'youtube_links_count': (YouTubeLink, 'book_id'),
+    'toc_entries_count': (TableOfContentEntry, 'book_id'),
+    'users_count': (BookAccess, 'book_id'),
+}
+
+
+def annotate_book_counts(queryset):
+    """Add the BOOK_COUNT_ANNOTATIONS to a Book queryset (no extra queries per row)."""
+    return queryset.annotate(**{
+        name: count_subquery(model, field) for name, (model, field) in BOOK_COUNT_ANNOTATIONS.items()
+    })
+
+
+class BatchLoader:
+    """Collects keys per kind and resolves each kind in one query."""
+
+    def __init__(self, user=None, batch_functions: Dict[str, tuple] = None):
+        self.user = user
+        self.batch_functions = batch_functions or BATCH_FUNCTIONS
+        self._pending = defaultdict(set)
+        self._results = defaultdict(dict)
+
+    def prime(self, kind: str, keys: Iterable) -> None:
+        """Register keys that will be loaded later in this request."""
+        resolved = self._results[kind]
+        self._pending[kind].update(key for key in keys if key not in resolved)
+
+    def seed(self, kind: str, values: Dict) -> None:
+        """Record results already known from elsewhere (e.g. an annotation)."""
+        self._results[kind].update(values)
+        self._pending[kind].difference_update(values)
+
+    def load(self, kind: str, key) -> Any:
+        results = self._results[kind]
+        if key not in results:
+            self._pending[kind].add(key)
+            self._resolve(kind)
+        return results[key]
+
+    def _resolve(self, kind: str) -> None:
+        batch_function, default = self.batch_functions[kind]
+        keys = self._pending.pop(kind)
+        found = batch_function(self, list(keys))
+        results = self._results[kind]
+        for key in keys:
+            value = found.get(key, default)
+            # Don't share one mutable default between keys
+            results[key] = list(value) if isinstance(value, list) else value
+
+
+def get_loader(context: Dict) -> BatchLoader:
+    """The BatchLoader of a serializer context, created on first use."""
+    loader = context.get('loader')
+    if loader is None:
+        request = context.get('request')
+        loader = context['loader'] = BatchLoader(user=getattr(request, 'user', None))
+    return loader
+
+
+class BatchListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer that lets its child prime the BatchLoader with the whole
+    page before serializing it, via the child's prime_loader(loader, objs).
+    """
+
+    def to_representation(self, data):
+        objs = list(data.all() if hasattr(data, 'all') else data)
+        prime = getattr(self.child, 'prime_loader', None)
+        if prime and objs:
+            prime(get_loader(self.context), objs)
+        return super().to_representation(objs)
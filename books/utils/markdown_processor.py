@@ -1,16 +1,78 @@
 """
 Markdown processing utility for converting markdown to HTML and extracting TOC.
 """
+import hashlib
+import json
 import markdown
 from bs4 import BeautifulSoup
+from bs4.builder import HTMLTreeBuilder
+from functools import lru_cache
 import re
-from typing import Dict, List
+from typing import Dict, List, Optional
+from xml.etree.ElementTree import HTML_EMPTY
 from django.utils.text import slugify
+from markdown.serializers import _escape_cdata, to_xhtml_string
+from markdown.util import STX, ETX
+from .highlighting import codehilite_config, highlighter_signature
+from .render_cache import RenderCache
+
+# Markdown extensions used for every render. Changing this list or their
+# configuration changes render_signature(), so cached renders are
+# invalidated automatically. fenced_code/codehilite are replaced by versions
+# that cache highlighted code (see utils.highlighting).
+MARKDOWN_EXTENSIONS = [
+    'markdown.extensions.toc',
+    'books.utils.highlighting:CachedFencedCodeExtension',
+    'books.utils.highlighting:CachedCodeHiliteExtension',
+]
+MARKDOWN_EXTENSION_CONFIGS = {
+    'books.utils.highlighting:CachedCodeHiliteExtension': codehilite_config(),
+}
+
+# Headings that get ids and TOC entries
+HEADING_TAGS = ['h1', 'h2', 'h3', 'h4']
+
+# Bump when the post-processing below changes in a way that alters output
+RENDER_VERSION = 1
+
+
+def render_signature() -> str:
+    """Identify the renderer configuration that produced a given output."""
+    return (
+        f"v{RENDER_VERSION}:{markdown.__version__}:{highlighter_signature()}:"
+        f"{','.join(MARKDOWN_EXTENSIONS)}:{json.dumps(MARKDOWN_EXTENSION_CONFIGS, sort_keys=True)}"
+    )
+
+
+def create_markdown() -> markdown.Markdown:
+    """A Markdown instance with the configured extensions."""
+    return markdown.Markdown(extensions=MARKDOWN_EXTENSIONS, extension_configs=MARKDOWN_EXTENSION_CONFIGS)
+
+
+def content_hash(markdown_text: str) -> str:
+    """Hash of the markdown source plus the renderer configuration."""
+    digest = hashlib.sha256(render_signature().encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((markdown_text or '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _rendered_size(result: Dict[str, any]) -> int:
+    """Approximate in-memory size of a render result, in bytes."""
+    toc_size = sum(len(entry['id']) + len(entry['title']) + 64 for entry in result['toc'])
+    return len(result['html']) + toc_size
+
+
+render_cache = RenderCache.from_settings('MARKDOWN_RENDER_CACHE', sizeof=_rendered_size, prefix='markdown-render')
 
 
 def process_markdown(markdown_text: str) -> Dict[str, any]:
     """
     Convert markdown to HTML and extract TOC from headings.
+
+    Results are memoized by content hash in render_cache, so rendering the
+    same document twice (e.g. for 'html' and then 'toc') only costs one
+    conversion.
     
     Args:
         markdown_text: Markdown content string
@@ -21,28 +83,88 @@ def process_markdown(markdown_text: str) -> Dict[str, any]:
     """
     if not markdown_text or not markdown_text.strip():
         return {'html': '', 'toc': []}
-    
-    # Configure markdown extensions
-    extensions = [
-        'markdown.extensions.toc',
-        'markdown.extensions.fenced_code',
-        'markdown.extensions.codehilite',
-    ]
-    
+
+    result = render_cache.get_or_render(
+        content_hash(markdown_text),
+        lambda: _render_markdown(markdown_text),
+    )
+    # Hand out copies so callers can't mutate the cached TOC
+    return {
+        'html': result['html'],
+        'toc': [dict(entry) for entry in result['toc']],
+    }
+
+
+def _render_markdown(markdown_text: str) -> Dict[str, any]:
+    """Uncached conversion of markdown to HTML and TOC."""
+    result = render_markdown_single_pass(markdown_text)
+    if result is None:
+        result = render_markdown_reference(markdown_text)
+    return result
+
+
+class HeadingIdAllocator:
+    """Assigns unique slug ids to headings in document order."""
+
+    def __init__(self):
+        self.used_ids = set()
+        self.id_counter = {}
+
+    def allocate(self, title: str, toc_length: int) -> str:
+        # Generate slug-based ID
+        base_id = slugify(title)
+        if not base_id:
+            # Fallback if slugify returns empty
+            base_id = f"heading-{toc_length}"
+        
+        # Ensure unique ID
+        heading_id = base_id
+        if heading_id in self.used_ids:
+            counter = self.id_counter.get(heading_id, 0) + 1
+            self.id_counter[heading_id] = counter
+            heading_id = f"{base_id}-{counter}"
+        
+        self.used_ids.add(heading_id)
+        return heading_id
+
+
+def render_markdown_reference(markdown_text: str) -> Dict[str, any]:
+    """
+    Reference renderer: convert with Markdown, then re-parse the output with
+    BeautifulSoup to rewrite heading ids and collect the TOC.
+
+    render_markdown_single_pass() must produce byte-identical output; this
+    implementation is kept for documents it can't handle and for the
+    compatibility tests.
+    """
     # Convert markdown to HTML
-    md = markdown.Markdown(extensions=extensions)
+    md = create_markdown()
     html = md.convert(markdown_text)
     
     # Parse HTML with BeautifulSoup
     soup = BeautifulSoup(html, 'html.parser')
+    toc = assign_heading_ids(soup)
     
+    # Return processed HTML and TOC
+    return {
+        'html': str(soup),
+        'toc': toc
+    }
+
+
+def assign_heading_ids(soup: BeautifulSoup) -> List[Dict[str, any]]:
+    """
+    Give the h1-h4 headings in soup unique slug ids, in place.
+    
+    Returns:
+        The TOC: list of {'id', 'title', 'level'} dicts in document order.
+    """
     # Extract headings (h1-h4)
-    headings = soup.find_all(['h1', 'h2', 'h3', 'h4'])
+    headings = soup.find_all(HEADING_TAGS)
     
     # Generate TOC array and ensure unique IDs
     toc = []
-    used_ids = set()
-    id_counter = {}
+    ids = HeadingIdAllocator()
     
     for heading in headings:
         # Get heading text
@@ -53,20 +175,7 @@ def process_markdown(markdown_text: str) -> Dict[str, any]:
         # Get heading level (1-4)
         level = int(heading.name[1])
         
-        # Generate slug-based ID
-        base_id = slugify(title)
-        if not base_id:
-            # Fallback if slugify returns empty
-            base_id = f"heading-{len(toc)}"
-        
-        # Ensure unique ID
-        heading_id = base_id
-        if heading_id in used_ids:
-            counter = id_counter.get(heading_id, 0) + 1
-            id_counter[heading_id] = counter
-            heading_id = f"{base_id}-{counter}"
-        
-        used_ids.add(heading_id)
+        heading_id = ids.allocate(title, len(toc))
         
         # Set ID attribute on heading element
         heading['id'] = heading_id
@@ -78,9 +187,222 @@ def process_markdown(markdown_text: str) -> Dict[str, any]:
             'level': level
         })
     
-    # Return processed HTML and TOC
-    return {
-        'html': str(soup),
-        'toc': toc
-    }
+    return toc
+
+
+# ---------------------------------------------------------------------------
+# Single-pass renderer
+#
+# Instead of serializing Markdown's element tree and re-parsing the result
+# with BeautifulSoup, the serializer below writes the tree out the way
+# BeautifulSoup would have re-serialized it, assigning heading ids and
+# collecting TOC entries as it goes. Anything it can't reproduce exactly
+# (raw HTML, unusual entities, obfuscated e-mail links) makes it bail out
+# to render_markdown_reference().
+# ---------------------------------------------------------------------------
+
+# Tags BeautifulSoup writes as <tag/>
+_VOID_TAGS = frozenset(HTMLTreeBuilder.empty_element_tags)
+# Attributes BeautifulSoup splits on whitespace and re-joins with one space
+_LIST_ATTRIBUTES = HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES
+
+_STASH_PLACEHOLDER_RE = re.compile(STX + r'wzxhzdk:(\d+)' + ETX)
+_ENTITY_RE = re.compile(r'&(?:#[0-9]+|#x[0-9a-f]+|[0-9a-z]+);', re.I)
+# Entities whose round trip through BeautifulSoup is the identity
+_NON_BASIC_ENTITY_RE = re.compile(r'&(?!amp;|lt;|gt;)')
+_TAG_RE = re.compile(r'<[^>]*>')
+# Whitespace-only text between tags, outside <pre> (which is matched and kept)
+_WHITESPACE_RUN_RE = re.compile(r'(<pre(?:\s[^>]*)?>.*?</pre>)|(?<=>)([ \t\n\r\f]+)(?=<)', re.S)
+# Tags Pygments/CodeHilite emit for a highlighted block
+_CODEHILITE_TAG_RE = re.compile(r'</?(?:div|pre|code|span)(?: class="[\w -]*")?>')
+
+
+def _collapse_whitespace_runs(html: str) -> str:
+    """
+    BeautifulSoup stores whitespace-only strings outside <pre> as a single
+    newline (or space, if there was no newline). Stash fragments can leave
+    runs like "\n\n" between blocks that only show up after Markdown's
+    postprocessors, so this runs on the final string.
+    """
+    def collapse(match):
+        if match.group(1):
+            return match.group(1)
+        return '\n' if '\n' in match.group(2) else ' '
+
+    return _WHITESPACE_RUN_RE.sub(collapse, html)
+
+
+class ReferenceRenderRequired(Exception):
+    """The document uses markup only the reference renderer reproduces exactly."""
+
+
+@lru_cache(maxsize=1024)
+def _normalize_entity(entity: str) -> str:
+    """An entity as BeautifulSoup would re-serialize it."""
+    return str(BeautifulSoup(entity, 'html.parser'))
+
 
+def _normalize_codehilite(fragment: str) -> str:
+    """
+    Pygments escapes quotes as &quot;/&#39;, which BeautifulSoup writes back
+    as literal characters; everything else in its output round-trips as is.
+    """
+    if _NON_BASIC_ENTITY_RE.search(fragment.replace('&quot;', '').replace('&#39;', '')):
+        raise ReferenceRenderRequired('unexpected entity in highlighted code')
+    if '<' in _CODEHILITE_TAG_RE.sub('', fragment):
+        raise ReferenceRenderRequired('unexpected markup in highlighted code')
+    return fragment.replace('&quot;', '"').replace('&#39;', "'")
+
+
+class SinglePassSerializer:
+    """
+    Markdown serializer that writes BeautifulSoup-normalized HTML, assigns
+    unique heading ids and collects the TOC in one walk of the element tree.
+    """
+
+    def __init__(self, md: markdown.Markdown):
+        self.md = md
+        self.toc = []
+        self.ids = HeadingIdAllocator()
+        # Stash entries that may appear inside a heading
+        self.inline_stash = set()
+        css_class = MARKDOWN_EXTENSION_CONFIGS['books.utils.highlighting:CachedCodeHiliteExtension']['css_class']
+        self.codehilite_prefixes = (f'<div class="{css_class}">', f'<pre class="{css_class}">')
+
+    def __call__(self, root) -> str:
+        if root is not self.md.parser.root:
+            # Extensions (e.g. toc building md.toc) serialize their own fragments
+            return to_xhtml_string(root)
+        self._normalize_stash()
+        parts = []
+        self._write(parts.append, root)
+        return ''.join(parts)
+
+    def _normalize_stash(self):
+        blocks = self.md.htmlStash.rawHtmlBlocks
+        for index, fragment in enumerate(blocks):
+            if not isinstance(fragment, str):
+                raise ReferenceRenderRequired('non-string stash entry')
+            if _ENTITY_RE.fullmatch(fragment):
+                html = _normalize_entity(fragment)
+                if STX in html or ETX in html:
+                    raise ReferenceRenderRequired('control character entity')
+                blocks[index] = html
+                self.inline_stash.add(index)
+            elif fragment.startswith(self.codehilite_prefixes):
+                blocks[index] = _normalize_codehilite(fragment)
+            else:
+                raise ReferenceRenderRequired('raw HTML')
+
+    def _write(self, write, elem):
+        tag = elem.tag
+        if not isinstance(tag, str) or tag != tag.lower():
+            raise ReferenceRenderRequired(f'unsupported element {tag!r}')
+        if tag in _VOID_TAGS and tag not in HTML_EMPTY:
+            raise ReferenceRenderRequired(f'void element {tag!r}')
+
+        attributes = sorted(elem.items())
+        if tag in HEADING_TAGS:
+            inner = []
+            self._write_content(inner.append, elem)
+            inner_html = ''.join(inner)
+            title = self._text_content(inner_html).strip()
+            if title:
+                heading_id = self.ids.allocate(title, len(self.toc))
+                attributes = self._with_id(attributes, heading_id)
+                self.toc.append({'id': heading_id, 'title': title, 'level': int(tag[1])})
+            write(self._start_tag(tag, attributes))
+            write(inner_html)
+            write(f'</{tag}>')
+        elif tag in HTML_EMPTY:
+            # Markdown never writes children of empty elements
+            write(self._start_tag(tag, attributes))
+        else:
+            write(self._start_tag(tag, attributes))
+            self._write_content(write, elem)
+            write(f'</{tag}>')
+
+        if elem.tail:
+            write(self._escape_text(elem.tail))
+
+    def _write_content(self, write, elem):
+        if elem.text:
+            write(self._escape_text(elem.text))
+        for child in elem:
+            self._write(write, child)
+
+    @staticmethod
+    def _with_id(attributes, heading_id):
+        # BeautifulSoup keeps an existing attribute in place and appends new ones
+        if any(key == 'id' for key, _ in attributes):
+            return [(key, heading_id if key == 'id' else value) for key, value in attributes]
+        return attributes + [('id', heading_id)]
+
+    def _start_tag(self, tag, attributes) -> str:
+        parts = ['<', tag]
+        for key, value in attributes:
+            parts.append(self._attribute(tag, key, value))
+        parts.append('/>' if tag in HTML_EMPTY else '>')
+        return ''.join(parts)
+
+    @staticmethod
+    def _attribute(tag, key, value) -> str:
+        if not isinstance(key, str) or not isinstance(value, str) or key != key.lower():
+            raise ReferenceRenderRequired('unsupported attribute')
+        if STX in value or ETX in value or ('&' in value and _ENTITY_RE.search(value)):
+            raise ReferenceRenderRequired('entity in attribute')
+        if key in _LIST_ATTRIBUTES['*'] or key in _LIST_ATTRIBUTES.get(tag, ()):
+            if ' '.join(value.split()) != value:
+                raise ReferenceRenderRequired('non-canonical list attribute')
+        value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        quote = '"'
+        if '"' in value:
+            if "'" in value:
+                value = value.replace('"', '&quot;')
+            else:
+                quote = "'"
+        return f' {key}={quote}{value}{quote}'
+
+    def _escape_text(self, text) -> str:
+        if STX in text or ETX in text:
+            for match in _STASH_PLACEHOLDER_RE.finditer(text):
+                if int(match.group(1)) >= len(self.md.htmlStash.rawHtmlBlocks):
+                    raise ReferenceRenderRequired('unknown placeholder')
+            remainder = _STASH_PLACEHOLDER_RE.sub('', text)
+            if STX in remainder or ETX in remainder:
+                raise ReferenceRenderRequired('substituted ampersand')
+        escaped = _escape_cdata(text)
+        if '&' in escaped and _NON_BASIC_ENTITY_RE.search(escaped):
+            raise ReferenceRenderRequired('entity in text')
+        return escaped
+
+    def _text_content(self, html: str) -> str:
+        """Equivalent of BeautifulSoup's get_text() for serialized inline HTML."""
+        def stash_html(match):
+            index = int(match.group(1))
+            if index not in self.inline_stash:
+                raise ReferenceRenderRequired('block HTML in heading')
+            return self.md.htmlStash.rawHtmlBlocks[index]
+
+        html = _collapse_whitespace_runs(_STASH_PLACEHOLDER_RE.sub(stash_html, html))
+        text = _TAG_RE.sub('', html)
+        return text.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')
+
+
+def render_markdown_single_pass(markdown_text: str) -> Optional[Dict[str, any]]:
+    """
+    Render markdown to HTML and TOC in a single pass over Markdown's element
+    tree, without re-parsing the output.
+
+    Returns:
+        The same {'html', 'toc'} as render_markdown_reference(), or None if
+        the document needs the reference renderer.
+    """
+    md = create_markdown()
+    serializer = SinglePassSerializer(md)
+    md.serializer = serializer
+    try:
+        html = md.convert(markdown_text)
+    except ReferenceRenderRequired:
+        return None
+    return {'html': _collapse_whitespace_runs(html), 'toc': serializer.toc}
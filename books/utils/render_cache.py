@@ -0,0 +1,125 @@
+"""
+Memoizing cache for rendered markdown.
+
+Entries are keyed by a content hash, so a cached value never goes stale: a
+changed document (or a changed renderer configuration) simply hashes to a new
+key and the old entry ages out of the LRU.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class RenderCache:
+    """
+    Bounded in-process LRU with an optional second tier in Django's cache.
+
+    The LRU is bounded by an approximate byte budget rather than an entry
+    count, since a single book can be several megabytes of HTML.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        sizeof: Callable[[Any], int],
+        prefix: str = 'render',
+        cache_alias: Optional[str] = None,
+        timeout: Optional[int] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.prefix = prefix
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_hits = 0
+
+    @classmethod
+    def from_settings(cls, setting_name: str, sizeof: Callable[[Any], int], prefix: str) -> 'RenderCache':
+        """Build a cache from a settings dict such as MARKDOWN_RENDER_CACHE."""
+        config = getattr(settings, setting_name, {})
+        return cls(
+            max_bytes=config.get('MAX_BYTES', 32 * 1024 * 1024),
+            sizeof=sizeof,
+            prefix=prefix,
+            cache_alias=config.get('CACHE_ALIAS'),
+            timeout=config.get('TIMEOUT'),
+        )
+
+    def _shared_key(self, key: str) -> str:
+        return f'{self.prefix}:{key}'
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value[0]
+
+        if self.cache_alias:
+            value = caches[self.cache_alias].get(self._shared_key(key))
+            if value is not None:
+                self.shared_hits += 1
+                self._store_local(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        self._store_local(key, value)
+        if self.cache_alias:
+            caches[self.cache_alias].set(self._shared_key(key), value, self.timeout)
+
+    def get_or_render(self, key: str, render: Callable[[], Any]) -> Any:
+        """Return the cached value for key, calling render() on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value)
+        return value
+
+    def _store_local(self, key: str, value: Any) -> None:
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            # Never let one oversized document flush the whole LRU
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every in-process entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = self.shared_hits = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
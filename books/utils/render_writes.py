@@ -0,0 +1,27 @@
+"""
+Bulk writes of the rendered columns (rerender_content, render_catalog).
+
+bulk_update() skips save() and the signals that bump a book's version on
+content changes, so re-rendered books (and the books of re-rendered
+chapters) are touched here; otherwise conditional GETs would keep
+answering 304 for the old HTML after a renderer change. Re-rendered
+chapters are also re-indexed for search, whose documents hold their text.
+"""
+from typing import List
+
+from ..models import Book, Chapter
+from ..search import index_chapters
+from .rendering import RENDERED_FIELDS
+
+
+def save_rendered(model, objs: List) -> None:
+    """Write the RENDERED_FIELDS of objs (Books or Chapters), bump their books' versions and reindex chapters."""
+    if not objs:
+        return
+    model.objects.bulk_update(objs, RENDERED_FIELDS)
+    pks = [obj.pk for obj in objs]
+    if model is Chapter:
+        Book.touch(Chapter.objects.filter(pk__in=pks).values_list('book_id', flat=True))
+        index_chapters(pks)
+    else:
+        Book.touch(pks)
@@ -0,0 +1,107 @@
+"""
+Render-on-save pipeline for markdown content.
+
+Book and Chapter store their rendered HTML, TOC and the content hash that
+produced them next to markdown_content, so read endpoints can serve the
+stored columns instead of converting markdown on every request.
+"""
+import re
+from typing import Dict, List
+from .markdown_processor import process_markdown, content_hash
+from .sections import build_section_index
+from .incremental import render_markdown_incremental
+
+RENDERED_FIELDS = ('rendered_html', 'rendered_toc', 'rendered_sections', 'content_hash')
+
+# Words, keeping contractions and hyphenated words whole; markdown syntax
+# characters are not word characters, so source text counts like prose
+WORD_RE = re.compile(r"\w+(?:['’-]\w+)*")
+
+
+def count_words(text: str) -> int:
+    return len(WORD_RE.findall(text or ''))
+
+
+def source_hash(obj) -> str:
+    """Content hash for obj.markdown_content, or '' when there is no source."""
+    source = obj.markdown_content or ''
+    if not source.strip():
+        return ''
+    return content_hash(source)
+
+
+def needs_render(obj) -> bool:
+    """Whether obj's rendered columns are missing or out of date."""
+    return source_hash(obj) != obj.content_hash or bool(obj.rendered_html and not obj.rendered_sections)
+
+
+def render_fields(markdown_text: str) -> Dict[str, any]:
+    """
+    Render markdown into values for RENDERED_FIELDS.
+
+    Takes and returns plain data only, so it can run in a worker process.
+    Blocks that didn't change since the last render come from the render
+    cache (see utils.incremental).
+    """
+    result = render_markdown_incremental(markdown_text or '')
+    return {
+        'rendered_html': result['html'],
+        'rendered_toc': result['toc'],
+        'rendered_sections': build_section_index(result['html'], result['toc']),
+        'content_hash': content_hash(markdown_text) if markdown_text and markdown_text.strip() else '',
+    }
+
+
+def apply_rendered_fields(obj, fields: Dict[str, any]) -> None:
+    for name in RENDERED_FIELDS:
+        setattr(obj, name, fields[name])
+
+
+def refresh_rendered_content(obj, force: bool = False) -> bool:
+    """
+    Re-render obj.markdown_content into the rendered_* columns.
+
+    Only renders when the source (or renderer configuration) changed since
+    the last render, unless force is set. Does not save obj.
+
+    Returns:
+        True if the rendered columns were updated.
+    """
+    if not force and not needs_render(obj):
+        return False
+    apply_rendered_fields(obj, render_fields(obj.markdown_content))
+    return True
+
+
+def get_rendered(obj) -> Dict[str, any]:
+    """
+    Rendered {'html', 'toc'} for obj, read from the stored columns.
+
+    Rows saved before the columns existed (no content_hash yet) are rendered
+    on the fly until rerender_content backfills them.
+    """
+    if obj.markdown_content and not obj.content_hash:
+        return process_markdown(obj.markdown_content)
+    return {'html': obj.rendered_html or '', 'toc': obj.rendered_toc or []}
+
+
+def get_rendered_html(obj) -> str:
+    """obj's rendered HTML, like get_rendered but without reading rendered_toc."""
+    if obj.markdown_content and not obj.content_hash:
+        return process_markdown(obj.markdown_content)['html']
+    return obj.rendered_html or ''
+
+
+def get_rendered_toc(obj) -> List[Dict]:
+    """obj's rendered TOC, like get_rendered but without reading rendered_html."""
+    if obj.markdown_content and not obj.content_hash:
+        return process_markdown(obj.markdown_content)['toc']
+    return obj.rendered_toc or []
+
+
+def get_sections(obj) -> List[Dict]:
+    """Section index of obj's rendered HTML (see utils.sections)."""
+    if obj.content_hash and obj.rendered_sections:
+        return obj.rendered_sections
+    rendered = get_rendered(obj)
+    return build_section_index(rendered['html'], rendered['toc'])
@@ -0,0 +1,88 @@
+"""
+Section index for rendered book HTML.
+
+A rendered book is split at its top-level h1/h2 headings into sections
+addressed by the heading's anchor id. Offsets are character offsets into the
+rendered HTML, so a section can be sliced out by the database with SUBSTR
+instead of loading the whole document.
+"""
+import re
+from typing import Dict, Iterator, List, Optional
+
+from django.db.models.functions import Substr
+
+# Anchor of the content before the first heading. slugify() strips leading
+# underscores, so no heading id can collide with it.
+INTRO_ANCHOR = '_intro'
+
+# Container tags whose contents are not top-level, and candidate headings.
+# Text and attribute values in rendered HTML always have '<' escaped, so a
+# tag-level scan is safe.
+_SCAN_RE = re.compile(
+    r'<(/?)(blockquote|ul|ol|div|table|pre|details)[\s>]'
+    r'|<h([12])(?:\s[^>]*?)?\sid="([^"]*)"'
+)
+
+
+def build_section_index(html: str, toc: List[Dict]) -> List[Dict]:
+    """
+    Split rendered HTML at top-level h1/h2 headings.
+
+    Returns:
+        List of {'id', 'title', 'level', 'start', 'end'} dicts in document
+        order, covering the whole of html.
+    """
+    if not html:
+        return []
+
+    titles = {entry['id']: entry['title'] for entry in toc}
+    starts = []
+    depth = 0
+    for match in _SCAN_RE.finditer(html):
+        if match.group(2):
+            depth += -1 if match.group(1) else 1
+        elif depth == 0 and match.group(4) in titles:
+            starts.append((match.start(), match.group(4), int(match.group(3))))
+
+    sections = []
+    if not starts or starts[0][0] > 0:
+        end = starts[0][0] if starts else len(html)
+        if html[:end].strip():
+            sections.append({'id': INTRO_ANCHOR, 'title': '', 'level': 0, 'start': 0, 'end': end})
+        elif starts:
+            # Only whitespace before the first heading: fold it into that section
+            starts[0] = (0,) + starts[0][1:]
+
+    for index, (start, anchor, level) in enumerate(starts):
+        end = starts[index + 1][0] if index + 1 < len(starts) else len(html)
+        sections.append({'id': anchor, 'title': titles[anchor], 'level': level, 'start': start, 'end': end})
+    return sections
+
+
+def find_section(sections: List[Dict], anchor: str) -> Optional[Dict]:
+    for section in sections:
+        if section['id'] == anchor:
+            return section
+    return None
+
+
+def load_html_slice(obj, start: int, end: int) -> str:
+    """Fetch obj.rendered_html[start:end], sliced by the database."""
+    return type(obj).objects.filter(pk=obj.pk).annotate(
+        html_slice=Substr('rendered_html', start + 1, end - start),
+    ).values_list('html_slice', flat=True).get() or ''
+
+
+def load_section_html(obj, section: Dict) -> str:
+    """Fetch one section of obj.rendered_html."""
+    return load_html_slice(obj, section['start'], section['end'])
+
+
+def iter_section_html(obj, sections: List[Dict], chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """
+    Yield obj.rendered_html section by section, in slices of at most
+    chunk_size characters, without loading the whole document.
+    """
+    for section in sections:
+        for start in range(section['start'], section['end'], chunk_size):
+            yield load_html_slice(obj, start, min(start + chunk_size, section['end']))
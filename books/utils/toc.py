@@ -0,0 +1,59 @@
+"""
+Manual table of contents (TableOfContentEntry) assembly.
+
+Entries are grouped by parent_id in one pass and the numbered tree
+(1, 1.1, 1.2.1, ...) is built from the groups, so assembly is O(n) and
+never touches entry.parent. The tree is cached per book in the shared
+cache (MANUAL_TOC_CACHE); every TOC entry write bumps the book's version
+(books.signals).
+"""
+from typing import Dict, Iterable, List
+
+from ..models import TableOfContentEntry
+from .tree_paths import group_children
+from .versioned_cache import VersionedCache
+
+toc_cache = VersionedCache('manual-toc', 'MANUAL_TOC_CACHE')
+
+
+def build_manual_toc(entries: Iterable[TableOfContentEntry]) -> List[Dict]:
+    """
+    Build the hierarchical, numbered TOC of a book's entries.
+
+    Siblings are ordered by (order, id). Entries whose parent isn't among
+    entries are left out, as are their descendants.
+    """
+    children = group_children(entries)
+
+    def build_tree(parent_id, parent_number):
+        toc_list = []
+        for index, entry in enumerate(children.get(parent_id, ()), start=1):
+            # Display number: 1, 1.1, 1.2.1, ...
+            number = f'{parent_number}.{index}' if parent_number else str(index)
+            toc_entry = {
+                'id': entry.anchor_id or f'toc-entry-{entry.id}',
+                'title': entry.title,
+                'level': entry.level,
+                'number': number,
+            }
+            if entry.id in children:
+                toc_entry['children'] = build_tree(entry.id, number)
+            toc_list.append(toc_entry)
+        return toc_list
+
+    return build_tree(None, '')
+
+
+def get_manual_toc(book_id: int) -> List[Dict]:
+    """Cached manual TOC of a book; empty if it has no TOC entries."""
+    def build():
+        entries = TableOfContentEntry.objects.filter(book_id=book_id).only(
+            'id', 'parent_id', 'title', 'level', 'order', 'anchor_id',
+        )
+        return build_manual_toc(entries)
+
+    return toc_cache.get_or_build(book_id, build)
+
+
+def invalidate_manual_toc(book_ids: Iterable[int]) -> None:
+    toc_cache.invalidate(book_ids)
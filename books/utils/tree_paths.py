@@ -0,0 +1,44 @@
+"""
+Helpers for the book hierarchies (TableOfContentEntry, BookContent).
+
+Nodes keep an adjacency list (parent) plus a materialized path: the ids of
+their ancestors and themselves, each as PATH_STEP base-36 digits, so
+'00000a00000f' is node 15 under root 10. A subtree is then a prefix match on
+an indexed column, and moving a branch rewrites its paths in one UPDATE.
+"""
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, Iterator, List
+
+PATH_STEP = 6
+PATH_MAX_LENGTH = 255
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_segment(pk: int) -> str:
+    """pk as PATH_STEP base-36 digits (sorts like the number)."""
+    digits, rest = '', pk
+    while rest:
+        rest, digit = divmod(rest, 36)
+        digits = PATH_DIGITS[digit] + digits
+    if len(digits) > PATH_STEP:
+        raise ValueError(f'id {pk} does not fit in a tree path segment')
+    return digits.rjust(PATH_STEP, '0')
+
+
+def group_children(nodes: Iterable) -> Dict[Hashable, List]:
+    """parent_id -> child nodes ordered by (order, id)."""
+    children = defaultdict(list)
+    for node in nodes:
+        children[node.parent_id].append(node)
+    for siblings in children.values():
+        siblings.sort(key=lambda node: (node.order, node.id))
+    return dict(children)
+
+
+def iter_preorder(children: Dict[Hashable, List], parent_id) -> Iterator:
+    """Descendants of parent_id in display order (each node before its children)."""
+    stack = list(reversed(children.get(parent_id, ())))
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(children.get(node.id, ())))
@@ -0,0 +1,85 @@
+"""
+Per-object cache entries invalidated by bumping a version number.
+
+Each scope (a user, a book, ...) has a version token in the cache, and
+values are stored under a key that includes it. Invalidation only replaces
+the token, so an entry computed from data that went stale while it was being
+built is written under an old key and never read. Tokens are random rather
+than counters: a version key lost to eviction or a cache restart gets a
+fresh token instead of restarting at 1 and reviving old entries.
+
+Invalidation only reaches other worker processes through a shared cache
+(CACHES, e.g. Redis). With a process-local backend (LocMemCache, the
+default without CACHES) values are cached for LOCAL_TIMEOUT seconds of the
+cache's settings (default TIMEOUT), and not at all when it is None.
+"""
+from typing import Any, Callable, Iterable
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+
+class VersionedCache:
+    def __init__(self, prefix: str, setting_name: str, default_timeout: int = 60 * 60 * 24):
+        self.prefix = prefix
+        self.setting_name = setting_name
+        self.default_timeout = default_timeout
+
+    @property
+    def config(self) -> dict:
+        return getattr(settings, self.setting_name, {})
+
+    @property
+    def cache(self):
+        return caches[self.config.get('CACHE_ALIAS', 'default')]
+
+    @property
+    def is_shared(self) -> bool:
+        """Whether every worker process sees this cache (and its invalidations)."""
+        return not isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def _version_key(self, scope) -> str:
+        return f'{self.prefix}-version:{scope}'
+
+    def get_or_build(self, scope, build: Callable[[], Any]) -> Any:
+        """Cached value for scope, calling build() on a miss."""
+        timeout = self.config.get('TIMEOUT', self.default_timeout)
+        if not self.is_shared:
+            timeout = self.config.get('LOCAL_TIMEOUT', timeout)
+            if timeout is None:
+                return build()
+        cache = self.cache
+        version_key = self._version_key(scope)
+        version = cache.get(version_key)
+        if version is None:
+            # add() keeps the token of a concurrent request that got here first
+            token = uuid4().hex
+            cache.add(version_key, token, timeout=None)
+            version = cache.get(version_key) or token
+        key = f'{self.prefix}:{scope}:{version}'
+        value = cache.get(key)
+        if value is None:
+            value = build()
+            cache.set(key, value, timeout=timeout)
+        return value
+
+    def _bump(self, scopes) -> None:
+        self.cache.set_many({self._version_key(scope): uuid4().hex for scope in scopes}, timeout=None)
+
+    def invalidate(self, scopes: Iterable) -> None:
+        """
+        Drop the cached values of scopes.
+
+        Bumps now, so the change is visible inside the current transaction,
+        and again on commit, in case another request cached the pre-commit
+        rows in between.
+        """
+        scopes = set(scopes)
+        if not scopes:
+            return
+        self._bump(scopes)
+        transaction.on_commit(lambda: self._bump(scopes))
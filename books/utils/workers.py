@@ -0,0 +1,30 @@
+"""
+Process pools for management commands (render_catalog).
+
+Workers are spawned rather than forked, so they never share the parent's
+database connections or open cursors, and they set up Django themselves.
+This module must not import models: it is imported in fresh workers before
+django.setup().
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections
+
+
+def init_worker() -> None:
+    django.setup()
+    # Workers only render; drop any connection a setup hook may have opened
+    connections.close_all()
+
+
+def worker_pool(workers: int) -> ProcessPoolExecutor:
+    """Pool of worker processes ready to run Django code."""
+    # Nothing for the workers to inherit, whatever the start method
+    connections.close_all()
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+    )
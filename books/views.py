@@ -1,16 +1,40 @@
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.db.models import DateTimeField, F, Value
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Book, BookAccess
-from .serializers import BookListSerializer, BookDetailSerializer
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_header_parameters
+from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from rest_framework.utils.encoders import JSONEncoder
+from .models import Book, Chapter
+from .serializers import (
+    HEAVY_COLUMNS, BookListSerializer, BookDetailSerializer, ChapterSerializer, PurchasedBookSerializer,
+    SearchResultSerializer,
+)
+from .entitlements import BOOK_LOCKED, BOOK_NOT_FOUND, BOOK_UNPUBLISHED, get_readable_book, has_book_access
+from .fieldsets import FieldSelection, SparseFieldsetViewMixin
 from .permissions import IsNotBlocked
-from .utils.markdown_processor import process_markdown
+from .search import search_documents
+from .utils.book_versions import ADMIN, BOOK_CACHE_CONTROL, LOCKED, UNLOCKED, get_book_version
+from .utils.highlighting import highlight_stylesheet
+from .utils.loaders import get_loader
+from .utils.http import is_not_modified, set_validators
+from .utils.rendering import get_rendered, get_sections
+from .utils.toc import get_manual_toc
+from .utils.sections import find_section, load_section_html, iter_section_html
+import hashlib
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
-class BookListCreateView(generics.ListAPIView):
+class BookListCreateView(SparseFieldsetViewMixin, generics.ListAPIView):
     serializer_class = BookListSerializer
     permission_classes = [permissions.IsAuthenticated, IsNotBlocked]
     
@@ -18,188 +42,390 @@ class BookListCreateView(generics.ListAPIView):
         # Admins (staff + superuser) can see all books (including unpublished), regular users only published
         user = self.request.user
         if user.is_staff and user.is_superuser:
-            return Book.objects.all()
-        return Book.objects.filter(is_published=True)
+            return self.only_selected(Book.objects.all())
+        return self.only_selected(Book.objects.filter(is_published=True))
 
 
-class BookDetailView(generics.RetrieveAPIView):
+class ConditionalBookMixin:
+    """
+    Conditional GET for book endpoints: ETag/Last-Modified from the book's
+    version and the user's entitlement (books.utils.book_versions), and 304
+    before the book is loaded or serialized when the client is up to date.
+    """
+    # Read/content endpoints only validate for users allowed to read the
+    # book; the detail endpoint also serves locked users (preview chapters)
+    requires_access = True
+
+    def get_book_version(self, request, pk):
+        """BookVersion for the request, or None to let the view answer (404/403...) as usual."""
+        version = get_book_version(request.user, pk)
+        if version is None or version.access == ADMIN:
+            return version
+        if not version.is_published or (self.requires_access and version.access == LOCKED):
+            return None
+        return version
+
+    def check_not_modified(self, request, pk, variant):
+        """
+        Returns:
+            (validators, response): response is a 304 when the client's copy
+            is current, else None; validators is None when not validating.
+        """
+        version = self.book_version = self.get_book_version(request, pk)
+        if version is None:
+            return None, None
+        # The representation also depends on the renderer, the selected
+        # fields (books.fieldsets) and, through absolute media URLs, the host
+        variant = ':'.join((variant, request.accepted_renderer.format, request.get_host(),
+                            request.META.get('QUERY_STRING', '')))
+        validators = (version.etag(variant), version.last_modified)
+        if is_not_modified(request, *validators):
+            return validators, set_validators(HttpResponseNotModified(), *validators, **BOOK_CACHE_CONTROL)
+        return validators, None
+
+    def get_loader_context(self, context):
+        """context with its BatchLoader told the entitlement the version query already read."""
+        version = getattr(self, 'book_version', None)
+        if version is not None and version.access != ADMIN:
+            get_loader(context).seed('unlocked_book', {version.book_id: version.access == UNLOCKED})
+        return context
+
+    def add_validators(self, response, validators):
+        if validators is not None and response.status_code == 200:
+            set_validators(response, *validators, **BOOK_CACHE_CONTROL)
+        return response
+
+
+class BookDetailView(ConditionalBookMixin, SparseFieldsetViewMixin, generics.RetrieveAPIView):
     serializer_class = BookDetailSerializer
     permission_classes = [permissions.IsAuthenticated, IsNotBlocked]
+    requires_access = False
     
     def get_queryset(self):
         # Admins (staff + superuser) can see all books (including unpublished), regular users only published
         user = self.request.user
         if user.is_staff and user.is_superuser:
-            return Book.objects.all()
-        return Book.objects.filter(is_published=True)
+            return self.defer_unselected(Book.objects.all())
+        return self.defer_unselected(Book.objects.filter(is_published=True))
     
+    def get_serializer_context(self):
+        return self.get_loader_context(super().get_serializer_context())
     
+    def retrieve(self, request, *args, **kwargs):
+        validators, not_modified = self.check_not_modified(request, kwargs['pk'], 'detail')
+        if not_modified:
+            return not_modified
+        return self.add_validators(super().retrieve(request, *args, **kwargs), validators)
+
+
+
+class BookContentAccessMixin:
+    """Entitlement checks and TOC assembly shared by the book content views."""
+
+    # get_readable_book refusal -> (status, detail)
+    READ_ERRORS = {
+        BOOK_NOT_FOUND: (404, 'Book not found'),
+        BOOK_UNPUBLISHED: (404, 'This book is not available.'),
+        BOOK_LOCKED: (403, 'Access denied: this book is locked.'),
+    }
+
+    def get_readable_book(self, request, pk, queryset=None):
+        """
+        Fetch the book and check the user may read its full content, in one
+        query (books.entitlements.get_readable_book). Blocked users are
+        already turned away by IsNotBlocked.
+
+        Returns:
+            (book, None) when access is granted, otherwise (None, error Response).
+        """
+        book, refusal = get_readable_book(request.user, pk, queryset)
+        if refusal:
+            logger.warning(f"User {request.user.id} refused book {pk}: {refusal}")
+            status_code, detail = self.READ_ERRORS[refusal]
+            return None, Response({'detail': detail}, status=status_code)
+        return book, None
 
-class BookReadView(APIView):
+    def get_book_toc(self, book, rendered_toc):
+        """TOC from manual entries, falling back to the one extracted from markdown."""
+        # Manual TOC with hierarchical numbering, cached per book
+        return get_manual_toc(book.pk) or rendered_toc
+
+
+class BookReadView(ConditionalBookMixin, BookContentAccessMixin, SparseFieldsetViewMixin, APIView):
     permission_classes = [permissions.IsAuthenticated, IsNotBlocked]
 
     def get(self, request, pk):
+        validators, not_modified = self.check_not_modified(request, pk, 'read')
+        if not_modified:
+            return not_modified
+
+        book, error = self.get_readable_book(
+            request, pk, self.defer_unselected(Book.objects.all(), BookDetailSerializer),
+        )
+        if error:
+            return error
+
+        context = self.get_loader_context({'request': request})
+        if hasattr(book, 'has_access'):
+            # The entitlement was checked with the book
+            get_loader(context).seed('unlocked_book', {book.pk: book.has_access})
+        serializer = BookDetailSerializer(book, context=context)
+        logger.info(f"User {request.user.id} granted access to book {pk}")
+        return self.add_validators(Response({
+            'message': f"You are reading '{book.title}'",
+            'book': serializer.data
+        }, status=200), validators)
+
+
+class BookChapterView(ConditionalBookMixin, APIView):
+    """
+    One chapter with its rendered content, for reading chapter by chapter:
+    GET /books/<id>/chapters/<chapter_id>/ (supports ?fields= / ?omit=).
+
+    Preview chapters of published books are open to every user; other
+    chapters need access to the book.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsNotBlocked]
+
+    def get(self, request, pk, chapter_id):
         user = request.user
-        
-        # Check if user is blocked (should be caught by IsNotBlocked, but double-check)
-        if user.is_blocked:
-            logger.warning(f"Blocked user {user.id} attempted to access book {pk}")
-            return Response({'detail': 'Your account is blocked.'}, status=403)
-        
-        try:
-            book = Book.objects.get(pk=pk)
-        except Book.DoesNotExist:
-            logger.warning(f"Book {pk} not found for user {user.id}")
-            return Response({'detail': 'Book not found'}, status=404)
-
-        # Admins (staff + superuser) can access all books, including unpublished ones
+        validators, not_modified = self.check_not_modified(request, pk, f'chapter-{chapter_id}')
+        if not_modified:
+            return not_modified
+
+        selection = FieldSelection.from_request(request)
+        chapter = Chapter.objects.select_related('book').defer(
+            *ChapterSerializer.deferred_columns(selection),
+            *(f'book__{column}' for column in ('description',) + HEAVY_COLUMNS),
+        ).filter(pk=chapter_id, book_id=pk).first()
+        if chapter is None:
+            return Response({'detail': 'Chapter not found'}, status=404)
+
         is_admin = user.is_staff and user.is_superuser
         if not is_admin:
-            # Check if book is published (only for non-admins)
-            if not book.is_published:
-                logger.warning(f"User {user.id} attempted to access unpublished book {pk}")
+            if not chapter.book.is_published:
                 return Response({'detail': 'This book is not available.'}, status=404)
+            if not chapter.is_preview and not has_book_access(user, pk):
+                logger.warning(f"User {user.id} denied access to chapter {chapter_id} of book {pk}")
+                return Response({'detail': 'Access denied: this chapter is locked.'}, status=403)
+
+        serializer = ChapterSerializer(chapter, context={'request': request}, selection=selection)
+        return self.add_validators(Response(serializer.data, status=200), validators)
+
+
+class BookContentView(ConditionalBookMixin, BookContentAccessMixin, APIView):
+    """
+    Get book content with HTML and TOC generated from markdown.
+    GET /api/books/<id>/content/ - Returns {id, title, html, toc}
 
-            # Access logic: unlocked only if a BookAccess exists for this user-book
-            # Use select_related for better performance and ensure exact match
-            has_access = BookAccess.objects.filter(
-                user=user,
-                book=book
-            ).exists()
+    With ?stream=1 (or "Accept: application/json; stream=true") the same
+    JSON document is streamed: metadata and TOC first, then the HTML in
+    chunks read section by section from the database.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsNotBlocked]
 
-            logger.info(f"User {user.id} access check for book {pk}: {has_access}")
+    def get(self, request, pk):
+        stream = self.wants_stream(request)
+        validators, not_modified = self.check_not_modified(request, pk, 'content-stream' if stream else 'content')
+        if not_modified:
+            return not_modified
+        if stream:
+            return self.add_validators(self.stream(request, pk), validators)
 
-            if not has_access:
-                logger.warning(f"User {user.id} denied access to book {pk} - no BookAccess record")
-                return Response({'detail': 'Access denied: this book is locked.'}, status=403)
+        book, error = self.get_readable_book(request, pk)
+        if error:
+            return error
+
+        # Rendered markdown is stored on the book when it is saved
+        rendered = get_rendered(book) if book.markdown_content else {'html': '', 'toc': []}
+        toc = self.get_book_toc(book, rendered['toc'])
+
+        logger.info(f"User {request.user.id} granted access to book content {pk}")
+        return self.add_validators(Response({
+            'id': book.id,
+            'title': book.title,
+            'html': rendered['html'],
+            'toc': toc,
+            'toc_position': book.toc_position
+        }, status=200), validators)
+
+    @staticmethod
+    def wants_stream(request):
+        if request.query_params.get('stream') in ('1', 'true'):
+            return True
+        _, params = parse_header_parameters(request.accepted_media_type or '')
+        return params.get('stream') == 'true'
+
+    def stream(self, request, pk):
+        book, error = self.get_readable_book(
+            request, pk, Book.objects.defer('rendered_html', 'markdown_content', 'content'),
+        )
+        if error:
+            return error
+
+        rendered_toc = book.rendered_toc if book.content_hash else get_rendered(book)['toc']
+        head = {
+            'id': book.id,
+            'title': book.title,
+            'toc': self.get_book_toc(book, rendered_toc),
+            'toc_position': book.toc_position,
+        }
+        if book.content_hash and book.rendered_sections:
+            chunks = iter_section_html(book, book.rendered_sections)
         else:
-            logger.info(f"Admin {user.id} (staff: {user.is_staff}, superuser: {user.is_superuser}) granted access to book {pk}")
+            chunks = iter([get_rendered(book)['html']])
 
-        serializer = BookDetailSerializer(book, context={'request': request})
-        logger.info(f"User {user.id} granted access to book {pk}")
-        return Response({
-            'message': f"You are reading '{book.title}'",
-            'book': serializer.data
-        }, status=200)
+        logger.info(f"User {request.user.id} granted streamed access to book content {pk}")
+        response = StreamingHttpResponse(self._stream_json(head, chunks), content_type='application/json')
+        # Let reverse proxies pass chunks through instead of buffering them
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def _stream_json(head, html_chunks):
+        """Yield head + {'html': ''.join(html_chunks)} as one JSON document."""
+        def dumps(value):
+            return json.dumps(value, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
 
+        yield (dumps(head)[:-1] + ',"html":"').encode('utf-8')
+        for chunk in html_chunks:
+            if chunk:
+                yield dumps(chunk)[1:-1].encode('utf-8')
+        yield b'"}'
 
-class BookContentView(APIView):
+
+class BookContentSectionListView(BookContentAccessMixin, APIView):
     """
-    Get book content with HTML and TOC generated from markdown.
-    GET /api/books/<id>/content/ - Returns {id, title, html, toc}
+    TOC and section index of a book's rendered content.
+    GET /api/books/<id>/content/sections/ - Returns {id, title, toc, sections}
     """
     permission_classes = [permissions.IsAuthenticated, IsNotBlocked]
 
     def get(self, request, pk):
-        user = request.user
-        
-        # Check if user is blocked
-        if user.is_blocked:
-            logger.warning(f"Blocked user {user.id} attempted to access book content {pk}")
-            return Response({'detail': 'Your account is blocked.'}, status=403)
-        
-        try:
-            book = Book.objects.get(pk=pk)
-        except Book.DoesNotExist:
-            logger.warning(f"Book {pk} not found for user {user.id}")
-            return Response({'detail': 'Book not found'}, status=404)
-
-        # Admins (staff + superuser) can access all books, including unpublished ones
-        is_admin = user.is_staff and user.is_superuser
-        if not is_admin:
-            # Check if book is published (only for non-admins)
-            if not book.is_published:
-                logger.warning(f"User {user.id} attempted to access unpublished book {pk}")
-                return Response({'detail': 'This book is not available.'}, status=404)
+        book, error = self.get_readable_book(
+            request, pk, Book.objects.defer('rendered_html', 'markdown_content', 'content'),
+        )
+        if error:
+            return error
 
-            # Check access
-            has_access = BookAccess.objects.filter(
-                user=user,
-                book=book
-            ).exists()
+        rendered_toc = book.rendered_toc if book.content_hash else get_rendered(book)['toc']
+        sections = [
+            {'id': section['id'], 'title': section['title'], 'level': section['level'],
+             'length': section['end'] - section['start']}
+            for section in get_sections(book)
+        ]
+        return Response({
+            'id': book.id,
+            'title': book.title,
+            'toc': self.get_book_toc(book, rendered_toc),
+            'toc_position': book.toc_position,
+            'sections': sections,
+        }, status=200)
 
-            if not has_access:
-                logger.warning(f"User {user.id} denied access to book {pk} - no BookAccess record")
-                return Response({'detail': 'Access denied: this book is locked.'}, status=403)
-        else:
-            logger.info(f"Admin {user.id} (staff: {user.is_staff}, superuser: {user.is_superuser}) granted access to book content {pk}")
 
-        # Process markdown if available
-        if book.markdown_content:
-            result = process_markdown(book.markdown_content)
-            html = result.get('html', '')
-        else:
-            html = ''
-
-        # Get TOC from manual entries or markdown
-        from .models import TableOfContentEntry
-        
-        manual_entries = TableOfContentEntry.objects.filter(book=book).order_by('order', 'id')
-        if manual_entries.exists():
-            # Build manual TOC with hierarchical numbering
-            toc = self._build_manual_toc(list(manual_entries))
-        elif book.markdown_content:
-            result = process_markdown(book.markdown_content)
-            toc = result.get('toc', [])
+class BookContentSectionView(BookContentAccessMixin, APIView):
+    """
+    HTML of one section of a book, addressed by its heading anchor.
+    GET /api/books/<id>/content/sections/<anchor>/ - Returns {id, section, html, previous, next}
+    """
+    permission_classes = [permissions.IsAuthenticated, IsNotBlocked]
+
+    def get(self, request, pk, anchor):
+        book, error = self.get_readable_book(
+            request, pk, Book.objects.defer('rendered_html', 'markdown_content', 'content'),
+        )
+        if error:
+            return error
+
+        sections = get_sections(book)
+        section = find_section(sections, anchor)
+        if section is None:
+            return Response({'detail': 'Section not found'}, status=404)
+
+        if book.content_hash and book.rendered_sections:
+            html = load_section_html(book, section)
         else:
-            toc = []
+            html = get_rendered(book)['html'][section['start']:section['end']]
 
-        logger.info(f"User {user.id} granted access to book content {pk}")
+        index = sections.index(section)
         return Response({
             'id': book.id,
-            'title': book.title,
+            'section': {'id': section['id'], 'title': section['title'], 'level': section['level']},
             'html': html,
-            'toc': toc,
-            'toc_position': book.toc_position
+            'previous': sections[index - 1]['id'] if index > 0 else None,
+            'next': sections[index + 1]['id'] if index + 1 < len(sections) else None,
         }, status=200)
-    
-    def _build_manual_toc(self, entries):
-        """Build hierarchical TOC from manual entries with numbering"""
-        root_entries = [entry for entry in entries if entry.parent is None]
-        
-        def build_tree(entry_list, parent_number=""):
-            """Recursively build TOC tree with numbers"""
-            toc_list = []
-            for idx, entry in enumerate(entry_list):
-                # Calculate display number (1, 1.1, 1.2.1, etc.)
-                number = parent_number + str(idx + 1) if parent_number else str(idx + 1)
-                
-                # Get children
-                children = [e for e in entries if e.parent_id == entry.id]
-                
-                # Create TOC entry
-                toc_entry = {
-                    'id': entry.anchor_id or f'toc-entry-{entry.id}',
-                    'title': entry.title,
-                    'level': entry.level,
-                    'number': number,
-                }
-                
-                # Add children if any
-                if children:
-                    sorted_children = sorted(children, key=lambda e: e.order)
-                    toc_entry['children'] = build_tree(sorted_children, number + '.')
-                
-                toc_list.append(toc_entry)
-            
-            return toc_list
-        
-        # Sort root entries by order
-        sorted_roots = sorted(root_entries, key=lambda e: e.order)
-        return build_tree(sorted_roots)
-
-
-class UserPurchasedBooksView(APIView):
+
+
+class PurchasedBooksPagination(CursorPagination):
+    """Most recently unlocked first; stable under concurrent grants."""
+    ordering = ('-unlocked_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        user = request.user
+        # Admins list the whole catalog, which has no unlock date
+        if user.is_staff and user.is_superuser:
+            return ('-created_at', '-id')
+        return self.ordering
+
+
+class UserPurchasedBooksView(SparseFieldsetViewMixin, generics.ListAPIView):
     """List all books the current user has access to."""
+    serializer_class = PurchasedBookSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PurchasedBooksPagination
 
-    def get(self, request):
-        user = request.user
+    def get_queryset(self):
+        user = self.request.user
+        # created_at: the admins' pagination cursor
+        books = self.only_selected(Book.objects.all(), 'created_at')
         # Admins (staff + superuser) can see all books
         if user.is_staff and user.is_superuser:
-            books = Book.objects.all()
-        else:
-            accesses = BookAccess.objects.filter(user=user)
-            books = [access.book for access in accesses]
-        serializer = BookListSerializer(books, many=True, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+            return books.annotate(unlocked_at=Value(None, output_field=DateTimeField()))
+        # One join: each book with the date this user unlocked it
+        return books.filter(access_records__user=user).annotate(
+            unlocked_at=F('access_records__unlocked_at'),
+        )
+
+
+class BookSearchView(generics.ListAPIView):
+    """
+    Ranked full-text search over books and chapters: GET /books/search/?q=...
+
+    Only published books are searched (admins see all), and chapter text is
+    only searched in preview chapters and books the user has unlocked.
+    """
+    serializer_class = SearchResultSerializer
+    permission_classes = [permissions.IsAuthenticated, IsNotBlocked]
+
+    def get_query(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': ['This query parameter is required.']})
+        return query
+
+    def get_queryset(self):
+        return search_documents(self.get_query(), self.request.user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['query'] = self.request.query_params.get('q', '').strip()
+        return context
+
+
+def _stylesheet_etag(request):
+    return hashlib.sha256(highlight_stylesheet().encode('utf-8')).hexdigest()[:32]
+
+
+@method_decorator(cache_control(public=True, max_age=60 * 60 * 24), name='get')
+@method_decorator(condition(etag_func=_stylesheet_etag), name='get')
+class HighlightStylesheetView(View):
+    """
+    Stylesheet for highlighted code blocks (settings.MARKDOWN_CODEHILITE).
+
+    Public and cacheable: it's the same for every book, so rendered HTML only
+    carries short CSS class names.
+    """
+
+    def get(self, request):
+        return HttpResponse(highlight_stylesheet(), content_type='text/css; charset=utf-8')